@@ -1,7 +1,10 @@
 from django.contrib import admin
-from logger.models import UserData, Datum, Value
+from logger.models import UserData, Datum, Value, Rollup, Span, ValueChunk, IngestKey
 
 admin.site.register(UserData)
 admin.site.register(Datum)
 admin.site.register(Value)
-
+admin.site.register(Rollup)
+admin.site.register(Span)
+admin.site.register(ValueChunk)
+admin.site.register(IngestKey)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class LoggerConfig(AppConfig):
     name = 'logger'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,87 @@
+"""
+An ASGI application for the ingest endpoints, so slow or long lived device connections don't each hold a worker.
+
+It serves the routes of logger/ingest_app.py: the short ones under /-/, and the same routes as the WSGI site,
+GET /<slug>/<value> like log_value and POST /bulk/ like bulk_log_values. Everything else is answered with a 404, the
+rest of the site stays on WSGI. Connections are handled on the event loop, and the ORM work runs in a thread pool of
+LOGGER_ASGI_MAX_WORKERS threads, with at most as many requests waiting for it as LOGGER_ASGI_MAX_PENDING.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .ingest_app import HttpError, bulk_log_values, call, log_value, query_key, route
+
+
+class IngestApplication(object):
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = max_workers or settings.LOGGER_ASGI_MAX_WORKERS
+        self.max_pending = max_pending or settings.LOGGER_ASGI_MAX_PENDING
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if self.slots is None:  # created here so it belongs to the running loop
+            self.slots = asyncio.Semaphore(self.max_workers + self.max_pending)
+
+        content_type = "text/plain"
+        try:
+            match = route(scope['method'], scope['path'])
+            headers = dict(scope.get('headers', []))
+            if match.bulk:
+                body = await self.read_body(receive)
+                request_type = headers.get(b'content-type', b'').decode('latin-1').split(';')[0].strip()
+                status, text = await self.run(bulk_log_values, body, request_type)
+                content_type = "application/json"
+            else:
+                key = headers.get(b'idempotency-key')
+                if key is not None:
+                    key = key.decode('latin-1')
+                else:
+                    key = query_key(scope.get('query_string', b'').decode('latin-1'))
+                status, text = await self.run(log_value, match, key)
+        except HttpError as e:
+            status, text = e.status, str(e)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', "{}; charset=utf-8".format(content_type).encode('latin-1'))],
+        })
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+    async def run(self, function, *args):
+        if self.slots.locked():
+            raise HttpError(503, "too many pending requests")
+        async with self.slots:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, call, function, *args)
+
+    async def read_body(self, receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise HttpError(400, "client disconnected")
+            body += message.get('body', b'')
+            if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is not None and len(body) > settings.DATA_UPLOAD_MAX_MEMORY_SIZE:
+                raise HttpError(413, "request body too large")
+            if not message.get('more_body', False):
+                return body
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,278 @@
+"""
+Synthetic data and timed cases for `manage.py run_benchmarks`.
+
+`generate` fills the database with a user that has a datum of every type: numeric series sampled at a steady rate,
+a "work" TIMESTAMP datum punched like an office day, and a "dense" one punched every few minutes. The cases then
+time the hot paths through the test client or directly, and count their queries. Results are plain dicts, so they
+can be written as JSON and compared with the results of another commit.
+"""
+import datetime
+import random
+import statistics
+import time
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from .models import Datum, Span, Value
+from .rollups import NUMERIC_TYPES, rebuild_rollups
+from .spans import rebuild_spans
+from .timeline import WeekTimeline
+from .utils import monday_this_week
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+INSERT_BATCH_SIZE = 5000
+DENSE_DAYS = 28
+LOG_VALUE_REQUESTS = 200
+
+
+def synthetic_spans(datum, from_date, days, seed=0):
+    """A few working spans a day, with random start and end minutes so the cells have realistic styles."""
+    generator = random.Random(seed)
+    spans = []
+    for day_index in range(days):
+        start = datetime.datetime.combine(from_date + datetime.timedelta(days=day_index), datetime.time(7))
+        start += datetime.timedelta(minutes=generator.randint(0, 90))
+        for _ in range(3):
+            end = start + datetime.timedelta(minutes=generator.randint(20, 240))
+            if end.date() != start.date():
+                break
+            spans.append(Span(datum=datum, start=start, end=end))
+            start = end + datetime.timedelta(minutes=generator.randint(5, 60))
+    return spans
+
+
+def _work_punches(generator, day):
+    """An office day: in, out and back in around lunch, out in the evening. Weekends are mostly empty."""
+    midnight = datetime.datetime.combine(day, datetime.time())
+    if day.weekday() >= 5:
+        if generator.random() < 0.8:
+            return []
+        start = midnight + datetime.timedelta(hours=10, minutes=generator.randint(0, 120))
+        return [start, start + datetime.timedelta(minutes=generator.randint(30, 180))]
+
+    punches = [midnight + datetime.timedelta(hours=7, minutes=generator.randint(30, 120))]
+    punches.append(midnight + datetime.timedelta(hours=11, minutes=generator.randint(45, 90)))
+    punches.append(punches[-1] + datetime.timedelta(minutes=generator.randint(20, 60)))
+    punches.append(midnight + datetime.timedelta(hours=16, minutes=generator.randint(0, 150)))
+    return punches
+
+
+def _dense_punches(generator, day):
+    """Short spans every few minutes through the working hours."""
+    punch = datetime.datetime.combine(day, datetime.time(8))
+    end = punch.replace(hour=18)
+    punches = []
+    while punch < end:
+        punches.append(punch)
+        punch += datetime.timedelta(seconds=generator.randint(60, 300))
+    return punches[:len(punches) // 2 * 2]
+
+
+def _values(datum, generator, start, end, count):
+    """Yields `count` unsaved Values of `datum` between start and end."""
+    if datum.type == Datum.TIMESTAMP:
+        punches = _dense_punches if datum.name == "dense" else _work_punches
+        first_day = end.date() - datetime.timedelta(days=DENSE_DAYS) if datum.name == "dense" else start.date()
+        day = first_day
+        while day <= end.date():
+            for punch in punches(generator, day):
+                if punch < end:
+                    yield Value(datum=datum, timestamp=punch)
+            day += datetime.timedelta(days=1)
+        return
+
+    step = (end - start) / max(count, 1)
+    level = 20.0
+    for index in range(count):
+        timestamp = start + step * index
+        level += generator.gauss(0, 0.5)
+        if datum.type == Datum.INT:
+            fields = {'int_value': int(level * 100)}
+        elif datum.type == Datum.FLOAT:
+            fields = {'float_value': level}
+        elif datum.type == Datum.STRING:
+            fields = {'string_value': generator.choice(["coffee", "tea", "water", "juice"])}
+        elif datum.type == Datum.DATE:
+            fields = {'date_value': timestamp.date()}
+        else:
+            fields = {'datetime_value': timestamp}
+        yield Value(datum=datum, timestamp=timestamp, **fields)
+
+
+def generate(values, days, seed=0, out=None):
+    """
+    Create the benchmark user and datums, and about `values` values over the last `days` days. Most of them are
+    numeric, which is what devices log. Returns the datums by name.
+    """
+    generator = random.Random(seed)
+    user = User.objects.create_user(username=USERNAME, password=PASSWORD)
+    end = datetime.datetime.now().replace(microsecond=0)
+    start = end - datetime.timedelta(days=days)
+
+    datums = {}
+    for datum_type, _ in Datum.TYPE_CHOICES:
+        name = "work" if datum_type == Datum.TIMESTAMP else datum_type.lower()
+        datums[name] = Datum.objects.create(user=user, name=name, type=datum_type)
+    datums['dense'] = Datum.objects.create(user=user, name="dense", type=Datum.TIMESTAMP)
+    # targets of the log_value case, so what it logs doesn't change the other cases' data
+    datums['ingest'] = Datum.objects.create(user=user, name="ingest", type=Datum.FLOAT)
+    datums['punch'] = Datum.objects.create(user=user, name="punch", type=Datum.TIMESTAMP)
+
+    counts = {Datum.INT: values * 45 // 100, Datum.FLOAT: values * 45 // 100}
+    for name, datum in datums.items():
+        if name in ('ingest', 'punch'):
+            continue
+        count = counts.get(datum.type, values // 30)
+        rows = _values(datum, generator, start, end, count)
+        inserted = 0
+        while True:
+            batch = list(islice(rows, INSERT_BATCH_SIZE))
+            if not batch:
+                break
+            Value.objects.bulk_create(batch)
+            inserted += len(batch)
+        if datum.type in NUMERIC_TYPES:
+            rebuild_rollups(datum)
+        elif datum.type == Datum.TIMESTAMP:
+            rebuild_spans(datum)
+        if out is not None:
+            out.write("{}: {} values".format(datum.name, inserted))
+
+    return datums
+
+
+def find_datums():
+    """The datums of an earlier `generate`, or None if there are none."""
+    datums = {datum.name: datum for datum in Datum.objects.filter(user__username=USERNAME)}
+    return datums or None
+
+
+class Case(object):
+    """
+    A timed path. `run` does the work `operations` times and is timed, `setup` isn't. Both get the datums and a
+    logged in client.
+    """
+
+    def __init__(self, name, run, setup=None, operations=1):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.operations = operations
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise AssertionError("{} answered {}".format(url, response.status_code))
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def _log_values(datums, client):
+    for index in range(LOG_VALUE_REQUESTS // 2):
+        _get(client, "/{}/{}".format(datums['ingest'].slug, index / 10))
+        _get(client, "/{}/timestamp".format(datums['punch'].slug))
+
+
+def _week_url(datum, weeks_ago=0):
+    if not weeks_ago:
+        return "/datum/{}".format(datum.pk)  # the current week, which is never cached
+    monday = monday_this_week() - datetime.timedelta(weeks=weeks_ago)
+    return "/datum/{}?week={}&year={}".format(datum.pk, monday.strftime("%W"), monday.year)
+
+
+def _table_render(datums, client):
+    from_date = monday_this_week() - datetime.timedelta(weeks=53)
+    spans = synthetic_spans(datums['work'], from_date, 53 * 7)
+    rows = []
+    for week in range(53):
+        week_spans = [span for span in spans if (span.start.date() - from_date).days // 7 == week]
+        rows.extend(WeekTimeline(from_date + datetime.timedelta(weeks=week), week_spans).table_rows(datums['work']))
+    return "".join([row.render() for row in rows])
+
+
+CASES = [
+    Case("log_value", _log_values, operations=LOG_VALUE_REQUESTS),
+    Case("timestamp_datum_dense", lambda datums, client: _get(client, _week_url(datums['dense'])),
+         setup=lambda datums, client: cache.clear()),
+    Case("timestamp_datum_sparse", lambda datums, client: _get(client, _week_url(datums['work'])),
+         setup=lambda datums, client: cache.clear()),
+    Case("timestamp_datum_cached", lambda datums, client: _get(client, _week_url(datums['dense'], 1)),
+         setup=lambda datums, client: _get(client, _week_url(datums['dense'], 1))),
+    Case("week_table_render_year", _table_render),
+    Case("index", lambda datums, client: _get(client, "/")),
+    Case("numeric_datum", lambda datums, client: _get(client, "/datum/{}".format(datums['float'].pk))),
+    Case("export_csv", lambda datums, client: _get(client, "/datum/{}/export.csv".format(datums['float'].pk))),
+]
+
+
+def run_case(case, datums, client, repeat):
+    """Time `case` `repeat` times. Returns its result dict, with times and queries per operation."""
+    timings = []
+    queries = []
+    for _ in range(repeat):
+        if case.setup is not None:
+            case.setup(datums, client)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            case.run(datums, client)
+            timings.append((time.perf_counter() - started) / case.operations)
+        queries.append(len(captured) / case.operations)
+
+    return {
+        'operations': case.operations,
+        'repeat': repeat,
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'queries': max(queries),
+    }
+
+
+def login(client):
+    client.login(username=USERNAME, password=PASSWORD)
+    return client
+
+
+def run(datums, repeat, names=None):
+    """Run the cases named `names`, or all of them. Returns a dict of results by case name."""
+    client = login(Client())
+    results = {}
+    for case in CASES:
+        if names and case.name not in names:
+            continue
+        results[case.name] = run_case(case, datums, client, repeat)
+    return results
+
+
+def regressions(results, thresholds=None, baseline=None, tolerance=1.0):
+    """
+    Returns a message per regression: results over their absolute thresholds, which map case names to max_queries
+    and max_seconds, or slower than `tolerance` times the median or with more queries than in `baseline` results.
+    """
+    messages = []
+    for name, result in sorted(results.items()):
+        limits = (thresholds or {}).get(name, {})
+        if 'max_queries' in limits and result['queries'] > limits['max_queries']:
+            messages.append("{}: {} queries, the threshold is {}".format(name, result['queries'],
+                                                                         limits['max_queries']))
+        if 'max_seconds' in limits and result['median_seconds'] > limits['max_seconds']:
+            messages.append("{}: {:.6f}s, the threshold is {:.6f}s".format(name, result['median_seconds'],
+                                                                          limits['max_seconds']))
+
+        previous = (baseline or {}).get(name)
+        if previous is None:
+            continue
+        if result['queries'] > previous['queries']:
+            messages.append("{}: {} queries, {} in the baseline".format(name, result['queries'], previous['queries']))
+        if result['median_seconds'] > previous['median_seconds'] * tolerance:
+            messages.append("{}: {:.6f}s, {:.6f}s in the baseline".format(name, result['median_seconds'],
+                                                                         previous['median_seconds']))
+    return messages
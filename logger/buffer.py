@@ -0,0 +1,322 @@
+"""
+Optional write-behind buffer for ingested values.
+
+With settings.LOGGER_INGEST_BUFFER set, ingested values are acknowledged as soon as they're queued, and written to the
+database later with bulk_create, once LOGGER_INGEST_BUFFER_SIZE values are queued or the oldest queued value is
+LOGGER_INGEST_BUFFER_DELAY seconds old.
+
+"memory" keeps the queue in the process and flushes it from a background thread, so queued values are lost if the
+process dies. "file" appends every value to an fsync'd log at LOGGER_INGEST_BUFFER_PATH, which is drained by
+`manage.py flush_ingest_buffer`. Lines of the log that can't be parsed are moved to a ".rejected" file next to it,
+and a rotated file that failed to save LOGGER_INGEST_BUFFER_MAX_ATTEMPTS times is renamed to ".failed", so neither
+holds up the files after it.
+"""
+import atexit
+import collections
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Datum, Value
+
+log = logging.getLogger(__name__)
+
+MEMORY = "memory"
+FILE = "file"
+
+_DATE_FIELDS = ('date_value',)
+_DATETIME_FIELDS = ('timestamp', 'datetime_value')
+
+
+def serialize(value):
+    record = {'datum': value.datum_id, 'timestamp': value.timestamp.isoformat()}
+    field = value.datum.value_field
+    if field is not None:
+        raw = getattr(value, field)
+        record[field] = raw.isoformat() if hasattr(raw, 'isoformat') else raw
+    if getattr(value, 'dedup_key', None) is not None:
+        record['dedup_key'] = value.dedup_key
+    return record
+
+
+def deserialize(record, datums):
+    fields = {}
+    for field, raw in record.items():
+        if field in ('datum', 'dedup_key'):
+            continue
+        if field in _DATETIME_FIELDS:
+            raw = parse_datetime(raw)
+        elif field in _DATE_FIELDS:
+            raw = parse_date(raw)
+        fields[field] = raw
+    value = Value(datum=datums[record['datum']], **fields)
+    value.dedup_key = record.get('dedup_key')
+    return value
+
+
+def save_records(records):
+    """
+    Save serialized values with one query for their datums and one bulk_create. Returns the number saved, which leaves
+    out duplicates of values saved before.
+    """
+    from .ingest import save_values
+
+    datums = Datum.objects.in_bulk({record['datum'] for record in records})
+    values = [deserialize(record, datums) for record in records if record['datum'] in datums]
+    return len(values) - len(save_values(values))
+
+
+class BufferStats(object):
+    """Counters of a buffer, for monitoring."""
+
+    def __init__(self):
+        self.queued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rejected = 0
+        self.failed_files = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def record_flush(self, count, seconds):
+        self.flushed += count
+        self.flushes += 1
+        self.last_flush_seconds = seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, seconds)
+        log.info("flushed %d values in %.3fs", count, seconds)
+
+    def as_dict(self, depth):
+        return {
+            'depth': depth,
+            'queued': self.queued,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'rejected': self.rejected,
+            'failed_files': self.failed_files,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+        }
+
+
+class MemoryBuffer(object):
+    def __init__(self, max_size, max_delay):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.queue = collections.deque()
+        self.oldest = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stats = BufferStats()
+        self.thread = None
+
+    def put(self, values):
+        records = [serialize(value) for value in values]
+        with self.lock:
+            if not self.queue:
+                self.oldest = time.time()
+            self.queue.extend(records)
+            self.stats.queued += len(records)
+            full = len(self.queue) >= self.max_size
+        self._ensure_flusher()
+        if full:
+            self.wakeup.set()
+
+    def depth(self):
+        return len(self.queue)
+
+    def flush(self):
+        with self.lock:
+            records = list(self.queue)
+            self.queue.clear()
+            self.oldest = None
+        if not records:
+            return 0
+
+        started = time.time()
+        try:
+            count = save_records(records)
+        except Exception:
+            log.exception("flush of %d values failed, requeueing them", len(records))
+            with self.lock:
+                self.queue.extendleft(reversed(records))
+                self.oldest = started
+                self.stats.failed_flushes += 1
+            return 0
+        self.stats.record_flush(count, time.time() - started)
+        return count
+
+    def _ensure_flusher(self):
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, name="ingest-buffer-flusher", daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.max_delay)
+            self.wakeup.clear()
+            oldest = self.oldest
+            if len(self.queue) >= self.max_size or (oldest is not None and time.time() - oldest >= self.max_delay):
+                self.flush()
+                connection.close()  # the thread has its own connection, don't leave it open between flushes
+
+    def stats_dict(self):
+        return self.stats.as_dict(self.depth())
+
+
+class FileBuffer(object):
+    """
+    An append only log of serialized values, one JSON object per line.
+
+    Writers lock the log while appending, and check that it wasn't rotated before they got the lock. The flusher
+    rotates the log under the same lock, and then saves and deletes the rotated file, so no append is ever lost.
+    """
+
+    def __init__(self, path, max_size, max_delay, max_attempts):
+        self.path = path
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.attempts = collections.Counter()  # rotated file -> failed flushes of it by this process
+        self.stats = BufferStats()
+
+    def _open_locked(self):
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)  # rotated while waiting for the lock, try the new file
+
+    def put(self, values):
+        data = "".join(json.dumps(serialize(value)) + "\n" for value in values).encode('utf-8')
+        fd = self._open_locked()
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.stats.queued += len(values)
+
+    def depth(self):
+        """The number of values waiting in the log and in rotated files that weren't flushed yet."""
+        depth = 0
+        for path in [self.path] + glob.glob(self.path + ".*.flushing"):
+            try:
+                with open(path, 'rb') as f:
+                    depth += sum(1 for _ in f)
+            except FileNotFoundError:
+                pass
+        return depth
+
+    def rotate(self):
+        if not os.path.exists(self.path):
+            return
+        fd = self._open_locked()
+        try:
+            os.rename(self.path, "{}.{}.flushing".format(self.path, int(time.time() * 1000)))
+        finally:
+            os.close(fd)
+
+    def read_records(self, path):
+        """
+        The records of a rotated file. Lines that aren't a serialized value, like one cut short by a crash while it
+        was written, are appended to the ".rejected" file of the log rather than failing the whole file.
+        """
+        records = []
+        rejected = []
+        with open(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    record = None
+                if isinstance(record, dict) and 'datum' in record:
+                    records.append(record)
+                else:
+                    rejected.append(line if line.endswith(b"\n") else line + b"\n")
+
+        if rejected:
+            log.error("%d malformed lines in %s, moved to %s.rejected", len(rejected), path, self.path)
+            with open(self.path + ".rejected", 'ab') as f:
+                f.write(b"".join(rejected))
+                os.fsync(f.fileno())
+            self.stats.rejected += len(rejected)
+        return records
+
+    def flush(self):
+        """
+        Rotate the log and save everything in it, plus anything left over from failed flushes. Files are saved in
+        order, and a file that fails stops the flush until it's retried, unless it already failed max_attempts times,
+        then it's renamed to ".failed" to be looked into.
+        """
+        self.rotate()
+
+        count = 0
+        for path in sorted(glob.glob(self.path + ".*.flushing")):
+            started = time.time()
+            try:
+                records = self.read_records(path)
+                flushed = save_records(records) if records else 0
+            except Exception:
+                self.stats.failed_flushes += 1
+                self.attempts[path] += 1
+                if self.attempts[path] < self.max_attempts:
+                    log.exception("flush of %s failed, it will be retried", path)
+                    break
+                failed = path[:-len(".flushing")] + ".failed"
+                log.exception("flush of %s failed %d times, moved to %s", path, self.attempts[path], failed)
+                os.rename(path, failed)
+                del self.attempts[path]
+                self.stats.failed_files += 1
+                continue
+            os.remove(path)
+            self.attempts.pop(path, None)
+            self.stats.record_flush(flushed, time.time() - started)
+            count += flushed
+        return count
+
+    def stats_dict(self):
+        return self.stats.as_dict(self.depth())
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Returns the configured buffer, or None if values are written directly."""
+    global _buffer
+    mode = settings.LOGGER_INGEST_BUFFER
+    if mode is None:
+        return None
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                if mode == MEMORY:
+                    _buffer = MemoryBuffer(settings.LOGGER_INGEST_BUFFER_SIZE, settings.LOGGER_INGEST_BUFFER_DELAY)
+                    atexit.register(_buffer.flush)  # don't lose what's queued on a clean shutdown
+                elif mode == FILE:
+                    _buffer = FileBuffer(settings.LOGGER_INGEST_BUFFER_PATH, settings.LOGGER_INGEST_BUFFER_SIZE,
+                                         settings.LOGGER_INGEST_BUFFER_DELAY,
+                                         settings.LOGGER_INGEST_BUFFER_MAX_ATTEMPTS)
+                else:
+                    raise NotImplementedError('no ingest buffer of type {}'.format(mode))
+    return _buffer
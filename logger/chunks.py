@@ -0,0 +1,239 @@
+"""
+Compressed storage for dense INT and FLOAT series.
+
+The values of a datum with CHUNKS storage are packed per CHUNK_WINDOW into a ValueChunk, once the window is closed.
+A chunk is a small header followed by one record per value:
+
+* the timestamp, as the zigzag varint of the delta of deltas of microseconds since the window start, which is one byte
+  for a steady sampling rate;
+* for FLOAT datums, the XOR of the value's bits with the previous value's bits, stored as one byte for a repeated
+  value, or a byte giving the number of leading and trailing zero bytes followed by the bytes in between;
+* for INT datums, the zigzag varint of the difference with the previous value.
+
+It's the scheme of Facebook's Gorilla, aligned to bytes so it can be decoded reasonably fast in Python.
+"""
+import datetime
+import heapq
+import struct
+
+from django.db import connection, transaction
+
+from .models import Datum, Value, ValueChunk
+
+CHUNK_WINDOW = datetime.timedelta(hours=1)
+DELETE_BATCH_SIZE = 500
+
+_HEADER = struct.Struct('<BBI')  # format version, value type, value count
+_VERSION = 1
+_KINDS = {Datum.INT: 0, Datum.FLOAT: 1}
+
+_SAME = 0x00  # FLOAT value with the same bits as the previous one
+_NONE = 0x7F  # missing FLOAT value
+_XOR = 0x80  # FLOAT value as XOR, the low bits hold the numbers of leading and trailing zero bytes
+
+_double = struct.Struct('<d')
+_bits = struct.Struct('<Q')
+
+
+def window_start(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def _unzigzag(z):
+    return z >> 1 if not z & 1 else -((z + 1) >> 1)
+
+
+def _write_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data, position):
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def encode(datum_type, start, points):
+    """Encode time ordered (timestamp, value) points of a window starting at `start` into bytes."""
+    out = bytearray(_HEADER.pack(_VERSION, _KINDS[datum_type], len(points)))
+    previous_offset = previous_delta = 0
+    previous_bits = previous_int = 0
+
+    for timestamp, value in points:
+        delta_time = timestamp - start
+        offset = (delta_time.days * 86400 + delta_time.seconds) * 1000000 + delta_time.microseconds
+        delta = offset - previous_offset
+        _write_varint(out, _zigzag(delta - previous_delta))
+        previous_offset, previous_delta = offset, delta
+
+        if datum_type == Datum.FLOAT:
+            if value is None:
+                out.append(_NONE)
+                continue
+            bits = _bits.unpack(_double.pack(value))[0]
+            xor = bits ^ previous_bits
+            previous_bits = bits
+            if xor == 0:
+                out.append(_SAME)
+                continue
+            raw = xor.to_bytes(8, 'big')
+            leading = 8 - len(raw.lstrip(b'\0'))
+            trailing = 8 - len(raw.rstrip(b'\0'))
+            out.append(_XOR | (leading << 3) | trailing)
+            out += raw[leading:8 - trailing]
+        else:
+            if value is None:
+                _write_varint(out, 1)
+                continue
+            _write_varint(out, _zigzag(value - previous_int) << 1)
+            previous_int = value
+
+    return bytes(out)
+
+
+def decode(start, data):
+    """Yields the (timestamp, value) points of an encoded window starting at `start`, one at a time."""
+    data = bytes(data)
+    version, kind, count = _HEADER.unpack_from(data)
+    if version != _VERSION:
+        raise ValueError("unknown chunk format version {}".format(version))
+    is_float = kind == _KINDS[Datum.FLOAT]
+
+    position = _HEADER.size
+    offset = delta = 0
+    previous_bits = previous_int = 0
+    for _ in range(count):
+        delta_of_delta, position = _read_varint(data, position)
+        delta += _unzigzag(delta_of_delta)
+        offset += delta
+        timestamp = start + datetime.timedelta(microseconds=offset)
+
+        if is_float:
+            header = data[position]
+            position += 1
+            if header == _NONE:
+                yield timestamp, None
+                continue
+            if header != _SAME:
+                leading, trailing = (header >> 3) & 0x07, header & 0x07
+                size = 8 - leading - trailing
+                xor = int.from_bytes(data[position:position + size], 'big') << (8 * trailing)
+                position += size
+                previous_bits ^= xor
+            yield timestamp, _double.unpack(_bits.pack(previous_bits))[0]
+        else:
+            encoded, position = _read_varint(data, position)
+            if encoded & 1:
+                yield timestamp, None
+                continue
+            previous_int += _unzigzag(encoded >> 1)
+            yield timestamp, previous_int
+
+
+def _chunk_points(datum, start, end):
+    chunks = ValueChunk.objects.filter(datum=datum)
+    if start is not None:
+        chunks = chunks.filter(end__gt=start)
+    if end is not None:
+        chunks = chunks.filter(start__lt=end)
+
+    for chunk_start, data in chunks.order_by('start').values_list('start', 'data').iterator():
+        for timestamp, value in decode(chunk_start, data):
+            if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                yield timestamp, value
+
+
+def _row_points(datum, start, end):
+    values = Value.objects.filter(datum=datum)
+    if start is not None:
+        values = values.filter(timestamp__gte=start)
+    if end is not None:
+        values = values.filter(timestamp__lt=end)
+    return values.order_by('timestamp').values_list('timestamp', datum.value_field).iterator()
+
+
+def iter_points(datum, start=None, end=None):
+    """
+    Yields the (timestamp, value) points of `datum` in [start, end), ordered by timestamp.
+
+    For CHUNKS storage these are merged from the chunks overlapping the range, which are decoded as they're reached, and
+    the rows that weren't compacted yet.
+    """
+    rows = _row_points(datum, start, end)
+    if datum.storage != Datum.CHUNKS:
+        return rows
+    return heapq.merge(_chunk_points(datum, start, end), rows, key=lambda point: point[0])
+
+
+def _delete_rows(ids):
+    """
+    Delete value rows by id with plain DELETEs, which don't fetch the rows again or send signals: the values are only
+    moved into a chunk, nothing about them changed.
+    """
+    table = connection.ops.quote_name(Value._meta.db_table)
+    with connection.cursor() as cursor:
+        for index in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = ids[index:index + DELETE_BATCH_SIZE]
+            cursor.execute("DELETE FROM {} WHERE id IN ({})".format(table, ", ".join(["%s"] * len(batch))), batch)
+
+
+def compact_window(datum, start):
+    """Pack the rows of `datum` in the window starting at `start` into its chunk, and delete them."""
+    end = start + CHUNK_WINDOW
+
+    with transaction.atomic():
+        rows = Value.objects.select_for_update().filter(datum=datum, timestamp__gte=start, timestamp__lt=end)
+        ids = []
+        points = []
+        for value_id, timestamp, number in rows.values_list('id', 'timestamp', datum.value_field):
+            ids.append(value_id)
+            points.append((timestamp, number))
+        if not points:
+            return 0
+
+        chunk = ValueChunk.objects.select_for_update().filter(datum=datum, start=start).first()
+        if chunk is None:
+            chunk = ValueChunk(datum=datum, start=start, end=end)
+        else:  # values that arrived late for an already compacted window
+            points.extend(decode(chunk.start, chunk.data))
+
+        points.sort(key=lambda point: point[0])
+        chunk.data = encode(datum.type, start, points)
+        chunk.count = len(points)
+        chunk.save()
+
+        _delete_rows(ids)
+
+    return len(points)
+
+
+def compact(datum, before):
+    """Compact every closed window of `datum` that ends before `before`. Returns (windows, values) compacted."""
+    cutoff = window_start(before)
+    timestamps = (Value.objects.filter(datum=datum, timestamp__lt=cutoff).order_by('timestamp')
+                  .values_list('timestamp', flat=True))
+
+    windows = values = 0
+    start = None
+    while True:
+        following = timestamps.filter(timestamp__gte=start + CHUNK_WINDOW) if start is not None else timestamps
+        first = following.first()
+        if first is None:
+            break
+        start = window_start(first)
+        values += compact_window(datum, start)
+        windows += 1
+
+    return windows, values
@@ -0,0 +1,94 @@
+"""
+Set based corrections of value timestamps, for clock drift, DST mistakes and the like.
+
+A correction is a list of (start, end, delta) shifts: values with a timestamp in [start, end) are moved by delta, and
+None leaves that side of the range open. Every value is moved by one UPDATE using a CASE over the shifts, so a value
+that is moved into the range of another shift isn't moved twice.
+"""
+import datetime
+from functools import reduce
+import operator
+
+import pytz
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Max, Min, Q, When
+
+from .models import Datum, Value
+from .rollups import NUMERIC_TYPES, rebuild_rollups
+from .spans import rebuild_spans
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def _condition(start, end):
+    condition = Q(timestamp__isnull=False)
+    if start is not None:
+        condition &= Q(timestamp__gte=start)
+    if end is not None:
+        condition &= Q(timestamp__lt=end)
+    return condition
+
+
+def shift_timestamps(datum, shifts, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Apply the shifts to the values of `datum` and rebuild its spans or rollups. Returns the number of values moved.
+
+    The UPDATE runs in windows of `batch_size` ids, one transaction each, so no lock is held for long. With dry_run
+    nothing is changed and the number of values that would be moved is returned.
+    """
+    shifts = [(start, end, delta) for start, end, delta in shifts if delta]
+    if not shifts:
+        return 0
+
+    matching = Value.objects.filter(datum=datum).filter(reduce(operator.or_, (_condition(start, end)
+                                                                            for start, end, _ in shifts)))
+    if dry_run:
+        return matching.count()
+
+    ids = matching.aggregate(first=Min('id'), last=Max('id'))
+    if ids['first'] is None:
+        return 0
+
+    timestamp = Case(*[When(_condition(start, end), then=F('timestamp') + delta) for start, end, delta in shifts],
+                     default=F('timestamp'), output_field=DateTimeField())
+
+    moved = 0
+    for first_id in range(ids['first'], ids['last'] + 1, batch_size):
+        with transaction.atomic():
+            moved += matching.filter(id__gte=first_id, id__lt=first_id + batch_size).update(timestamp=timestamp)
+
+    # update() doesn't send signals, so bring the derived tables up to date by hand
+    datum.touch_values()
+    if datum.type in NUMERIC_TYPES:
+        rebuild_rollups(datum)
+    elif datum.type == Datum.TIMESTAMP:
+        rebuild_spans(datum)
+
+    return moved
+
+
+def timezone_shifts(from_tz, to_tz, start, end):
+    """
+    Returns the shifts that reinterpret naive timestamps in [start, end) recorded in from_tz as times in to_tz.
+
+    The offset between two zones changes at DST transitions, so the range is walked hour by hour and hours with the
+    same offset are merged into one shift.
+    """
+    from_tz, to_tz = pytz.timezone(from_tz), pytz.timezone(to_tz)
+
+    def delta_at(timestamp):
+        converted = from_tz.localize(timestamp, is_dst=False).astimezone(to_tz).replace(tzinfo=None)
+        return converted - timestamp
+
+    hour = datetime.timedelta(hours=1)
+    shifts = []
+    current = start.replace(minute=0, second=0, microsecond=0)
+    shift_start, shift_delta = start, delta_at(current)
+    while current < end:
+        current += hour
+        delta = delta_at(current) if current < end else None
+        if delta != shift_delta:
+            shifts.append((shift_start, min(current, end), shift_delta))
+            shift_start, shift_delta = current, delta
+
+    return shifts
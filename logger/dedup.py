@@ -0,0 +1,83 @@
+"""
+Idempotent ingest with keys chosen by clients.
+
+A value can be logged with a key, the Idempotency-Key header or ?key= of log_value, or the "key" of a bulk record. A
+value whose datum already has a value logged with the same key is a retry and isn't saved again. Keys are claimed in
+the transaction that saves their values, by inserting them into IngestKey, whose unique index on (datum, key) settles
+races between workers: the loser's insert fails and its value is dropped.
+
+Most retries come soon after the first attempt, so keys are remembered in a per process LRU cache of
+LOGGER_INGEST_KEY_CACHE_SIZE recent keys as well, and those retries are answered without touching the database. Keys
+are kept in the database for LOGGER_INGEST_KEY_RETENTION_DAYS, `manage.py enforce_retention` deletes older ones.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .datum_cache import LRUCache
+from .models import IngestKey
+
+_recent = LRUCache(settings.LOGGER_INGEST_KEY_CACHE_SIZE, settings.LOGGER_INGEST_KEY_CACHE_TTL)
+
+
+def key_of(value):
+    return getattr(value, 'dedup_key', None)
+
+
+def is_recent(value):
+    """Whether the key of `value` was seen lately by this process, so `value` is a retry."""
+    key = key_of(value)
+    return key is not None and _recent.get((value.datum_id, key)) is not None
+
+
+def remember(values):
+    for value in values:
+        key = key_of(value)
+        if key is not None:
+            _recent.set((value.datum_id, key), True)
+
+
+def _claim(value):
+    try:
+        with transaction.atomic():
+            IngestKey.objects.create(datum_id=value.datum_id, key=key_of(value))
+    except IntegrityError:
+        return False
+    return True
+
+
+def claim(values):
+    """
+    Claim the keys of `values` within the current transaction. Returns the values to save, in their order, which are
+    those without a key and the first with each key that wasn't claimed before, and the duplicates.
+    """
+    keyed = {}
+    duplicates = []
+    for value in values:
+        key = key_of(value)
+        if key is None:
+            continue
+        if (value.datum_id, key) in keyed:
+            duplicates.append(value)
+        else:
+            keyed[(value.datum_id, key)] = value
+    if not keyed:
+        return values, duplicates
+
+    if len(keyed) == 1:
+        # like a log_value request, where trying the insert is cheaper than looking the key up first
+        duplicates.extend([value for value in keyed.values() if not _claim(value)])
+    else:
+        claimed = set(IngestKey.objects.filter(datum__in={datum_id for datum_id, _ in keyed},
+                                               key__in={key for _, key in keyed}).values_list('datum_id', 'key'))
+        for pair in claimed & set(keyed):
+            duplicates.append(keyed.pop(pair))
+
+        try:
+            with transaction.atomic():
+                IngestKey.objects.bulk_create([IngestKey(datum_id=datum_id, key=key) for datum_id, key in keyed])
+        except IntegrityError:
+            # another worker claimed some of them meanwhile, so find out which one by one
+            duplicates.extend([value for value in keyed.values() if not _claim(value)])
+
+    rejected = {id(value) for value in duplicates}
+    return [value for value in values if id(value) not in rejected], duplicates
@@ -0,0 +1,92 @@
+import csv
+import json
+
+from django.db.models import Q
+
+from .chunks import iter_points
+from .models import Datum, Value
+
+CHUNK_SIZE = 2000
+
+# columns that can be exported, "value" is the Value field of the datum's type
+COLUMNS = ['id', 'timestamp', 'value', 'int_value', 'float_value', 'string_value', 'date_value', 'datetime_value']
+DEFAULT_COLUMNS = ['timestamp', 'value']
+
+
+def value_columns(datum, columns):
+    """Returns the Value fields to select for the export columns `columns` of `datum`."""
+    fields = []
+    for column in columns:
+        if column not in COLUMNS:
+            raise ValueError("unknown column {}".format(column))
+        if column == 'value':
+            column = datum.value_field or 'timestamp'
+        fields.append(column)
+    return fields
+
+
+def iter_values(datum, fields, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields value tuples of `fields` for the values of `datum` in [start, end), ordered by timestamp.
+
+    Rows are read in chunks with keyset pagination on (timestamp, id), so memory use doesn't depend on the number of
+    rows, and every chunk is a range scan of the (datum, timestamp) index whatever the database driver buffers.
+
+    Datums with CHUNKS storage only have a timestamp and a value, their other fields are exported as empty.
+    """
+    if datum.storage == Datum.CHUNKS:
+        for timestamp, value in iter_points(datum, start, end):
+            point = {'timestamp': timestamp, datum.value_field: value}
+            yield tuple(point.get(field) for field in fields)
+        return
+
+    values = Value.objects.filter(datum=datum)
+    if start is not None:
+        values = values.filter(timestamp__gte=start)
+    if end is not None:
+        values = values.filter(timestamp__lt=end)
+
+    values = values.order_by('timestamp', 'id')
+
+    chunk = list(values.values_list('timestamp', 'id', *fields)[:chunk_size])
+    while chunk:
+        for row in chunk:
+            yield row[2:]
+
+        if len(chunk) < chunk_size:
+            break
+
+        timestamp, pk = chunk[-1][:2]
+        chunk = list(values.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+                     .values_list('timestamp', 'id', *fields)[:chunk_size])
+
+
+def _serializable(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+class _Echo(object):
+    """A file-like object that returns what is written to it, so csv.writer can produce lines for streaming."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_serializable(value) for value in row])
+
+
+def ndjson_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, (_serializable(value) for value in row)))) + "\n"
+
+
+FORMATS = {
+    'csv': ("text/csv", csv_lines),
+    'ndjson': ("application/x-ndjson", ndjson_lines),
+}
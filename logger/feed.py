@@ -0,0 +1,299 @@
+"""
+A feed of the values of a datum as they're logged, and of the spans they open and close for TIMESTAMP datums.
+
+The database is the log of the feed: events are read back as the values with an id above the last one a client got,
+and a client that reconnects with a Last-Event-ID gets whatever it missed. Ids are handed out when values are
+inserted rather than when their transaction commits, so a value can become visible after one with a higher id has
+been sent. The event id is a Cursor of the highest value id sent and of the ids below it, within LOOKBACK ids, that
+weren't committed yet when it was read: those are read again until they show up or fall out of the window. Writers
+only publish the ids of the datums they saved values of, once their transaction is committed, and the broker wakes
+up the streams that follow those datums to read them.
+
+"local" wakes the streams in the process only, which is all it takes with a single worker. With several worker
+processes, or with ingest served by the ASGI application, values are saved in processes that streams don't share a
+broker with, so "polling" also wakes every stream each LOGGER_FEED_POLL_SECONDS to look for them, until a broker
+shared between processes is set up.
+
+The feed is served by the WSGI site only, not by the ingest applications, and every open stream or long poll holds
+its worker for up to LOGGER_FEED_TIMEOUT or LOGGER_FEED_KEEPALIVE seconds. Run the site on threaded or async
+workers, gunicorn's gthread or gevent workers for instance, with more threads than displays follow feeds. On sync
+workers a few open feeds take every worker, and the site and log_value stop answering.
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Datum, Span, Value
+
+LOCAL = "local"
+POLLING = "polling"
+
+BATCH_SIZE = 500
+# how many ids below the highest one sent a cursor keeps waiting for, for the values of transactions still open
+LOOKBACK = 100
+
+
+class Subscription(object):
+    """What a stream waits on for new values of its datum."""
+
+    def __init__(self, broker, datum_id):
+        self.broker = broker
+        self.datum_id = datum_id
+        self.event = threading.Event()
+
+    def wait(self, timeout):
+        """Waits up to `timeout` seconds to be woken up. Returns whether there may be new values."""
+        woken = self.event.wait(timeout)
+        self.event.clear()
+        return woken
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker(object):
+    """Wakes the subscriptions of this process to the datums values were saved for."""
+
+    def __init__(self):
+        self.subscriptions = {}  # datum id -> set of Subscriptions
+        self.lock = threading.Lock()
+
+    def subscribe(self, datum_id):
+        subscription = Subscription(self, datum_id)
+        with self.lock:
+            self.subscriptions.setdefault(datum_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.datum_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscriptions.pop(subscription.datum_id, None)
+
+    def publish(self, datum_ids):
+        with self.lock:
+            woken = [subscription for datum_id in set(datum_ids)
+                     for subscription in self.subscriptions.get(datum_id, ())]
+        for subscription in woken:
+            subscription.event.set()
+
+
+class PollingSubscription(Subscription):
+
+    def __init__(self, broker, datum_id, interval):
+        super(PollingSubscription, self).__init__(broker, datum_id)
+        self.interval = interval
+
+    def wait(self, timeout):
+        if timeout <= self.interval:
+            return super(PollingSubscription, self).wait(timeout)
+        super(PollingSubscription, self).wait(self.interval)
+        return True
+
+
+class PollingBroker(LocalBroker):
+    """A LocalBroker whose subscriptions also look for values saved by other processes every `interval` seconds."""
+
+    def __init__(self, interval):
+        super(PollingBroker, self).__init__()
+        self.interval = interval
+
+    def subscribe(self, datum_id):
+        subscription = PollingSubscription(self, datum_id, self.interval)
+        with self.lock:
+            self.subscriptions.setdefault(datum_id, set()).add(subscription)
+        return subscription
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                mode = settings.LOGGER_FEED_BROKER
+                if mode == LOCAL:
+                    _broker = LocalBroker()
+                elif mode == POLLING:
+                    _broker = PollingBroker(settings.LOGGER_FEED_POLL_SECONDS)
+                else:
+                    raise NotImplementedError('no feed broker of type {}'.format(mode))
+    return _broker
+
+
+def publish(datum_ids):
+    """Wake the streams of `datum_ids` once the current transaction is committed, or now outside of one."""
+    datum_ids = set(datum_ids)
+    transaction.on_commit(lambda: get_broker().publish(datum_ids))
+
+
+class Cursor(namedtuple('Cursor', ['after', 'gaps'])):
+    """
+    Where a client is in the feed: the highest value id it got, and the ids below that which may still be committed.
+    Written as "after" or "after:gap,gap" in the event ids.
+    """
+
+    @classmethod
+    def parse(cls, text):
+        """Raises ValueError when `text` isn't a cursor."""
+        after, _, gaps = text.partition(":")
+        cursor = cls(int(after), frozenset(int(gap) for gap in gaps.split(",")) if gaps else frozenset())
+        if cursor.after < 0 or any(gap < 0 or gap >= cursor.after for gap in cursor.gaps):
+            raise ValueError(text)
+        return cursor
+
+    def __str__(self):
+        if not self.gaps:
+            return str(self.after)
+        return "{}:{}".format(self.after, ",".join(str(gap) for gap in sorted(self.gaps)))
+
+    def sent(self, value_id, committed):
+        """
+        The cursor once the value `value_id` is sent too. Ids skipped up to it that aren't in `committed`, the ids of
+        all datums' values read along with it, become gaps.
+        """
+        if value_id <= self.after:
+            return self._replace(gaps=self.gaps - {value_id})
+        skipped = set(range(max(self.after, value_id - LOOKBACK) + 1, value_id)) - committed
+        gaps = frozenset(gap for gap in self.gaps | skipped if gap > value_id - LOOKBACK)
+        return Cursor(value_id, gaps)
+
+
+def last_value_id(datum):
+    """The cursor of the latest saved value of `datum`, to follow it from. 0 if it has none."""
+    return Cursor(Value.objects.filter(datum=datum).order_by('-id').values_list('id', flat=True).first() or 0,
+                  frozenset())
+
+
+def _value_data(datum, value):
+    data = {'id': value.id, 'timestamp': value.timestamp.isoformat()}
+    if datum.value_field is not None:
+        raw = getattr(value, datum.value_field)
+        data['value'] = raw.isoformat() if hasattr(raw, 'isoformat') else raw
+    return data
+
+
+def _span_data(span, state):
+    return {'state': state, 'start': span.start.isoformat(), 'end': span.end.isoformat() if span.end else None,
+            'duration': span.duration.total_seconds() if span.duration is not None else None}
+
+
+def events(datum, cursor):
+    """
+    Returns the events of the values of `datum` the client at `cursor` hasn't got, the late ones of its gaps first and
+    then the newer ones in the order they were saved, as (cursor, event, data) tuples, at most BATCH_SIZE values.
+    TIMESTAMP values that start or end a span are preceded by a "span" event without a cursor, so a client that missed
+    it gets it again along with the value.
+    """
+    late = []
+    if cursor.gaps:
+        others = set()
+        for value in Value.objects.filter(id__in=cursor.gaps).order_by('id'):
+            if value.datum_id == datum.pk:
+                late.append(value)
+            else:
+                others.add(value.id)
+        # gaps that turned out to be values of other datums are closed without an event, the late ones as they're sent
+        cursor = cursor._replace(gaps=cursor.gaps - others)
+
+    values = list(Value.objects.filter(datum=datum, id__gt=cursor.after).order_by('id')[:BATCH_SIZE])
+    committed = set()
+    if values:
+        window_start = max(cursor.after, values[-1].id - LOOKBACK)
+        committed.update(Value.objects.filter(id__gt=window_start, id__lt=values[-1].id).values_list('id', flat=True))
+    values = late + values
+
+    spans = {}
+    if datum.type == Datum.TIMESTAMP and values:
+        timestamps = [value.timestamp for value in values]
+        for span in Span.objects.filter(datum=datum, start__gte=min(timestamps), start__lte=max(timestamps)):
+            spans[(span.start, "open")] = span
+        for span in Span.objects.filter(datum=datum, end__gte=min(timestamps), end__lte=max(timestamps)):
+            spans[(span.end, "close")] = span
+
+    result = []
+    for value in values:
+        # a punch that both ends a span and starts the next one, at the same instant, gets both events
+        for state in ("close", "open"):
+            span = spans.pop((value.timestamp, state), None)
+            if span is not None:
+                result.append((None, "span", _span_data(span, state)))
+        cursor = cursor.sent(value.id, committed)
+        result.append((cursor, "value", _value_data(datum, value)))
+    return result
+
+
+def format_event(event_id, event, data):
+    lines = []
+    if event_id is not None:
+        lines.append("id: {}".format(event_id))
+    lines.append("event: {}".format(event))
+    lines.append("data: {}".format(json.dumps(data)))
+    return "\n".join(lines) + "\n\n"
+
+
+def stream(datum, after, timeout=None, keepalive=None):
+    """
+    Yields the server-sent events of the values of `datum` the client at the Cursor `after` hasn't got, and then of the
+    values saved while the stream is open, for `timeout` seconds. Clients reconnect after that, with the id of the last
+    event.
+    """
+    timeout = settings.LOGGER_FEED_TIMEOUT if timeout is None else timeout
+    keepalive = settings.LOGGER_FEED_KEEPALIVE if keepalive is None else keepalive
+    subscription = get_broker().subscribe(datum.pk)
+    deadline = time.monotonic() + timeout
+    try:
+        yield "retry: {}\n\n".format(settings.LOGGER_FEED_RETRY_MILLISECONDS)
+        sent = time.monotonic()
+        # subscribed before the first read, so values saved in between wake the stream up rather than being missed
+        woken = True
+        while True:
+            while woken:
+                batch = events(datum, after)
+                for event_id, event, data in batch:
+                    if event_id is not None:
+                        after = event_id
+                    yield format_event(event_id, event, data)
+                    sent = time.monotonic()
+                # a full batch means there may be more
+                woken = sum(1 for event_id, _, _ in batch if event_id is not None) >= BATCH_SIZE
+
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if now - sent >= keepalive:
+                yield ": keepalive\n\n"
+                sent = now
+            woken = subscription.wait(min(sent + keepalive, deadline) - now)
+    finally:
+        subscription.close()
+
+
+def poll(datum, after, timeout=None):
+    """
+    Long polling: the events the client at the Cursor `after` hasn't got, waiting up to `timeout` seconds for values
+    to be saved when there are none yet. Returns a list of (cursor, event, data) tuples, which is empty when nothing
+    was saved.
+    """
+    timeout = settings.LOGGER_FEED_KEEPALIVE if timeout is None else timeout
+    subscription = get_broker().subscribe(datum.pk)
+    deadline = time.monotonic() + timeout
+    try:
+        batch = events(datum, after)
+        while not batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if subscription.wait(remaining):
+                batch = events(datum, after)
+        return batch
+    finally:
+        subscription.close()
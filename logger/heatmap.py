@@ -0,0 +1,124 @@
+"""
+Month, quarter and year heatmaps of the time a TIMESTAMP datum spends in spans, per hour of every day.
+
+The minutes of every hour are computed at once rather than cell by cell: the time covered by the spans before an
+hour boundary B is sum(max(0, B - start)) - sum(max(0, B - end)), which is a binary search and a prefix sum over the
+sorted starts and ends. The occupancy of each hour is the difference between its two boundaries. NumPy does this for
+all boundaries in a few array operations when it's installed, otherwise the same algorithm runs in plain Python.
+"""
+import bisect
+import datetime
+from itertools import accumulate
+
+from .utils import datetime_range, format_timedelta
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PERIODS = ('month', 'quarter', 'year')
+HOUR = 3600
+
+
+def period_range(period, day):
+    """Returns the first day of the month, quarter or year containing `day`, and the first day after it."""
+    if period == 'month':
+        first = day.replace(day=1)
+        months = 1
+    elif period == 'quarter':
+        first = day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+        months = 3
+    elif period == 'year':
+        first = day.replace(month=1, day=1)
+        months = 12
+    else:
+        raise NotImplementedError('no heatmap for period {}'.format(period))
+
+    month = first.month - 1 + months
+    return first, first.replace(year=first.year + month // 12, month=month % 12 + 1)
+
+
+def _covered(boundaries, points):
+    """sum(max(0, boundary - point)) over `points` for every boundary, in plain Python."""
+    points = sorted(points)
+    prefix = [0.0] + list(accumulate(points))
+    covered = []
+    for boundary in boundaries:
+        count = bisect.bisect_left(points, boundary)
+        covered.append(count * boundary - prefix[count])
+    return covered
+
+
+def hourly_occupancy(starts, ends, hours):
+    """
+    Returns the seconds within spans of each of `hours` hours, for spans given as their start and end in seconds from
+    the start of the first hour.
+    """
+    if numpy is not None:
+        boundaries = numpy.arange(hours + 1, dtype=numpy.float64) * HOUR
+        covered = numpy.zeros(hours + 1)
+        for points, sign in ((starts, 1), (ends, -1)):
+            points = numpy.sort(numpy.asarray(points, dtype=numpy.float64))
+            prefix = numpy.concatenate(([0.0], numpy.cumsum(points)))
+            counts = numpy.searchsorted(points, boundaries, side='left')
+            covered += sign * (counts * boundaries - prefix[counts])
+        return numpy.clip(numpy.diff(covered), 0, HOUR).tolist()
+
+    boundaries = [hour * HOUR for hour in range(hours + 1)]
+    covered = [start - end for start, end in zip(_covered(boundaries, starts), _covered(boundaries, ends))]
+    return [min(max(after - before, 0), HOUR) for before, after in zip(covered, covered[1:])]
+
+
+class Heatmap(object):
+    """
+    The occupancy of `days` days from `first_day` by `spans`, (start, end) pairs of the spans starting in those days.
+
+    Open spans are closed at `now` if they're on today's date, otherwise at the end of their day, like in the week
+    table.
+    """
+
+    def __init__(self, first_day, days, spans, now=None):
+        self.first_day = first_day
+        self.days = days
+        self.now = now if now is not None else datetime.datetime.now()
+
+        origin, _ = datetime_range(first_day)
+        starts, ends = [], []
+        for start, end in spans:
+            if end is None:
+                if start.date() == self.now.date():
+                    end = max(start, self.now)
+                else:
+                    end = max(start, datetime.datetime.combine(start.date(), datetime.time(23, 59)))
+            starts.append((start - origin).total_seconds())
+            ends.append((end - origin).total_seconds())
+
+        self.seconds = hourly_occupancy(starts, ends, days * 24)
+
+    def rows(self):
+        """Yields (day, minutes in span of each hour, total time in span) for every day."""
+        for day_index in range(self.days):
+            seconds = self.seconds[day_index * 24:(day_index + 1) * 24]
+            yield (self.first_day + datetime.timedelta(days=day_index), [int(round(second / 60)) for second in seconds],
+                   datetime.timedelta(seconds=round(sum(seconds))))
+
+    def hour_totals(self):
+        """The time in span of each hour of the day, over all days."""
+        return [datetime.timedelta(seconds=round(sum(self.seconds[hour::24]))) for hour in range(24)]
+
+    def total(self):
+        return datetime.timedelta(seconds=round(sum(self.seconds)))
+
+
+def _cells(datum):
+    """The <td> of an hour for every number of minutes in span, so a row is just a join."""
+    return ['<td class="heat_cell" title="{} min" style="background-color: {};"></td>'.format(
+        minutes, datum.rgba(alpha=round(minutes / 60, 2))) for minutes in range(61)]
+
+
+def render_rows(heatmap, datum):
+    """Returns (day, row HTML, total) for every day of `heatmap`, in the color of `datum`."""
+    cells = _cells(datum)
+    return [(day, "".join([cells[minute] for minute in minutes]), format_timedelta(total, use_days=False))
+            for day, minutes, total in heatmap.rows()]
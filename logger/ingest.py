@@ -0,0 +1,257 @@
+import datetime
+import json
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import dedup, feed, routers
+from .buffer import get_buffer
+from .datum_cache import get_datums
+from .models import Datum, IngestKey, Value
+from .rollups import update_rollups
+from .spans import update_spans
+
+
+SAVED = "saved"
+QUEUED = "queued"
+DUPLICATE = "duplicate"
+
+
+class IngestError(ValueError):
+    pass
+
+
+def parse_timestamp(raw):
+    """Parse an ISO 8601 string or a number of seconds since the epoch into a naive local datetime."""
+    if raw is None:
+        return timezone.now()
+
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        try:
+            return datetime.datetime.fromtimestamp(raw)
+        except (OverflowError, OSError, ValueError):
+            raise IngestError("bad timestamp: {}".format(raw))
+
+    try:
+        timestamp = parse_datetime(str(raw))
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise IngestError("bad timestamp: {}".format(raw))
+
+    if timezone.is_aware(timestamp):
+        timestamp = timezone.make_naive(timestamp)
+
+    return timestamp
+
+
+def parse_value(datum, raw):
+    """Returns the Value field(s) to set for the raw value `raw` of `datum`, according to the datum's type."""
+    if datum.type == Datum.TIMESTAMP:
+        if raw not in (None, "timestamp"):
+            raise IngestError('timestamp datum but value was not "timestamp"')
+        return {}
+
+    if raw is None:
+        raise IngestError("missing value")
+
+    try:
+        if datum.type == Datum.INT:
+            if isinstance(raw, float) and not raw.is_integer():
+                raise ValueError
+            return {'int_value': int(raw)}
+        elif datum.type == Datum.FLOAT:
+            return {'float_value': float(raw)}
+        elif datum.type == Datum.STRING:
+            raw = str(raw)
+            if len(raw) > Value._meta.get_field('string_value').max_length:
+                raise ValueError
+            return {'string_value': raw}
+        elif datum.type == Datum.DATE:
+            date = parse_date(str(raw))
+            if date is None:
+                raise ValueError
+            return {'date_value': date}
+        elif datum.type == Datum.DATETIME:
+            return {'datetime_value': parse_timestamp(raw)}
+    except (TypeError, ValueError):
+        raise IngestError("bad value for {} datum: {}".format(datum.type, raw))
+
+    raise IngestError("handling for {} datums not implemented yet".format(datum.type))
+
+
+def parse_key(raw):
+    """The idempotency key of a value, see logger/dedup.py, or None if it has none."""
+    if raw is None or raw == "":
+        return None
+    if not isinstance(raw, str) or len(raw) > IngestKey._meta.get_field('key').max_length:
+        raise IngestError("bad key: keys are strings of at most {} characters".format(
+            IngestKey._meta.get_field('key').max_length))
+    return raw
+
+
+def _is_record_list(parsed):
+    return isinstance(parsed, list) and all(isinstance(record, (list, dict)) for record in parsed)
+
+
+def parse_records(body, content_type=None):
+    """
+    Parse a bulk ingest body into a list of records.
+
+    The body is either a JSON list of records, or newline delimited JSON with one record per line. A record is an
+    object with "slug", "timestamp" and "value" keys and an optional idempotency "key", or a [slug, timestamp, value]
+    or [slug, timestamp, value, key] list. Unless the content type says it's NDJSON, the body is taken as a JSON list
+    only if it parses as a list of records, so a single line of NDJSON with a list record is still one record.
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+
+    body = body.strip()
+    if content_type not in ('application/x-ndjson', 'application/ndjson'):
+        try:
+            records = json.loads(body)
+        except ValueError:
+            records = None
+        if _is_record_list(records):
+            return records
+
+    try:
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    except ValueError as e:
+        raise IngestError("malformed body: {}".format(e))
+
+
+def _unpack_record(record):
+    if isinstance(record, dict):
+        slug, timestamp, value = record.get('slug'), record.get('timestamp'), record.get('value')
+        key = record.get('key')
+    elif isinstance(record, list) and len(record) in (3, 4):
+        slug, timestamp, value, key = (record + [None])[:4]
+    else:
+        raise IngestError("malformed record")
+
+    if not isinstance(slug, str):
+        raise IngestError("missing slug")
+
+    return slug, timestamp, value, parse_key(key)
+
+
+def bulk_ingest(records):
+    """
+    Validate and save many records at once.
+
+    Slugs that aren't cached are resolved with one query, and the valid records are saved with a single bulk_create
+    in one transaction. Returns a status dict per record, in the same order as `records`. Records with the key of a
+    value logged before have the status "duplicate".
+    """
+    unpacked = []
+    for record in records:
+        try:
+            unpacked.append(_unpack_record(record))
+        except IngestError as e:
+            unpacked.append(e)
+
+    slugs = {record[0] for record in unpacked if not isinstance(record, IngestError)}
+    datums = get_datums(slugs)
+
+    results = []
+    values = []
+    value_results = {}
+    for record in unpacked:
+        try:
+            if isinstance(record, IngestError):
+                raise record
+            slug, timestamp, raw, key = record
+            datum = datums.get(slug)
+            if datum is None:
+                raise IngestError("no datum with slug {}".format(slug))
+            fields = parse_value(datum, raw)
+            value = Value(datum=datum, timestamp=parse_timestamp(timestamp), **fields)
+            value.dedup_key = key
+            values.append(value)
+            results.append({'status': 'ok'})
+            value_results[id(value)] = results[-1]
+        except IngestError as e:
+            results.append({'status': 'error', 'error': str(e)})
+
+    for value in store_values(values):
+        value_results[id(value)]['status'] = DUPLICATE
+
+    return results
+
+
+def build_value(datum, raw):
+    """Returns an unsaved Value of `datum` for the raw value of a log_value request."""
+    if datum.type == Datum.FLOAT:
+        try:
+            val = float(raw)
+        except Exception:
+            raise IngestError("bad val")
+        return Value(datum=datum, float_value=val)
+    elif datum.type == Datum.TIMESTAMP:
+        if raw != "timestamp":
+            raise IngestError('timestamp datum but value was not "timestamp"')
+
+        return Value(datum=datum)
+
+    raise NotImplementedError('handling for {} datums not implemented yet'.format(datum.type))
+
+
+def store_value(value):
+    """
+    Save a single value, or queue it when the write-behind buffer is enabled. Returns SAVED or QUEUED, or DUPLICATE
+    when the value has the key of a value logged before, and wasn't saved.
+
+    Unlike store_values this saves with Value.save(), so the spans of TIMESTAMP datums are updated incrementally.
+    """
+    if dedup.is_recent(value):
+        return DUPLICATE
+
+    ingest_buffer = get_buffer()
+    if ingest_buffer is not None:
+        ingest_buffer.put([value])
+        dedup.remember([value])
+        return QUEUED
+
+    with transaction.atomic():
+        new, _ = dedup.claim([value])
+        if new:
+            value.save()
+            update_rollups([value])
+    dedup.remember([value])
+    return SAVED if new else DUPLICATE
+
+
+def store_values(values):
+    """
+    Save unsaved values, or queue them when the write-behind buffer is enabled. Returns the values that weren't
+    because they have the key of a value logged before. Queued values are only checked against recent keys until
+    they're saved.
+    """
+    duplicates = [value for value in values if dedup.is_recent(value)]
+    if duplicates:
+        values = [value for value in values if not dedup.is_recent(value)]
+
+    ingest_buffer = get_buffer()
+    if ingest_buffer is not None:
+        ingest_buffer.put(values)
+    else:
+        duplicates.extend(save_values(values))
+    dedup.remember(values)
+    return duplicates
+
+
+def save_values(values, batch_size=None):
+    """
+    Insert unsaved values with bulk_create, and bring the rollups and spans they affect up to date. Values with the key
+    of a value saved before are left out, and returned.
+    """
+    with transaction.atomic():
+        values, duplicates = dedup.claim(values)
+        Value.objects.bulk_create(values, batch_size=batch_size)
+        update_rollups(values)
+        update_spans(values)
+        feed.publish(value.datum_id for value in values)
+        routers.record_writes(value.datum.user_id for value in values)
+    return duplicates
@@ -0,0 +1,108 @@
+"""
+The ingest endpoints without Django's request handling, for the ingest-only applications in logger/asgi.py and
+logger/wsgi.py.
+
+Devices don't use sessions, CSRF, auth or messages, so these applications answer ingest requests without the
+middleware and URL resolving of the site. The short routes under /-/ are matched first with string operations:
+GET /-/<slug>/<value> answers with only "saved", "queued" or "duplicate", and proper status codes for errors, and
+POST /-/bulk like bulk_log_values. A slug is never "-", underscore_slugify turns hyphens into underscores, so the
+prefix can't shadow the values of a datum. The routes of the site, GET /<slug>/<value> like log_value and POST /bulk/,
+keep answering like the site does.
+"""
+import json
+import re
+from collections import namedtuple
+from urllib.parse import parse_qs, unquote
+
+from django.db import close_old_connections
+
+from .buffer import get_buffer
+from .datum_cache import get_datum
+from .ingest import IngestError, build_value, bulk_ingest, parse_key, parse_records, store_value
+from .models import Datum
+
+PREFIX = "/-/"
+LOG_VALUE_RE = re.compile(r'^/(?P<slug>[^/]+)/(?P<value>[^/]+)/?$')
+BULK_RE = re.compile(r'^/bulk/?$')
+
+# a matched request: bulk or a single value with its slug and raw value, on a short route or a route of the site
+Route = namedtuple('Route', ['bulk', 'short', 'slug', 'value'])
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+def route(method, path):
+    """Returns the Route of a request, or raises HttpError."""
+    if path.startswith(PREFIX):
+        rest = path[len(PREFIX):]
+        if rest in ("bulk", "bulk/"):
+            match = Route(True, True, None, None)
+        else:
+            parts = rest.rstrip("/").split("/")
+            if len(parts) != 2 or not all(parts):
+                raise HttpError(404, "not found")
+            match = Route(False, True, unquote(parts[0]), unquote(parts[1]))
+    elif BULK_RE.match(path):
+        match = Route(True, False, None, None)
+    else:
+        found = LOG_VALUE_RE.match(path)
+        if found is None:
+            raise HttpError(404, "not found")
+        match = Route(False, False, unquote(found.group('slug')), unquote(found.group('value')))
+
+    if match.bulk and method != 'POST':
+        raise HttpError(405, "POST only")
+    return match
+
+
+def query_key(query_string):
+    """The idempotency key in the ?key= of a query string, or None."""
+    return parse_qs(query_string).get('key', [None])[0]
+
+
+def log_value(match, key):
+    """Saves the value of a matched log_value request. Returns the status code and text of the response."""
+    try:
+        datum = get_datum(match.slug)
+    except Datum.DoesNotExist:
+        raise HttpError(404, "no datum with slug {}".format(match.slug))
+
+    try:
+        value = build_value(datum, match.value)
+        value.dedup_key = parse_key(key)
+    except IngestError as e:
+        if match.short:
+            raise HttpError(400, str(e))
+        return 200, str(e)
+    except NotImplementedError as e:
+        raise HttpError(400, str(e))
+
+    status = store_value(value)
+    if match.short:
+        return 200, status
+    return 200, "{}: slug: {}, value: {}".format(status, match.slug, value)
+
+
+def bulk_log_values(body, content_type):
+    """Saves the records of a bulk request. Returns the status code and JSON text of the response."""
+    try:
+        records = parse_records(body, content_type)
+    except IngestError as e:
+        raise HttpError(400, json.dumps({'error': str(e)}))
+
+    results = bulk_ingest(records)
+    saved = sum(1 for result in results if result['status'] == 'ok')
+    return 200, json.dumps({'saved': saved, 'queued': get_buffer() is not None, 'results': results})
+
+
+def call(function, *args):
+    """Run a handler like Django runs a view, with the database connections cleaned up before and after."""
+    close_old_connections()
+    try:
+        return function(*args)
+    finally:
+        close_old_connections()
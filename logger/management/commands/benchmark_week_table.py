@@ -0,0 +1,45 @@
+import datetime
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from logger.benchmarks import synthetic_spans
+from logger.models import Datum
+from logger.timeline import WeekTimeline
+from logger.timestamp_table import cell_html, cell_style
+from logger.utils import monday_this_week
+
+
+class Command(BaseCommand):
+    help = ("Time building and rendering the week table rows of a synthetic TIMESTAMP datum, for a month or a year "
+            "of weeks. Nothing is read from or written to the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=53, help="weeks in the grid, eg. 5 for a month")
+        parser.add_argument('--repeat', type=int, default=5, help="best of this many runs is reported")
+
+    def handle(self, *args, **options):
+        datum = Datum(name="benchmark", type=Datum.TIMESTAMP)
+        from_date = monday_this_week() - datetime.timedelta(weeks=options['weeks'])
+        spans = synthetic_spans(datum, from_date, options['weeks'] * 7)
+        timelines = [WeekTimeline(from_date + datetime.timedelta(weeks=week),
+                                  [span for span in spans if (span.start.date() - from_date).days // 7 == week])
+                     for week in range(options['weeks'])]
+
+        def build():
+            return [row for timeline in timelines for row in timeline.table_rows(datum)]
+
+        rows = build()
+
+        def render():
+            return "".join([row.render() for row in rows])
+
+        def render_cold():
+            cell_html.cache_clear()
+            cell_style.cache_clear()
+            return render()
+
+        for name, function in (("build", build), ("render, cold cache", render_cold), ("render", render)):
+            seconds = min(timeit.repeat(function, number=1, repeat=options['repeat']))
+            self.stdout.write("{}: {:.2f} ms for {} rows of {} cells".format(name, seconds * 1000, len(rows),
+                                                                            len(rows[0]) if rows else 0))
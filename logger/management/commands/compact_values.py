@@ -0,0 +1,29 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from logger.chunks import compact
+from logger.models import Datum
+
+
+class Command(BaseCommand):
+    help = ("Pack the values of datums with chunk storage into compressed chunks, one per hour, for the hours that "
+            "ended at least --age hours ago.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', help="slugs of the datums to compact, all chunk datums if omitted")
+        parser.add_argument('--age', type=float, default=2, help="hours before a window is compacted")
+
+    def handle(self, *args, **options):
+        datums = Datum.objects.filter(storage=Datum.CHUNKS)
+        if options['slugs']:
+            datums = datums.filter(slug__in=options['slugs'])
+            missing = set(options['slugs']) - set(datums.values_list('slug', flat=True))
+            if missing:
+                raise CommandError("no chunk datum with slug(s) {}".format(", ".join(sorted(missing))))
+
+        before = timezone.now() - datetime.timedelta(hours=options['age'])
+        for datum in datums:
+            windows, values = compact(datum, before)
+            self.stdout.write("{}: {} values in {} chunks".format(datum.slug, values, windows))
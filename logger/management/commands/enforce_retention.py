@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from logger import partitions
+from logger.models import Datum
+from logger.retention import DEFAULT_BATCH_SIZE, enforce_retention, expire_keys
+
+
+class Command(BaseCommand):
+    help = ("Downsample and delete the raw values and hourly rollups that are older than their datum's retention "
+            "settings, and the expired idempotency keys of ingested values. Rows are deleted in small batches, so it "
+            "can run while values are being ingested.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', help="slugs of the datums to prune, all with retention if omitted")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="rows per DELETE")
+        parser.add_argument('--pause', type=float, default=0, help="seconds to sleep between batches")
+
+    def handle(self, *args, **options):
+        datums = Datum.objects.filter(Q(raw_retention_days__isnull=False) | Q(hourly_retention_days__isnull=False))
+        if options['slugs']:
+            datums = datums.filter(slug__in=options['slugs'])
+            missing = set(options['slugs']) - set(datums.values_list('slug', flat=True))
+            if missing:
+                raise CommandError("no datum with retention settings and slug(s) {}".format(
+                    ", ".join(sorted(missing))))
+
+        # with a partitioned value table, whole months are dropped first and only what's left is deleted by rows
+        if not options['slugs'] and partitions.is_partitioned():
+            for month in partitions.drop_expired(timezone.now()):
+                self.stdout.write("dropped the values of {:%Y-%m}".format(month))
+
+        rows = seconds = 0
+        for datum in datums:
+            result = enforce_retention(datum, batch_size=options['batch_size'], pause=options['pause'])
+            rows += result.rows
+            seconds += result.seconds
+            self.stdout.write("{}: downsampled {} days, deleted {} values, {} chunks and {} hourly rollups "
+                              "in {:.1f}s ({:.0f} rows/s)".format(datum.slug, result.days, result.values, result.chunks,
+                                                                  result.rollups, result.seconds,
+                                                                  result.rows_per_second))
+
+        self.stdout.write("deleted {} rows in {:.1f}s ({:.0f} rows/s)".format(rows, seconds,
+                                                                            rows / seconds if seconds else 0))
+
+        if not options['slugs']:
+            self.stdout.write("deleted {} expired ingest keys".format(
+                expire_keys(batch_size=options['batch_size'], pause=options['pause'])))
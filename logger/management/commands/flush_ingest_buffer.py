@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from logger.buffer import FILE, get_buffer
+
+
+class Command(BaseCommand):
+    help = ("Drain the file ingest buffer into the database, whenever LOGGER_INGEST_BUFFER_SIZE values are waiting or "
+            "every LOGGER_INGEST_BUFFER_DELAY seconds")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="flush what's buffered and exit")
+
+    def handle(self, *args, **options):
+        if settings.LOGGER_INGEST_BUFFER != FILE:
+            raise CommandError('LOGGER_INGEST_BUFFER is not "{}"'.format(FILE))
+
+        ingest_buffer = get_buffer()
+        if options['once']:
+            self.flush(ingest_buffer)
+            return
+
+        poll_interval = ingest_buffer.max_delay / 10
+        last_flush = time.time()
+        while True:
+            time.sleep(poll_interval)
+            if ingest_buffer.depth() >= ingest_buffer.max_size or time.time() - last_flush >= ingest_buffer.max_delay:
+                self.flush(ingest_buffer)
+                last_flush = time.time()
+
+    def flush(self, ingest_buffer):
+        count = ingest_buffer.flush()
+        if count:
+            stats = ingest_buffer.stats_dict()
+            self.stdout.write("flushed {} values in {:.3f}s, {} waiting".format(count, stats['last_flush_seconds'],
+                                                                              stats['depth']))
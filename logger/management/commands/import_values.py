@@ -0,0 +1,184 @@
+import csv
+import gzip
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from logger.ingest import IngestError, parse_timestamp, parse_value, save_values
+from logger.models import Datum, Value
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ("Import values from a CSV or NDJSON file, optionally gzipped, or from stdin. Records have slug, timestamp "
+            "and value columns, the slug can be given with --slug instead. Values that already exist for the same "
+            "datum and timestamp are skipped, records without a timestamp are errors.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="file to import, - for stdin (the default)")
+        parser.add_argument('--slug', help="datum for records without a slug")
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help="input format, guessed from the file name if omitted, csv for stdin")
+        parser.add_argument('--gzip', action='store_true', help="input is gzipped, implied by a .gz file name")
+        parser.add_argument('--batch-size', type=int, default=1000, help="values per bulk_create")
+        parser.add_argument('--transaction-size', type=int, default=10, help="batches per transaction")
+        parser.add_argument('--offset', type=int, default=0,
+                            help="resume from this byte offset of the (uncompressed) input, as reported by a "
+                                 "previous run")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        compressed = options['gzip'] or path.endswith('.gz')
+        name = path[:-3] if path.endswith('.gz') else path
+        input_format = options['format'] or ('ndjson' if name.endswith(('.ndjson', '.jsonl', '.json')) else 'csv')
+
+        if path == '-':
+            stream = sys.stdin.buffer
+        else:
+            try:
+                stream = open(path, 'rb')
+            except OSError as e:
+                raise CommandError(e)
+        source = stream
+
+        if compressed:
+            stream = gzip.GzipFile(fileobj=source)
+
+        self.default_slug = options['slug']
+        self.datums = {}
+        self.read = self.saved = self.skipped = self.errors = 0
+        self.started = time.time()
+
+        try:
+            records = self.records(stream, input_format, options['offset'])
+            chunk_size = options['batch_size'] * options['transaction_size']
+            offset = options['offset']
+            for chunk in _chunks(records, chunk_size):
+                with transaction.atomic():
+                    for batch in _chunks(chunk, options['batch_size']):
+                        self.save_batch(batch)
+                offset = chunk[-1][0]
+                self.report(offset)
+        finally:
+            stream.close()
+            if source is not sys.stdin.buffer:
+                source.close()
+
+        self.stdout.write("done: {} read, {} saved, {} skipped as duplicates, {} errors".format(
+            self.read, self.saved, self.skipped, self.errors))
+
+    def records(self, stream, input_format, offset):
+        """
+        Yields (offset after the record, record dict) for each record in the stream, starting at `offset`.
+
+        CSV is read with a single csv.reader, so quoted fields can span lines. Offsets are counted in bytes as lines
+        are read, rather than with tell(), which stdin doesn't support, and are at a record boundary whenever the
+        reader returns a row.
+        """
+        position = 0
+
+        def lines():
+            nonlocal position
+            for line in stream:
+                position += len(line)
+                yield line.decode('utf-8')
+
+        text_lines = lines()
+        reader = header = None
+        if input_format == 'csv':
+            reader = csv.reader(text_lines)
+            header = next(reader, None)
+            if not header:
+                return
+
+        if offset > position:
+            if stream.seekable():
+                stream.seek(offset)
+            else:
+                stream.read(offset - position)
+            position = offset
+
+        if input_format == 'csv':
+            for row in reader:
+                if row:
+                    yield position, dict(zip(header, row))
+            return
+
+        for text in text_lines:
+            text = text.strip()
+            if not text:
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                record = e
+            yield position, record
+
+    def datum(self, slug):
+        if slug not in self.datums:
+            self.datums[slug] = Datum.objects.filter(slug=slug).first()
+        return self.datums[slug]
+
+    def parse(self, record):
+        if not isinstance(record, dict):
+            raise IngestError("malformed record")
+
+        slug = record.get('slug') or self.default_slug
+        datum = self.datum(slug)
+        if datum is None:
+            raise IngestError("no datum with slug {}".format(slug))
+
+        raw = record.get('value')
+        if raw == '' or datum.type == Datum.TIMESTAMP:  # exports of timestamp datums repeat the timestamp as value
+            raw = None
+
+        # ingest takes a missing timestamp as now, which is never what a historical record means
+        if record.get('timestamp') in (None, ''):
+            raise IngestError("missing timestamp")
+
+        return Value(datum=datum, timestamp=parse_timestamp(record['timestamp']), **parse_value(datum, raw))
+
+    def save_batch(self, batch):
+        values = []
+        for offset, record in batch:
+            self.read += 1
+            try:
+                values.append(self.parse(record))
+            except IngestError as e:
+                self.errors += 1
+                self.stderr.write("record ending at byte {}: {}".format(offset, e))
+
+        # skip values that are already stored, or repeated within the batch, with one range query per datum
+        new_values = []
+        for datum in {value.datum for value in values}:
+            datum_values = [value for value in values if value.datum == datum]
+            timestamps = [value.timestamp for value in datum_values]
+            seen = set(Value.objects.filter(datum=datum, timestamp__gte=min(timestamps), timestamp__lte=max(timestamps))
+                       .values_list('timestamp', flat=True))
+            for value in datum_values:
+                if value.timestamp in seen:
+                    self.skipped += 1
+                    continue
+                seen.add(value.timestamp)
+                new_values.append(value)
+
+        save_values(new_values)
+        self.saved += len(new_values)
+
+    def report(self, offset):
+        elapsed = time.time() - self.started
+        self.stdout.write("{} read, {} saved, {} skipped, {} errors, {:.0f} values/s, resume with --offset {}".format(
+            self.read, self.saved, self.skipped, self.errors, self.read / elapsed if elapsed else 0, offset))
@@ -0,0 +1,45 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from logger import partitions
+
+
+class Command(BaseCommand):
+    help = ("Manage the monthly partitions of the value table on MySQL: partition it with --enable, add the "
+            "partitions of the coming months, which should run every month, or drop or detach old months. See "
+            "logger/partitions.py.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enable', action='store_true', help="partition the value table, which rebuilds it")
+        parser.add_argument('--months-ahead', type=int, default=3, help="months to have partitions for after this one")
+        parser.add_argument('--drop-before',
+                            help="drop the months before this month, as YYYY-MM, once their values are downsampled")
+        parser.add_argument('--detach', action='store_true',
+                            help="move the dropped months into tables of their own rather than deleting them")
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported():
+            raise CommandError("partitioning the value table needs MySQL")
+
+        if options['enable']:
+            if partitions.is_partitioned():
+                raise CommandError("the value table is already partitioned")
+            partitions.enable(options['months_ahead'])
+        elif not partitions.is_partitioned():
+            raise CommandError("the value table isn't partitioned, run with --enable first")
+        else:
+            for month in partitions.add_months(options['months_ahead']):
+                self.stdout.write("added {}".format(partitions.partition_name(month)))
+
+        if options['drop_before']:
+            try:
+                before = datetime.datetime.strptime(options['drop_before'], "%Y-%m").date()
+            except ValueError:
+                raise CommandError("bad month: {}".format(options['drop_before']))
+            for month in partitions.drop_months(before, detach=options['detach']):
+                self.stdout.write("{} {}".format("detached" if options['detach'] else "dropped",
+                                                 partitions.partition_name(month)))
+
+        for name, rows in partitions.partitions():
+            self.stdout.write("{}: about {} values".format(name, rows))
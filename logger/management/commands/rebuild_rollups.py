@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from logger.models import Datum
+from logger.rollups import NUMERIC_TYPES, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly and daily rollups of numeric datums from their raw values"
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', help="slugs of the datums to rebuild, all numeric datums if omitted")
+
+    def handle(self, *args, **options):
+        datums = Datum.objects.filter(type__in=NUMERIC_TYPES)
+        if options['slugs']:
+            datums = datums.filter(slug__in=options['slugs'])
+            missing = set(options['slugs']) - set(datums.values_list('slug', flat=True))
+            if missing:
+                raise CommandError("no numeric datum with slug(s) {}".format(", ".join(sorted(missing))))
+
+        for datum in datums:
+            count = rebuild_rollups(datum)
+            self.stdout.write("{}: {} rollups".format(datum.slug, count))
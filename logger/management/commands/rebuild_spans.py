@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from logger.models import Datum
+from logger.spans import rebuild_spans
+
+
+class Command(BaseCommand):
+    help = "Recompute the spans of timestamp datums from their raw values"
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', help="slugs of the datums to rebuild, all timestamp datums if omitted")
+
+    def handle(self, *args, **options):
+        datums = Datum.objects.filter(type=Datum.TIMESTAMP)
+        if options['slugs']:
+            datums = datums.filter(slug__in=options['slugs'])
+            missing = set(options['slugs']) - set(datums.values_list('slug', flat=True))
+            if missing:
+                raise CommandError("no timestamp datum with slug(s) {}".format(", ".join(sorted(missing))))
+
+        for datum in datums:
+            count = rebuild_spans(datum)
+            self.stdout.write("{}: {} spans".format(datum.slug, count))
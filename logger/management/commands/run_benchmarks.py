@@ -0,0 +1,79 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from logger import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Generate synthetic data in a test database and time the hot paths: log_value, the week table of dense "
+            "and sparse weeks, rendering a year of week tables, the index and exports. Writes the results as JSON, "
+            "and fails when they regress past --thresholds or a --baseline of earlier results.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', help="names of the cases to run, all if omitted")
+        parser.add_argument('--values', type=int, default=100000, help="values to generate, mostly numeric")
+        parser.add_argument('--days', type=int, default=365, help="days of history to generate")
+        parser.add_argument('--repeat', type=int, default=5, help="runs of each case, the median is compared")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="file to write the results to, they're printed if omitted")
+        parser.add_argument('--thresholds', help="JSON file of max_queries and max_seconds per case")
+        parser.add_argument('--baseline', help="results of an earlier run to compare with")
+        parser.add_argument('--tolerance', type=float, default=1.5,
+                            help="how many times slower than the baseline a case may be")
+        parser.add_argument('--keepdb', action='store_true',
+                            help="keep the test database and its data between runs, rather than generating it again")
+
+    def handle(self, *args, **options):
+        unknown = set(options['cases']) - {case.name for case in benchmarks.CASES}
+        if unknown:
+            raise CommandError("no benchmark case(s) {}".format(", ".join(sorted(unknown))))
+
+        thresholds = baseline = None
+        if options['thresholds']:
+            with open(options['thresholds']) as f:
+                thresholds = json.load(f)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['results']
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            datums = benchmarks.find_datums() if options['keepdb'] else None
+            if datums is None:
+                datums = benchmarks.generate(options['values'], options['days'], seed=options['seed'],
+                                             out=self.stderr)
+            results = benchmarks.run(datums, options['repeat'], options['cases'])
+        finally:
+            if not options['keepdb']:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'values': options['values'],
+            'days': options['days'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        for name, result in sorted(results.items()):
+            self.stderr.write("{}: {:.3f} ms, {:g} queries".format(name, result['median_seconds'] * 1000,
+                                                                    result['queries']))
+
+        messages = benchmarks.regressions(results, thresholds, baseline, options['tolerance'])
+        if messages:
+            raise CommandError("regressions:\n" + "\n".join(messages))
@@ -0,0 +1,71 @@
+import datetime
+
+import pytz
+from django.core.management.base import BaseCommand, CommandError
+
+from logger.datafixes import DEFAULT_BATCH_SIZE, shift_timestamps, timezone_shifts
+from logger.models import Datum, Value, ValueChunk
+from logger.utils import parse_datetime_or_date
+
+
+class Command(BaseCommand):
+    help = ("Move the timestamps of datums' values, either by a fixed amount or from one time zone to another. "
+            "Each datum is updated with set based UPDATEs in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='+', help="slugs of the datums to correct")
+        parser.add_argument('--hours', type=float, default=0, help="hours to move the timestamps by, may be negative")
+        parser.add_argument('--minutes', type=float, default=0)
+        parser.add_argument('--seconds', type=float, default=0)
+        parser.add_argument('--from-tz', help="time zone the timestamps were recorded in, eg. UTC")
+        parser.add_argument('--to-tz', help="time zone the timestamps should be in, eg. CET")
+        parser.add_argument('--start', help="only correct timestamps from this date or datetime")
+        parser.add_argument('--end', help="only correct timestamps before this date or datetime")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="value ids per UPDATE")
+        parser.add_argument('--dry-run', action='store_true', help="only count the values that would be moved")
+
+    def handle(self, *args, **options):
+        bounds = {}
+        for bound in ('start', 'end'):
+            bounds[bound] = None
+            if options[bound]:
+                bounds[bound] = parse_datetime_or_date(options[bound])
+                if bounds[bound] is None:
+                    raise CommandError("bad {}: {}".format(bound, options[bound]))
+
+        delta = datetime.timedelta(hours=options['hours'], minutes=options['minutes'], seconds=options['seconds'])
+        if bool(options['from_tz']) != bool(options['to_tz']):
+            raise CommandError("--from-tz and --to-tz must be given together")
+        if options['from_tz'] and delta:
+            raise CommandError("give either a time zone change or an amount of time, not both")
+        if not options['from_tz'] and not delta:
+            raise CommandError("nothing to do, give an amount of time or a time zone change")
+
+        datums = Datum.objects.filter(slug__in=options['slugs'])
+        missing = set(options['slugs']) - set(datums.values_list('slug', flat=True))
+        if missing:
+            raise CommandError("no datum with slug(s) {}".format(", ".join(sorted(missing))))
+        compacted = ValueChunk.objects.filter(datum__in=datums).values_list('datum__slug', flat=True).distinct()
+        if compacted:
+            raise CommandError("compacted values can't be moved, datum(s) {}".format(", ".join(sorted(compacted))))
+
+        for datum in datums:
+            if options['from_tz']:
+                start, end = bounds['start'], bounds['end']
+                if start is None or end is None:
+                    values = Value.objects.filter(datum=datum).order_by('timestamp')
+                    first, last = values.first(), values.last()
+                    if first is None:
+                        continue
+                    start = start or first.timestamp
+                    end = end or last.timestamp + datetime.timedelta(microseconds=1)
+                try:
+                    shifts = timezone_shifts(options['from_tz'], options['to_tz'], start, end)
+                except pytz.UnknownTimeZoneError as e:
+                    raise CommandError("unknown time zone: {}".format(e))
+            else:
+                shifts = [(bounds['start'], bounds['end'], delta)]
+
+            moved = shift_timestamps(datum, shifts, batch_size=options['batch_size'], dry_run=options['dry_run'])
+            self.stdout.write("{}: {} {} values".format(datum.slug, "would move" if options['dry_run'] else "moved",
+                                                        moved))
@@ -0,0 +1,257 @@
+"""
+Per view query counts and latencies, as a structured log line per request and as histograms for Prometheus.
+
+With LOGGER_METRICS set, requests are measured by MetricsMiddleware, which settings installs unless
+LOGGER_METRICS_MIDDLEWARE is turned off, and by views with the `instrumented` decorator. Each request is split into
+the time spent in SQL queries, in rendering templates, and the rest which is Python. Queries are timed by swapping
+Django's debug cursor for a TimedCursor for the duration of the request, and templates by wrapping the template
+backend's render once.
+
+Histograms live in the process, so with several worker processes every scrape only sees the worker that answered it.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+from django.http import Http404, HttpResponse
+from django.template.backends.django import Template
+
+from .buffer import get_buffer
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram(object):
+    """A Prometheus histogram with a label for the view, safe to observe from several threads."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}  # view -> [count per bucket, count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self.lock:
+            series = self.series.get(view)
+            if series is None:
+                series = self.series[view] = [[0] * len(self.buckets), 0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def lines(self):
+        yield "# HELP {} {}".format(self.name, self.documentation)
+        yield "# TYPE {} histogram".format(self.name)
+        with self.lock:
+            series = sorted((view, list(counts), count, total) for view, (counts, count, total) in self.series.items())
+        for view, counts, count, total in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield '{}_bucket{{view="{}",le="{}"}} {}'.format(self.name, view, bound, bucket_count)
+            yield '{}_bucket{{view="{}",le="+Inf"}} {}'.format(self.name, view, count)
+            yield '{}_sum{{view="{}"}} {}'.format(self.name, view, total)
+            yield '{}_count{{view="{}"}} {}'.format(self.name, view, count)
+
+
+REQUEST_SECONDS = Histogram("logger_request_seconds", "Time to answer a request.", LATENCY_BUCKETS)
+DB_SECONDS = Histogram("logger_request_db_seconds", "Time spent in SQL queries per request.", LATENCY_BUCKETS)
+TEMPLATE_SECONDS = Histogram("logger_request_template_seconds", "Time spent rendering templates per request.",
+                             LATENCY_BUCKETS)
+PYTHON_SECONDS = Histogram("logger_request_python_seconds", "Time spent outside SQL and templates per request.",
+                           LATENCY_BUCKETS)
+QUERIES = Histogram("logger_request_queries", "SQL queries per request.", QUERY_BUCKETS)
+
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, TEMPLATE_SECONDS, PYTHON_SECONDS, QUERIES)
+
+_local = threading.local()
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        measurement = getattr(_local, 'measurement', None)
+        if measurement is None:
+            return render(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(*args, **kwargs)
+        finally:
+            measurement.template_seconds += time.perf_counter() - started
+    wrapper.timed = True
+    return wrapper
+
+
+if not getattr(Template.render, 'timed', False):
+    Template.render = _timed_render(Template.render)
+
+
+class TimedCursor(CursorWrapper):
+    """A cursor that adds the number and duration of its queries to a Measurement."""
+
+    def __init__(self, cursor, db, measurement):
+        super(TimedCursor, self).__init__(cursor, db)
+        self.measurement = measurement
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursor, self).execute(sql, params)
+        finally:
+            self.measurement.add_query(time.perf_counter() - started)
+
+    def executemany(self, sql, param_list):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursor, self).executemany(sql, param_list)
+        finally:
+            self.measurement.add_query(time.perf_counter() - started)
+
+
+class Measurement(object):
+    """The queries and time of one request, from start() to stop()."""
+
+    def __init__(self, view):
+        self.view = view
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+    def add_query(self, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+
+    def _cursor_factory(self, connection):
+        # keep Django's query log working when something else turned it on, like DEBUG or assertNumQueries
+        logging_queries = connection.queries_logged
+        make_debug_cursor = connection.make_debug_cursor
+
+        def make_cursor(cursor):
+            if logging_queries:
+                cursor = make_debug_cursor(cursor)
+            return TimedCursor(cursor, connection, self)
+        return make_cursor
+
+    def start(self):
+        self.debug_cursors = {}
+        for connection in connections.all():
+            self.debug_cursors[connection.alias] = connection.force_debug_cursor
+            connection.make_debug_cursor = self._cursor_factory(connection)
+            connection.force_debug_cursor = True
+        _local.measurement = self
+        self.started = time.perf_counter()
+
+    def stop(self, status):
+        self.seconds = time.perf_counter() - self.started
+        _local.measurement = None
+
+        for connection in connections.all():
+            connection.force_debug_cursor = self.debug_cursors[connection.alias]
+            del connection.make_debug_cursor  # back to the method of the class
+
+        self.python_seconds = max(self.seconds - self.db_seconds - self.template_seconds, 0.0)
+        self.status = status
+        self.record()
+
+    def record(self):
+        REQUEST_SECONDS.observe(self.view, self.seconds)
+        DB_SECONDS.observe(self.view, self.db_seconds)
+        TEMPLATE_SECONDS.observe(self.view, self.template_seconds)
+        PYTHON_SECONDS.observe(self.view, self.python_seconds)
+        QUERIES.observe(self.view, self.queries)
+
+        log.info(json.dumps({
+            'view': self.view,
+            'status': self.status,
+            'queries': self.queries,
+            'seconds': round(self.seconds, 6),
+            'db_seconds': round(self.db_seconds, 6),
+            'template_seconds': round(self.template_seconds, 6),
+            'python_seconds': round(self.python_seconds, 6),
+        }))
+
+
+def _view_name(request, default):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None and match.url_name:
+        return match.url_name
+    return default
+
+
+class MetricsMiddleware(object):
+    """Measures every request, under the name of the URL pattern of its view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        measurement = Measurement(None)
+        request.metrics_measurement = measurement
+        measurement.start()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            measurement.view = _view_name(request, "unresolved")
+            measurement.stop(status)
+
+
+def instrumented(view):
+    """Measure a view when LOGGER_METRICS is set, for when the middleware isn't installed. Does nothing when it is."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.LOGGER_METRICS or hasattr(request, 'metrics_measurement'):
+            return view(request, *args, **kwargs)
+
+        measurement = Measurement(_view_name(request, view.__name__))
+        request.metrics_measurement = measurement
+        measurement.start()
+        status = 500
+        try:
+            response = view(request, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            measurement.stop(status)
+
+    return wrapper
+
+
+_BUFFER_COUNTERS = ('queued', 'flushed', 'flushes', 'failed_flushes', 'rejected', 'failed_files')
+
+
+def buffer_lines():
+    """The stats of the ingest buffer, if there is one."""
+    ingest_buffer = get_buffer()
+    if ingest_buffer is None:
+        return
+    for name, value in sorted(ingest_buffer.stats_dict().items()):
+        name = "logger_ingest_buffer_{}".format(name)
+        if name.endswith(_BUFFER_COUNTERS):
+            yield "# TYPE {}_total counter".format(name)
+            yield "{}_total {}".format(name, value)
+        else:
+            yield "# TYPE {} gauge".format(name)
+            yield "{} {}".format(name, value)
+
+
+def metrics(request):
+    """The histograms in the Prometheus text format, only served when LOGGER_METRICS is set."""
+    if not settings.LOGGER_METRICS:
+        raise Http404("metrics are disabled")
+
+    lines = [line for histogram in HISTOGRAMS for line in histogram.lines()]
+    lines.extend(buffer_lines())
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
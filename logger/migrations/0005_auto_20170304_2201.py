@@ -5,18 +5,13 @@ from __future__ import unicode_literals
 import datetime
 
 from django.db import migrations
+from django.db.models import F
 
-from logger.models import Datum, Value
 
-
-# this is absolutely filthy, may god have mercy on my soul
 def increment_hour_by_one(apps, schema_editor):
-    work = Datum.objects.filter(slug="work")
-    values = Value.objects.filter(datum=work)
+    Value = apps.get_model('logger', 'Value')
 
-    for value in values:
-        value.timestamp += datetime.timedelta(hours=1)
-        value.save()
+    Value.objects.filter(datum__slug="work").update(timestamp=F('timestamp') + datetime.timedelta(hours=1))
 
 
 class Migration(migrations.Migration):
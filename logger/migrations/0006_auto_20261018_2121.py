@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:21
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0005_auto_20170304_2201'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='value',
+            index_together=set([('datum', 'timestamp')]),
+        ),
+    ]
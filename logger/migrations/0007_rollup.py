@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0006_auto_20261018_2121'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=5)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('sum', models.FloatField(default=0.0)),
+                ('min', models.FloatField(blank=True, null=True)),
+                ('max', models.FloatField(blank=True, null=True)),
+                ('last', models.FloatField(blank=True, null=True)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('datum', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='logger.Datum')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='rollup',
+            unique_together=set([('datum', 'resolution', 'bucket')]),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def pair_existing_values(apps, schema_editor):
+    Datum = apps.get_model('logger', 'Datum')
+    Value = apps.get_model('logger', 'Value')
+    Span = apps.get_model('logger', 'Span')
+
+    for datum in Datum.objects.filter(type='TIMESTAMP'):
+        timestamps = Value.objects.filter(datum=datum).order_by('timestamp').values_list('timestamp', flat=True)
+
+        spans = []
+        span = None
+        for timestamp in timestamps.iterator():
+            if span is not None and span.start.date() != timestamp.date():  # pairing restarts every day
+                span = None
+
+            if span is None:
+                span = Span(datum=datum, start=timestamp)
+                spans.append(span)
+            else:
+                span.end = timestamp
+                span.duration = timestamp - span.start
+                span = None
+
+        Span.objects.bulk_create(spans, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0007_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Span',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('datum', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='logger.Datum')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='span',
+            index_together=set([('datum', 'start')]),
+        ),
+        migrations.RunPython(pair_existing_values, migrations.RunPython.noop),
+    ]
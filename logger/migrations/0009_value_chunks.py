@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0008_span'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValueChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='datum',
+            name='storage',
+            field=models.CharField(choices=[('ROWS', 'One row per value'), ('CHUNKS', 'Compressed chunks')], default='ROWS', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='valuechunk',
+            name='datum',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='logger.Datum'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='valuechunk',
+            unique_together=set([('datum', 'start')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0009_value_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datum',
+            name='hourly_retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datum',
+            name='pruned_before',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='datum',
+            name='raw_retention_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
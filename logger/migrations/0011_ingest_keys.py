@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 21:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0010_datum_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('datum', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='logger.Datum')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingestkey',
+            unique_together=set([('datum', 'key')]),
+        ),
+    ]
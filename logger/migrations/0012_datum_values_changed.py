@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 22:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0011_ingest_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datum',
+            name='values_changed',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -35,6 +36,18 @@ class Datum(models.Model):
                     (DATE, "Date"),
                     (DATETIME, "Date & time"),
                     (TIMESTAMP, "Timestamp")]
+    # the Value field holding the values of each type, timestamps only use Value.timestamp
+    VALUE_FIELDS = {INT: "int_value",
+                    FLOAT: "float_value",
+                    STRING: "string_value",
+                    DATE: "date_value",
+                    DATETIME: "datetime_value",
+                    TIMESTAMP: None}
+
+    ROWS = "ROWS"
+    CHUNKS = "CHUNKS"
+    STORAGE_CHOICES = [(ROWS, "One row per value"),
+                       (CHUNKS, "Compressed chunks")]  # only for INT and FLOAT datums, see logger/chunks.py
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=20, null=False, blank=False)
@@ -43,20 +56,45 @@ class Datum(models.Model):
     unit = models.CharField(max_length=30, null=True, blank=True)
     color = RGBColorField(blank=False, null=False, default="#87BBFF")
     comment = models.CharField(max_length=100, blank=True, null=True)
+    storage = models.CharField(max_length=10, choices=STORAGE_CHOICES, default=ROWS)
+    # days to keep raw values and hourly rollups for, forever when empty. Daily rollups and spans are always kept.
+    # Applied by `manage.py enforce_retention`, see logger/retention.py
+    raw_retention_days = models.PositiveIntegerField(null=True, blank=True)
+    hourly_retention_days = models.PositiveIntegerField(null=True, blank=True)
+    # raw values before this were deleted by retention, so aggregates before it can't be rebuilt
+    pruned_before = models.DateTimeField(null=True, blank=True, editable=False)
+    # when values were last edited, moved or deleted rather than logged, for the validators of logger/series.py
+    values_changed = models.DateTimeField(null=True, blank=True, editable=False)
+
+    def clean(self):
+        if self.storage == self.CHUNKS and self.type not in (self.INT, self.FLOAT):
+            raise ValidationError({'storage': "only integer and float datums can be stored in chunks"})
 
     @property
     def color_rgba(self):
+        return self.rgba()
+
+    def rgba(self, alpha=1):
         fmt = "rgba({red}, {green}, {blue}, {alpha})"
 
         colors = {
             'red': int(self.color[1:3], 16),
             'green': int(self.color[3:5], 16),
             'blue': int(self.color[5:7], 16),
-            'alpha': 1
+            'alpha': alpha
         }
 
         return fmt.format(**colors)
 
+    def touch_values(self):
+        """Record that values of the datum were changed, without a save or its signals."""
+        self.values_changed = timezone.now()
+        Datum.objects.filter(pk=self.pk).update(values_changed=self.values_changed)
+
+    @property
+    def value_field(self):
+        return self.VALUE_FIELDS[self.type]
+
     def __str__(self):
         return "{} ({}, {})".format(self.name, self.comment, self.slug)
 
@@ -70,6 +108,10 @@ class Value(models.Model):
     date_value = models.DateField(null=True, blank=True)
     datetime_value = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        # every read is a timestamp range scan of one datum, ordered by timestamp
+        index_together = [['datum', 'timestamp']]
+
     def __str__(self):
         value = "UNDEFINED"
         if self.datum.type == Datum.FLOAT:
@@ -79,3 +121,102 @@ class Value(models.Model):
         else:
             raise NotImplementedError('no __str__ defined for datum type {}'.format(self.datum.type))
         return "{} at {}: {}".format(self.datum.name, self.timestamp, value)
+
+
+class Rollup(models.Model):
+    """Aggregates of the values of an INT or FLOAT datum over one hour or one day."""
+    HOUR = "HOUR"
+    DAY = "DAY"
+    RESOLUTION_CHOICES = [(HOUR, "Hour"),
+                          (DAY, "Day")]
+
+    datum = models.ForeignKey(Datum, on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=5, choices=RESOLUTION_CHOICES)
+    bucket = models.DateTimeField(blank=False, null=False)
+    count = models.IntegerField(default=0)
+    sum = models.FloatField(default=0.0)
+    min = models.FloatField(null=True, blank=True)
+    max = models.FloatField(null=True, blank=True)
+    last = models.FloatField(null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [['datum', 'resolution', 'bucket']]
+
+    @property
+    def average(self):
+        if not self.count:
+            return None
+        return self.sum / self.count
+
+    def __str__(self):
+        return "{} {} rollup of {} at {}".format(self.get_resolution_display(), self.datum.name, self.count,
+                                                 self.bucket)
+
+
+class Span(models.Model):
+    """
+    A start/stop pair of punches of a TIMESTAMP datum, kept in sync with its values by logger.spans.
+
+    Pairing restarts every day, so a start without a stop on the same day stays open. `end` and `duration` are None
+    while the span is open.
+    """
+    datum = models.ForeignKey(Datum, on_delete=models.CASCADE)
+    start = models.DateTimeField(blank=False, null=False)
+    end = models.DateTimeField(null=True, blank=True)
+    duration = models.DurationField(null=True, blank=True)
+
+    class Meta:
+        index_together = [['datum', 'start']]
+
+    @property
+    def is_open(self):
+        return self.end is None
+
+    def close(self, end):
+        self.end = end
+        self.duration = end - self.start
+
+    def __str__(self):
+        if self.is_open:
+            return "{} from {}".format(self.datum.name, self.start.strftime("%Y-%m-%d %H:%M:%S"))
+        return "{} from {} to {}".format(self.datum.name, self.start.strftime("%Y-%m-%d %H:%M:%S"),
+                                         self.end.strftime("%H:%M:%S"))
+
+
+class ValueChunk(models.Model):
+    """
+    The values of a datum with CHUNKS storage within one window of time, compressed by logger.chunks.
+
+    Values are first saved as Value rows like for every other datum, and packed into chunks by `manage.py
+    compact_values` once their window is closed.
+    """
+    datum = models.ForeignKey(Datum, on_delete=models.CASCADE)
+    start = models.DateTimeField(blank=False, null=False)
+    end = models.DateTimeField(blank=False, null=False)
+    count = models.IntegerField(default=0)
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = [['datum', 'start']]
+
+    def __str__(self):
+        return "{} values of {} from {}".format(self.count, self.datum.name, self.start)
+
+
+class IngestKey(models.Model):
+    """
+    An idempotency key a client sent along with a value of a datum, so retries of that value are only saved once.
+
+    Kept for LOGGER_INGEST_KEY_RETENTION_DAYS, see logger/dedup.py. Keys live in a table of their own rather than on
+    Value, so they can expire, and the partitions of Value don't need a unique key with the timestamp in it.
+    """
+    datum = models.ForeignKey(Datum, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = [['datum', 'key']]
+
+    def __str__(self):
+        return "{} key {}".format(self.datum.name, self.key)
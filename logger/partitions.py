@@ -0,0 +1,208 @@
+"""
+Monthly range partitions of the Value table, on MySQL.
+
+Partitioning is opt-in, with `manage.py partition_values --enable`, and then lives in the database only: Value is
+partitioned BY RANGE on the days of its timestamp, one partition per month named pYYYYMM, and a last "pfuture"
+partition for anything after the last month. MySQL prunes partitions by itself, so queries with a timestamp range,
+which is every read of values but the feed's, only touch the months that overlap the range. Old months are dropped
+or detached into tables of their own in constant time, rather than DELETEd row by row. Like retention, dropping
+downsamples the days of every datum in the months first and moves its pruned_before up past them.
+
+MySQL requires the partitioning column in every unique key and doesn't allow foreign keys on partitioned tables, so
+enabling partitioning makes the primary key (id, timestamp) and drops the foreign key of datum_id. Ids are still
+unique, they're auto incremented, and deleting a datum deletes its values through Django like before.
+
+Other databases keep one Value table. Pruning there would take a table per month, and every query of values in the
+app going through a router of those tables.
+"""
+import datetime
+
+from django.db import connection
+
+from .models import Datum, Value
+from .retention import prepare_pruning, prepare_raw
+
+FUTURE = "pfuture"
+
+
+def is_supported():
+    return connection.vendor == 'mysql'
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def next_month(first):
+    return datetime.date(first.year + first.month // 12, first.month % 12 + 1, 1)
+
+
+def partition_name(first):
+    return "p{:%Y%m}".format(first)
+
+
+def partition_month(name):
+    """The first day of the month of partition `name`, None for pfuture."""
+    if name == FUTURE:
+        return None
+    return datetime.datetime.strptime(name[1:], "%Y%m").date()
+
+
+def _table():
+    return connection.ops.quote_name(Value._meta.db_table)
+
+
+def _timestamp():
+    return connection.ops.quote_name(Value._meta.get_field('timestamp').column)
+
+
+def _partition_sql(first):
+    return "PARTITION {} VALUES LESS THAN (TO_DAYS('{:%Y-%m-%d}'))".format(partition_name(first), next_month(first))
+
+
+def _future_sql():
+    return "PARTITION {} VALUES LESS THAN MAXVALUE".format(FUTURE)
+
+
+def _execute(statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def partitions():
+    """The (name, estimated rows) of the partitions of the Value table, in order. Empty if it isn't partitioned."""
+    if not is_supported():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+                       "ORDER BY PARTITION_ORDINAL_POSITION", [Value._meta.db_table])
+        return list(cursor.fetchall())
+
+
+def is_partitioned():
+    return bool(partitions())
+
+
+def months():
+    """The first days of the months with a partition, in order."""
+    return [partition_month(name) for name, _ in partitions() if name != FUTURE]
+
+
+def enable(months_ahead, today=None):
+    """
+    Partition the Value table into months, from the month of its oldest value to `months_ahead` months after this
+    one. This rebuilds the table, so it takes as long as copying it and blocks writes to it meanwhile.
+    """
+    today = today or datetime.date.today()
+    table = _table()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT MIN({}) FROM {}".format(_timestamp(), table))
+        oldest = cursor.fetchone()[0]
+        cursor.execute("SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND REFERENCED_TABLE_NAME IS NOT NULL",
+                       [Value._meta.db_table])
+        foreign_keys = [row[0] for row in cursor.fetchall()]
+
+    first = month_start(oldest.date() if oldest is not None else today)
+    last = month_start(today)
+    for _ in range(months_ahead):
+        last = next_month(last)
+    month_sql = []
+    while first <= last:
+        month_sql.append(_partition_sql(first))
+        first = next_month(first)
+
+    statements = ["ALTER TABLE {} DROP FOREIGN KEY {}".format(table, connection.ops.quote_name(name))
+                  for name in foreign_keys]
+    # in one statement, MySQL wants the auto incremented id to be in a key at all times
+    statements.append("ALTER TABLE {} DROP PRIMARY KEY, ADD PRIMARY KEY (id, {})".format(table, _timestamp()))
+    statements.append("ALTER TABLE {} PARTITION BY RANGE (TO_DAYS({})) ({})".format(
+        table, _timestamp(), ", ".join(month_sql + [_future_sql()])))
+    _execute(statements)
+
+
+def add_months(months_ahead, today=None):
+    """
+    Make sure there are partitions up to `months_ahead` months after this one, by splitting them off pfuture, which is
+    quick while it's empty. Returns the first days of the months added.
+    """
+    today = today or datetime.date.today()
+    existing = months()
+    if not existing:
+        raise ValueError("the value table isn't partitioned")
+
+    last = month_start(today)
+    for _ in range(months_ahead):
+        last = next_month(last)
+    added = []
+    first = next_month(existing[-1])
+    while first <= last:
+        added.append(first)
+        first = next_month(first)
+
+    if added:
+        _execute(["ALTER TABLE {} REORGANIZE PARTITION {} INTO ({})".format(
+            _table(), FUTURE, ", ".join([_partition_sql(month) for month in added] + [_future_sql()]))])
+    return added
+
+
+def drop_months(before, detach=False, datums=None):
+    """
+    Drop the partitions of the months before the month of `before`, or with `detach` move each into a table of its
+    own, named after the value table and the partition, before dropping the emptied partition. The values of `datums`,
+    or of all of them, in those months are downsampled first. Returns the first days of the months dropped.
+    """
+    dropped = [month for month in months() if next_month(month) <= month_start(before)]
+    if dropped:
+        end = datetime.datetime.combine(next_month(dropped[-1]), datetime.time())
+        for datum in (Datum.objects.all() if datums is None else datums):
+            prepare_pruning(datum, end)
+    return _drop_partitions(dropped, detach)
+
+
+def _drop_partitions(dropped, detach=False):
+    table = _table()
+    statements = []
+    for month in dropped:
+        name = partition_name(month)
+        if detach:
+            archive = connection.ops.quote_name("{}_{}".format(Value._meta.db_table, name))
+            statements.append("CREATE TABLE {} LIKE {}".format(archive, table))
+            statements.append("ALTER TABLE {} REMOVE PARTITIONING".format(archive))
+            statements.append("ALTER TABLE {} EXCHANGE PARTITION {} WITH TABLE {}".format(table, name, archive))
+    if dropped:
+        statements.append("ALTER TABLE {} DROP PARTITION {}".format(
+            table, ", ".join([partition_name(month) for month in dropped])))
+    _execute(statements)
+    return dropped
+
+
+def drop_expired(now, datums=None):
+    """
+    Drop the months whose raw values are all past the raw retention of their datum, for enforce_retention. The datums
+    with raw retention are downsampled up to their cutoff first, like enforce_retention would before deleting, and a
+    month is only dropped if no datum without retention, or with a later cutoff, has values in it. Returns the first
+    days of the months dropped.
+    """
+    datums = list(Datum.objects.all() if datums is None else datums)
+    cutoffs = {}
+    for datum in datums:
+        if datum.raw_retention_days is not None:
+            cutoffs[datum.pk] = prepare_raw(datum, now)[0]
+
+    dropped = []
+    for month in months():
+        end = datetime.datetime.combine(next_month(month), datetime.time())
+        if end > now:
+            break
+        start = datetime.datetime.combine(month, datetime.time())
+        # a query per datum, each pruned to the month and an index lookup
+        kept = [datum for datum in datums if datum.pk not in cutoffs or cutoffs[datum.pk] < end]
+        if any(Value.objects.filter(datum=datum, timestamp__gte=start, timestamp__lt=end).exists() for datum in kept):
+            break
+        dropped.append(month)
+
+    # the datums with values in these months are past their cutoff there, and were prepared above
+    return _drop_partitions(dropped)
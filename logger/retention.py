@@ -0,0 +1,155 @@
+"""
+Retention of raw values and hourly rollups, per datum.
+
+Before raw values are deleted their days are aggregated once more from the raw data, into rollups for numeric datums
+and spans for timestamp datums, so what's kept doesn't depend on every ingest path having maintained them. The datum's
+pruned_before is moved up before anything is deleted, which makes rebuilds leave the older aggregates alone.
+
+Rows are deleted by id in batches of `batch_size`, each in its own short transaction, with plain DELETEs that don't
+fetch the rows or send signals. Retention only touches whole days older than the cutoff, so ingestion of current
+values is never blocked for longer than one batch. A value arriving late for a day that was pruned is folded into
+its aggregates, merged into the rollups like any other value, and into the spans of the day by re-pairing them with
+the new punch, see logger.spans.repair_day, and it's deleted on the next run. When the value table is partitioned, see
+logger/partitions.py, `manage.py enforce_retention` drops the months that have expired for every datum first.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import datum_cache
+from .models import Datum, IngestKey, Rollup, Value, ValueChunk
+from .rollups import NUMERIC_TYPES, rebuild_rollups
+from .spans import rebuild_spans
+from .utils import datetime_range
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class RetentionResult(object):
+    """What enforce_retention did to one datum."""
+
+    def __init__(self):
+        self.days = 0
+        self.values = 0
+        self.chunks = 0
+        self.rollups = 0
+        self.seconds = 0.0
+
+    @property
+    def rows(self):
+        return self.values + self.chunks + self.rollups
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def cutoff(days, now):
+    """Midnight `days` days before `now`, so retention always keeps or deletes whole days."""
+    return datetime.datetime.combine((now - datetime.timedelta(days=days)).date(), datetime.time())
+
+
+def _delete_batches(queryset, batch_size, pause):
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    ids = queryset.order_by('id').values_list('id', flat=True)
+
+    deleted = 0
+    while True:
+        batch = list(ids[:batch_size])
+        if not batch:
+            return deleted
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("DELETE FROM {} WHERE id IN ({})".format(table, ", ".join(["%s"] * len(batch))), batch)
+        deleted += len(batch)
+
+        if pause:
+            time.sleep(pause)
+
+
+def _next_day(datum, start, end):
+    """The first day in [start, end) with raw values of `datum`, or None."""
+    values = Value.objects.filter(datum=datum, timestamp__lt=end)
+    chunks = ValueChunk.objects.filter(datum=datum, start__lt=end)
+    if start is not None:
+        values = values.filter(timestamp__gte=start)
+        chunks = chunks.filter(start__gte=start)
+
+    firsts = [values.aggregate(first=Min('timestamp'))['first'], chunks.aggregate(first=Min('start'))['first']]
+    firsts = [first for first in firsts if first is not None]
+    return min(firsts).date() if firsts else None
+
+
+def downsample(datum, before):
+    """
+    Recompute the aggregates of `datum` for the days before `before` that weren't pruned yet and have raw values.
+    Returns the number of days.
+
+    Days before pruned_before are skipped, what's left of their raw values are late arrivals that were folded into
+    the existing aggregates, so recomputing them would lose the pruned values.
+    """
+    days = 0
+    day = _next_day(datum, datum.pruned_before, before)
+    while day is not None:
+        if datum.type in NUMERIC_TYPES:
+            rebuild_rollups(datum, day)
+        elif datum.type == Datum.TIMESTAMP:
+            rebuild_spans(datum, day)
+        days += 1
+        day = _next_day(datum, datetime_range(day)[1], before)
+    return days
+
+
+def prepare_pruning(datum, before):
+    """
+    Downsample the days of `datum` before `before` and move its pruned_before up to it, so its raw values before then
+    can be deleted. Returns the number of days downsampled.
+    """
+    days = downsample(datum, before)
+
+    if datum.pruned_before is None or datum.pruned_before < before:
+        Datum.objects.filter(pk=datum.pk).update(pruned_before=before)
+        datum.pruned_before = before
+        datum_cache.invalidate(datum.slug)
+    return days
+
+
+def prepare_raw(datum, now):
+    """
+    Prepare the raw values of `datum` before its raw cutoff for pruning. Returns the cutoff and the number of days
+    downsampled.
+    """
+    raw_cutoff = cutoff(datum.raw_retention_days, now)
+    return raw_cutoff, prepare_pruning(datum, raw_cutoff)
+
+
+def enforce_retention(datum, now=None, batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """Apply the retention settings of `datum`. Returns a RetentionResult."""
+    now = now or timezone.now()
+    result = RetentionResult()
+    started = time.time()
+
+    if datum.raw_retention_days is not None:
+        raw_cutoff, result.days = prepare_raw(datum, now)
+        result.values = _delete_batches(Value.objects.filter(datum=datum, timestamp__lt=raw_cutoff), batch_size, pause)
+        result.chunks = _delete_batches(ValueChunk.objects.filter(datum=datum, end__lte=raw_cutoff), batch_size, pause)
+
+    if datum.hourly_retention_days is not None:
+        hourly_cutoff = cutoff(datum.hourly_retention_days, now)
+        result.rollups = _delete_batches(Rollup.objects.filter(datum=datum, resolution=Rollup.HOUR,
+                                                               bucket__lt=hourly_cutoff), batch_size, pause)
+
+    result.seconds = time.time() - started
+    return result
+
+
+def expire_keys(now=None, batch_size=DEFAULT_BATCH_SIZE, pause=0):
+    """Delete the idempotency keys older than LOGGER_INGEST_KEY_RETENTION_DAYS, see logger/dedup.py."""
+    now = now or timezone.now()
+    expired = now - datetime.timedelta(days=settings.LOGGER_INGEST_KEY_RETENTION_DAYS)
+    keys = IngestKey.objects.filter(created__lt=expired)
+    return _delete_batches(keys, batch_size, pause)
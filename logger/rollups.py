@@ -0,0 +1,124 @@
+from django.db import IntegrityError, transaction
+
+from .chunks import iter_points
+from .models import Datum, Rollup
+from .utils import datetime_range
+
+NUMERIC_TYPES = (Datum.INT, Datum.FLOAT)
+
+
+def truncate(timestamp, resolution):
+    if resolution == Rollup.HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    elif resolution == Rollup.DAY:
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise NotImplementedError('no truncation defined for resolution {}'.format(resolution))
+
+
+def merge(rollup, other):
+    """Merge the aggregates of `other` into `rollup`."""
+    rollup.count += other.count
+    rollup.sum += other.sum
+    rollup.min = other.min if rollup.min is None else min(rollup.min, other.min)
+    rollup.max = other.max if rollup.max is None else max(rollup.max, other.max)
+    if rollup.last_timestamp is None or other.last_timestamp >= rollup.last_timestamp:
+        rollup.last = other.last
+        rollup.last_timestamp = other.last_timestamp
+
+
+class RollupAccumulator(object):
+    """Accumulates samples into unsaved Rollups of every resolution, keyed on (datum id, resolution, bucket)."""
+
+    def __init__(self):
+        self.rollups = {}
+
+    def add(self, datum_id, timestamp, number):
+        if number is None:
+            return
+
+        sample = Rollup(count=1, sum=number, min=number, max=number, last=number, last_timestamp=timestamp)
+        for resolution, _ in Rollup.RESOLUTION_CHOICES:
+            key = (datum_id, resolution, truncate(timestamp, resolution))
+            rollup = self.rollups.get(key)
+            if rollup is None:
+                rollup = self.rollups[key] = Rollup(datum_id=datum_id, resolution=resolution, bucket=key[2])
+            merge(rollup, sample)
+
+    def values(self):
+        return self.rollups.values()
+
+    def __len__(self):
+        return len(self.rollups)
+
+
+def _merge_into_existing(rollups):
+    """
+    Merge the partial rollups of `rollups`, a dict like RollupAccumulator.rollups, into the existing rows of their
+    buckets with one locking query, and take them out of `rollups`. Returns the number of rows updated.
+    """
+    datum_ids = {key[0] for key in rollups}
+    buckets = {key[2] for key in rollups}
+    merged = 0
+    for rollup in Rollup.objects.select_for_update().filter(datum_id__in=datum_ids, bucket__in=buckets):
+        partial = rollups.pop((rollup.datum_id, rollup.resolution, rollup.bucket), None)
+        if partial is not None:
+            merge(rollup, partial)
+            rollup.save()
+            merged += 1
+    return merged
+
+
+def update_rollups(values):
+    """
+    Incrementally fold newly saved values into their rollups.
+
+    Values of non numeric datums are ignored. The affected rollups are read with one locking query and written back
+    with one bulk_create for the new buckets plus an update per existing bucket. When another transaction created one
+    of the new buckets in the meantime, the insert fails on the unique index, and the rollups are merged into the rows
+    that exist by then instead.
+    """
+    accumulator = RollupAccumulator()
+    for value in values:
+        if value.datum.type in NUMERIC_TYPES:
+            accumulator.add(value.datum_id, value.timestamp, getattr(value, value.datum.value_field))
+
+    if not accumulator:
+        return
+
+    with transaction.atomic():
+        _merge_into_existing(accumulator.rollups)
+        while accumulator:
+            try:
+                with transaction.atomic():
+                    Rollup.objects.bulk_create(accumulator.values())
+                return
+            except IntegrityError:
+                if not _merge_into_existing(accumulator.rollups):
+                    raise
+
+
+def rebuild_rollups(datum, day=None):
+    """
+    Throw away and recompute the rollups of `datum` with one pass over its values, for one day or for all of its
+    history. Returns the number of rollups.
+
+    Rollups from before the datum's pruned_before are kept, their values are gone.
+    """
+    rollups = Rollup.objects.filter(datum=datum)
+    start = end = None
+    if day is not None:
+        start, end = datetime_range(day)
+        rollups = rollups.filter(bucket__gte=start, bucket__lt=end)
+    elif datum.pruned_before is not None:
+        start = datum.pruned_before
+        rollups = rollups.filter(bucket__gte=start)
+
+    accumulator = RollupAccumulator()
+    for timestamp, number in iter_points(datum, start, end):
+        accumulator.add(datum.pk, timestamp, number)
+
+    with transaction.atomic():
+        rollups.delete()
+        Rollup.objects.bulk_create(accumulator.values())
+
+    return len(accumulator)
@@ -0,0 +1,108 @@
+"""
+Read replica routing.
+
+With replica aliases in LOGGER_DB_REPLICAS, the reads of the logger models made by views wrapped in `replica_reads`
+go to one of the replicas, and everything else, ingest and all writes, goes to the primary `default` alias. Sessions
+and users always come from the primary, so a login is never missed because a replica lags behind.
+
+Replicas lag, so a user whose values were saved less than LOGGER_DB_READ_YOUR_WRITES_SECONDS ago reads from the
+primary, and sees them. Writes are marked per user in Django's cache once they're committed, which has to be shared
+by all workers, like for the datum cache.
+"""
+import functools
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+_state = threading.local()
+
+
+def _written_key(user_id):
+    return "logger:db:written:{}".format(user_id)
+
+
+def record_writes(user_ids):
+    """Mark `user_ids` as having had values saved, once the current transaction is committed."""
+    if not settings.LOGGER_DB_REPLICAS:
+        return
+    user_ids = set(user_ids)
+
+    def mark():
+        now = time.time()
+        cache.set_many({_written_key(user_id): now for user_id in user_ids},
+                       settings.LOGGER_DB_READ_YOUR_WRITES_SECONDS)
+    transaction.on_commit(mark)
+
+
+def recently_wrote(user_id):
+    return cache.get(_written_key(user_id)) is not None
+
+
+def should_use_replicas(user_id=None):
+    """Whether reads for `user_id`, or for no user in particular, can go to a replica."""
+    if not settings.LOGGER_DB_REPLICAS:
+        return False
+    return user_id is None or not recently_wrote(user_id)
+
+
+class use_replicas(object):
+    """Routes the reads of the logger models in the block to a replica if `enabled`, and to the primary if not."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def __enter__(self):
+        self.previous = getattr(_state, 'replicas', False)
+        _state.replicas = self.enabled
+        return self
+
+    def __exit__(self, *exc_info):
+        _state.replicas = self.previous
+
+
+def _iterate_with(enabled, content):
+    with use_replicas(enabled):
+        for chunk in content:
+            yield chunk
+
+
+def replica_reads(view):
+    """
+    Serve a read-only view from a replica, unless the user's values were saved less than
+    LOGGER_DB_READ_YOUR_WRITES_SECONDS ago. The content of streaming responses is only read once the view returned, so
+    it's iterated with the same routing.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        enabled = should_use_replicas(request.user.pk if request.user.is_authenticated else None)
+        with use_replicas(enabled):
+            response = view(request, *args, **kwargs)
+        if enabled and response.streaming:
+            response.streaming_content = _iterate_with(enabled, response.streaming_content)
+        return response
+
+    return wrapper
+
+
+class ReplicaRouter(object):
+    """Sends the reads of the logger app within `use_replicas` to a random replica, and the rest to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'replicas', False) and model._meta.app_label == 'logger':
+            return random.choice(settings.LOGGER_DB_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -0,0 +1,145 @@
+"""
+Time series of a datum over a range of time, raw or bucketed, for the JSON series API.
+
+Buckets of numeric datums come from their rollups where there are rollups of that size, and are otherwise computed by
+the database with a GROUP BY on the truncated timestamp. Only compacted values, which the database can't read, are
+bucketed in Python. Non numeric datums only have a count per bucket.
+"""
+import datetime
+import hashlib
+from itertools import islice
+
+from django.db.models import Avg, Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+
+from .chunks import iter_points
+from .models import Datum, Rollup, Value, ValueChunk
+from .rollups import NUMERIC_TYPES
+
+RAW = "raw"
+RESOLUTIONS = [RAW, "1m", "1h", "1d"]
+
+_STEPS = {"1m": datetime.timedelta(minutes=1), "1h": datetime.timedelta(hours=1), "1d": datetime.timedelta(days=1)}
+_TRUNCATIONS = {"1m": TruncMinute, "1h": TruncHour, "1d": TruncDay}
+_ROLLUPS = {"1h": Rollup.HOUR, "1d": Rollup.DAY}
+
+# the range returned when none is asked for, ending now
+DEFAULT_RANGES = {RAW: datetime.timedelta(days=1), "1m": datetime.timedelta(days=1),
+                  "1h": datetime.timedelta(days=7), "1d": datetime.timedelta(days=365)}
+
+
+def floor(timestamp, resolution):
+    if resolution == "1m":
+        return timestamp.replace(second=0, microsecond=0)
+    elif resolution == "1h":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    elif resolution == "1d":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise NotImplementedError('no buckets for resolution {}'.format(resolution))
+
+
+def bucket_range(start, end, resolution):
+    """Widen [start, end) to whole buckets of `resolution`, so the first and last bucket aren't partial."""
+    if resolution == RAW:
+        return start, end
+    bucket_end = floor(end, resolution)
+    if bucket_end != end:
+        bucket_end += _STEPS[resolution]
+    return floor(start, resolution), bucket_end
+
+
+def _raw_points(datum, start, end):
+    for timestamp, value in iter_points(datum, start, end):
+        yield {'t': timestamp, 'value': value}
+
+
+def _rollup_points(datum, resolution, start, end):
+    rollups = (Rollup.objects.filter(datum=datum, resolution=_ROLLUPS[resolution], bucket__gte=start, bucket__lt=end)
+               .order_by('bucket'))
+    for rollup in rollups.iterator():
+        yield {'t': rollup.bucket, 'count': rollup.count, 'sum': rollup.sum, 'min': rollup.min, 'max': rollup.max,
+               'avg': rollup.average}
+
+
+def _grouped_points(datum, resolution, start, end):
+    aggregates = {'count': Count('id')}
+    if datum.type in NUMERIC_TYPES:
+        aggregates.update(sum=Sum(datum.value_field), min=Min(datum.value_field), max=Max(datum.value_field),
+                          avg=Avg(datum.value_field))
+
+    buckets = (Value.objects.filter(datum=datum, timestamp__gte=start, timestamp__lt=end)
+               .annotate(t=_TRUNCATIONS[resolution]('timestamp')).values('t').annotate(**aggregates).order_by('t'))
+    return buckets.iterator()
+
+
+def _bucketed_points(datum, resolution, start, end):
+    bucket = None
+    for timestamp, value in iter_points(datum, start, end):
+        t = floor(timestamp, resolution)
+        if bucket is None or bucket['t'] != t:
+            if bucket is not None:
+                yield bucket
+            bucket = {'t': t, 'count': 0, 'sum': 0, 'min': None, 'max': None, 'avg': None}
+        if value is None:
+            continue
+        bucket['count'] += 1
+        bucket['sum'] += value
+        bucket['min'] = value if bucket['min'] is None else min(bucket['min'], value)
+        bucket['max'] = value if bucket['max'] is None else max(bucket['max'], value)
+        bucket['avg'] = bucket['sum'] / bucket['count']
+    if bucket is not None:
+        yield bucket
+
+
+def points(datum, resolution, start, end):
+    """Yields the points of `datum` in [start, end) at `resolution`, as dicts ordered by their time "t"."""
+    if resolution == RAW:
+        return _raw_points(datum, start, end)
+
+    start, end = bucket_range(start, end, resolution)
+    if datum.type in NUMERIC_TYPES and resolution in _ROLLUPS:
+        return _rollup_points(datum, resolution, start, end)
+    if datum.storage == Datum.CHUNKS:
+        return _bucketed_points(datum, resolution, start, end)
+    return _grouped_points(datum, resolution, start, end)
+
+
+def series(datum, resolution, start, end, max_points):
+    """
+    Returns (points, next) with at most `max_points` points of `datum`. `next` is the time of the first point that was
+    left out, to continue from, or None when all points were returned.
+    """
+    selected = list(islice(points(datum, resolution, start, end), max_points + 1))
+    if len(selected) > max_points:
+        return selected[:max_points], selected[max_points]['t']
+    return selected, None
+
+
+def validators(datum, resolution, start, end, max_points):
+    """
+    Returns an ETag and the time of the newest value for a series request, with one query on the values in the range,
+    and one on the chunks for CHUNKS storage.
+
+    The ETag changes whenever a value in the range is added, and whenever any value of the datum is edited, moved or
+    deleted. The time is the later of the newest value and of the last such change, backfilled values don't move it.
+    """
+    start, end = bucket_range(start, end, resolution)
+    state = Value.objects.filter(datum=datum, timestamp__gte=start, timestamp__lt=end).aggregate(
+        count=Count('id'), last_id=Max('id'), newest=Max('timestamp'))
+    newest = state['newest']
+    # not the range itself, which moves with the clock when the request doesn't end it
+    parts = [datum.pk, resolution, max_points, datum.pruned_before, datum.values_changed, state['count'],
+             state['last_id']]
+
+    if datum.storage == Datum.CHUNKS:
+        chunks = ValueChunk.objects.filter(datum=datum, end__gt=start, start__lt=end).aggregate(
+            count=Sum('count'), last_id=Max('id'), newest=Max('end'))
+        parts += [chunks['count'], chunks['last_id']]
+        if chunks['newest'] is not None and (newest is None or chunks['newest'] > newest):
+            newest = chunks['newest']
+
+    if datum.values_changed is not None and (newest is None or datum.values_changed > newest):
+        newest = datum.values_changed
+
+    etag = hashlib.md5(":".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return etag, newest
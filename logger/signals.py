@@ -0,0 +1,111 @@
+import threading
+
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import datum_cache, feed, routers, week_cache
+from .models import Datum, Value
+from .rollups import NUMERIC_TYPES, rebuild_rollups
+from .spans import is_pruned, record_timestamp, repair_day
+
+_pending = threading.local()
+
+
+def _on_commit_once(key, function):
+    """
+    Run `function` once the current transaction is committed, unless a function with the same key is already waiting
+    for it, so deleting many values in one transaction does the work once.
+    """
+    queued = getattr(_pending, 'functions', None)
+    if queued is None:
+        queued = _pending.functions = {}
+    waiting = queued.get(key)
+    # a rolled back transaction drops its functions, and the key is free again
+    if waiting is not None and any(function is waiting for _, function in connection.run_on_commit):
+        return
+
+    def run():
+        queued.pop(key, None)
+        function()
+    queued[key] = run
+    transaction.on_commit(run)
+
+
+def _update_rollups(datum, day):
+    """
+    Recompute the rollups of a day of a numeric datum after a value of it was edited or deleted. Pruned days are left
+    alone, their rollups hold the values that were deleted by retention.
+    """
+    if datum.type in NUMERIC_TYPES and not is_pruned(datum, day):
+        rebuild_rollups(datum, day)
+
+
+@receiver(pre_save, sender=Value)
+def value_saving(sender, instance, **kwargs):
+    # the datum and timestamp an edited value is moved away from, whose day has to be re-paired as well
+    instance._previous = None
+    if instance.pk is not None:
+        instance._previous = Value.objects.filter(pk=instance.pk).values_list('datum_id', 'timestamp').first()
+
+
+@receiver(post_save, sender=Value)
+def value_saved(sender, instance, created, **kwargs):
+    if created:
+        feed.publish([instance.datum_id])
+    routers.record_writes([instance.datum.user_id])
+
+    if created:
+        if instance.datum.type == Datum.TIMESTAMP:
+            record_timestamp(instance.datum, instance.timestamp)
+        return
+
+    instance.datum.touch_values()
+    # the number of a value can change in place, which only matters to its rollups
+    _update_rollups(instance.datum, instance.timestamp.date())
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        datum_id, timestamp = previous
+        datum = instance.datum if datum_id == instance.datum_id else Datum.objects.get(pk=datum_id)
+        if datum != instance.datum:
+            datum.touch_values()
+        elif timestamp == instance.timestamp:
+            return
+        if datum.type == Datum.TIMESTAMP:
+            repair_day(datum, timestamp.date(), removed=[timestamp])
+        elif datum != instance.datum or timestamp.date() != instance.timestamp.date():
+            _update_rollups(datum, timestamp.date())
+    if instance.datum.type == Datum.TIMESTAMP:
+        repair_day(instance.datum, instance.timestamp.date(), added=[instance.timestamp])
+
+
+@receiver(post_delete, sender=Value)
+def value_deleted(sender, instance, **kwargs):
+    datum = instance.datum
+    _on_commit_once(('touch', datum.pk), datum.touch_values)
+    if datum.type in NUMERIC_TYPES:
+        day = instance.timestamp.date()
+        _on_commit_once(('rollups', datum.pk, day), lambda: _update_rollups(datum, day))
+    if instance.datum.type != Datum.TIMESTAMP:
+        return
+
+    repair_day(instance.datum, instance.timestamp.date(), removed=[instance.timestamp])
+
+
+@receiver(pre_save, sender=Datum)
+def datum_saving(sender, instance, **kwargs):
+    # the slug the datum is cached under until now
+    instance._previous_slug = None
+    if instance.pk is not None:
+        instance._previous_slug = Datum.objects.filter(pk=instance.pk).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Datum)
+@receiver(post_delete, sender=Datum)
+def datum_changed(sender, instance, **kwargs):
+    datum_cache.invalidate(instance.slug)
+    previous_slug = getattr(instance, '_previous_slug', None)
+    if previous_slug is not None and previous_slug != instance.slug:
+        datum_cache.invalidate(previous_slug)
+    week_cache.invalidate_datum(instance.pk)
+    routers.record_writes([instance.user_id])
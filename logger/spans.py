@@ -0,0 +1,149 @@
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+from . import week_cache
+from .models import Datum, Value, Span
+from .utils import datetime_range
+
+
+def pair_timestamps(datum, timestamps):
+    """
+    Pair time ordered punches of `datum` into unsaved Spans in a single pass.
+
+    Pairing restarts every day, so a start that isn't followed by a stop on the same day is left as an open span.
+    """
+    spans = []
+    current_day = None
+    span = None
+    for timestamp in timestamps:
+        day = timestamp.date()
+        if day != current_day:
+            current_day = day
+            span = None
+
+        if span is None:
+            span = Span(datum=datum, start=timestamp)
+            spans.append(span)
+        else:
+            span.close(timestamp)
+            span = None
+
+    return spans
+
+
+def rebuild_spans(datum, day=None):
+    """
+    Recompute the spans of `datum` from its values, for one day or for all of its history.
+
+    Spans from before the datum's pruned_before are kept, their values are gone.
+    """
+    values = Value.objects.filter(datum=datum)
+    spans = Span.objects.filter(datum=datum)
+    if day is not None:
+        day_start, day_end = datetime_range(day)
+        values = values.filter(timestamp__gte=day_start, timestamp__lt=day_end)
+        spans = spans.filter(start__gte=day_start, start__lt=day_end)
+    elif datum.pruned_before is not None:
+        values = values.filter(timestamp__gte=datum.pruned_before)
+        spans = spans.filter(start__gte=datum.pruned_before)
+
+    timestamps = values.order_by('timestamp').values_list('timestamp', flat=True)
+
+    with transaction.atomic():
+        spans.delete()
+        new_spans = pair_timestamps(datum, timestamps.iterator())
+        Span.objects.bulk_create(new_spans)
+
+        if day is not None:
+            transaction.on_commit(lambda: week_cache.invalidate_day(datum.pk, day))
+        else:
+            transaction.on_commit(lambda: week_cache.invalidate_datum(datum.pk))
+
+    return len(new_spans)
+
+
+def is_pruned(datum, day):
+    """
+    Whether the raw values of `day` were deleted by retention, according to the database: Datums of
+    logger.datum_cache may not know the latest pruned_before yet.
+    """
+    pruned_before = Datum.objects.filter(pk=datum.pk).values_list('pruned_before', flat=True).first()
+    return pruned_before is not None and datetime_range(day)[1] <= pruned_before
+
+
+def repair_day(datum, day, added=(), removed=()):
+    """
+    Bring the spans of one day of `datum` up to date after the punches `added` were saved and `removed` deleted.
+
+    Days are re-paired from their values, except for days whose values were pruned by retention, which only have
+    their spans and maybe a few late values left. Their spans are re-paired from the punches of the spans instead,
+    with the added and removed punches merged in.
+    """
+    if not is_pruned(datum, day):
+        return rebuild_spans(datum, day)
+
+    day_start, day_end = datetime_range(day)
+    with transaction.atomic():
+        spans = Span.objects.select_for_update().filter(datum=datum, start__gte=day_start, start__lt=day_end)
+        punches = []
+        for span in spans:
+            punches.append(span.start)
+            if not span.is_open:
+                punches.append(span.end)
+        for timestamp in removed:
+            if timestamp in punches:
+                punches.remove(timestamp)
+        punches.extend(added)
+
+        spans.delete()
+        new_spans = pair_timestamps(datum, sorted(punches))
+        Span.objects.bulk_create(new_spans)
+        transaction.on_commit(lambda: week_cache.invalidate_day(datum.pk, day))
+
+    return len(new_spans)
+
+
+def record_timestamp(datum, timestamp):
+    """
+    Fold one newly saved punch into the spans of `datum`.
+
+    A punch after the last span of its day either closes that span or opens a new one, which costs one read and one
+    write. Anything else, like a backfilled punch in the middle of a day, repairs the whole day.
+    """
+    day_start, day_end = datetime_range(timestamp.date())
+
+    with transaction.atomic():
+        latest = Span.objects.select_for_update().filter(datum=datum, start__gte=day_start,
+                                                         start__lt=day_end).order_by('-start').first()
+        if latest is None or (not latest.is_open and timestamp >= latest.end):
+            Span.objects.create(datum=datum, start=timestamp)
+        elif latest.is_open and timestamp >= latest.start:
+            latest.close(timestamp)
+            latest.save()
+        else:
+            repair_day(datum, timestamp.date(), added=[timestamp])
+            return
+
+        transaction.on_commit(lambda: week_cache.invalidate_day(datum.pk, timestamp.date()))
+
+
+def update_spans(values):
+    """Repair every day touched by `values`, for values that were saved without signals, ie. by bulk_create."""
+    days = OrderedDict()
+    for value in values:
+        if value.datum.type == Datum.TIMESTAMP:
+            days.setdefault((value.datum, value.timestamp.date()), []).append(value.timestamp)
+
+    for (datum, day), timestamps in sorted(days.items(), key=lambda item: (item[0][0].pk, item[0][1])):
+        repair_day(datum, day, added=timestamps)
+
+
+def day_totals(datum, start, end):
+    """Returns the summed duration of the closed spans of `datum` per day, for spans starting in [start, end)."""
+    totals = (Span.objects.filter(datum=datum, start__gte=start, start__lt=end, end__isnull=False)
+              .annotate(day=TruncDate('start')).values('day').annotate(total=Sum('duration')).order_by('day'))
+
+    return OrderedDict((total['day'], total['total']) for total in totals)
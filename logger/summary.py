@@ -0,0 +1,131 @@
+"""
+The latest value, last seen time, count of today and the last days of every datum of the index page.
+
+All datums are summarized together in a fixed number of queries, however many there are: the id of the latest value
+of each datum is selected with the datums, the values themselves in one more query, and the days of the sparklines
+come from the daily rollups of numeric datums and from one grouped count over the values of the others. Numeric
+datums can have their raw values compacted into chunks or pruned by retention, so their latest value is taken from
+the rollups when those have a later one.
+"""
+import datetime
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Sum, When
+from django.db.models.expressions import RawSQL
+
+from .models import Datum, Rollup, Value
+from .rollups import NUMERIC_TYPES
+from .utils import datetime_range
+
+SPARKLINE_DAYS = 7
+SPARKLINE_BLOCKS = "▁▂▃▄▅▆▇█"
+
+
+class DatumSummary(object):
+    """
+    A datum with its latest value and when it was logged, the number of values logged today, and the daily average
+    of numeric datums, or the daily count of other datums, of the last SPARKLINE_DAYS days up to today.
+    """
+    __slots__ = ('datum', 'latest', 'last_seen', 'today_count', 'days', 'sparkline_values')
+
+    def __init__(self, datum, days):
+        self.datum = datum
+        self.latest = None
+        self.last_seen = None
+        self.today_count = 0
+        self.days = days
+        # days without values have no average, but a count of zero
+        self.sparkline_values = [None if datum.type in NUMERIC_TYPES else 0] * len(days)
+
+    @property
+    def sparkline_kind(self):
+        return "average" if self.datum.type in NUMERIC_TYPES else "count"
+
+    @property
+    def sparkline(self):
+        """
+        The days as a line of block characters. Averages are scaled between their min and max and days without values
+        are blank, counts are scaled from zero.
+        """
+        numbers = [number for number in self.sparkline_values if number is not None]
+        if not numbers:
+            return ""
+        low, high = (min(numbers), max(numbers)) if self.sparkline_kind == "average" else (0, max(numbers))
+        scale = (len(SPARKLINE_BLOCKS) - 1) / (high - low) if high > low else 0
+        return "".join(["\u00a0" if number is None else SPARKLINE_BLOCKS[int(round((number - low) * scale))]
+                        for number in self.sparkline_values])
+
+    @property
+    def sparkline_title(self):
+        return ", ".join(["{}: {}".format(day.strftime("%a"), "-" if number is None else round(number, 2))
+                          for day, number in zip(self.days, self.sparkline_values)])
+
+    def see(self, timestamp, latest):
+        if self.last_seen is None or timestamp > self.last_seen:
+            self.last_seen = timestamp
+            self.latest = latest
+
+
+def _latest_value_id():
+    """
+    The id of the latest value of each datum, as a correlated subquery: an index seek per datum, where grouping the
+    values on datum to find their max timestamp reads the whole index.
+    """
+    value_table = connection.ops.quote_name(Value._meta.db_table)
+    datum_table = connection.ops.quote_name(Datum._meta.db_table)
+    return RawSQL("SELECT id FROM {value} WHERE datum_id = {datum}.id ORDER BY timestamp DESC, id DESC LIMIT 1".format(
+        value=value_table, datum=datum_table), ())
+
+
+def summarize(datums, today=None):
+    """Returns a DatumSummary of each of the datums of the queryset `datums`, in their order."""
+    if today is None:
+        today = datetime.date.today()
+    days = [today - datetime.timedelta(days=offset) for offset in range(SPARKLINE_DAYS - 1, -1, -1)]
+    first, _ = datetime_range(days[0])
+
+    datums = list(datums.annotate(latest_value_id=_latest_value_id()))
+    summaries = {datum.pk: DatumSummary(datum, days) for datum in datums}
+    if not summaries:
+        return []
+
+    latest_ids = [datum.latest_value_id for datum in datums if datum.latest_value_id is not None]
+    if latest_ids:
+        for value in Value.objects.filter(id__in=latest_ids):
+            summary = summaries[value.datum_id]
+            field = summary.datum.value_field
+            summary.last_seen = value.timestamp
+            summary.latest = getattr(value, field) if field else value.timestamp
+
+    day_indexes = {day: index for index, day in enumerate(days)}
+    numeric = [pk for pk, summary in summaries.items() if summary.datum.type in NUMERIC_TYPES]
+    if numeric:
+        rollups = Rollup.objects.filter(datum__in=numeric, resolution=Rollup.DAY, bucket__gte=first)
+        for rollup in rollups.only('datum', 'bucket', 'count', 'sum', 'last', 'last_timestamp'):
+            summary = summaries[rollup.datum_id]
+            index = day_indexes.get(rollup.bucket.date())
+            if index is None:
+                continue
+            summary.sparkline_values[index] = rollup.average
+            if index == len(days) - 1:
+                summary.today_count = rollup.count
+            if rollup.last_timestamp is not None:
+                last = int(rollup.last) if summary.datum.type == Datum.INT else rollup.last
+                summary.see(rollup.last_timestamp, last)
+
+    others = [pk for pk, summary in summaries.items() if summary.datum.type not in NUMERIC_TYPES]
+    if others:
+        # a conditional count per day over the timestamp range, which needs no date function on every row
+        counts = {}
+        for index, day in enumerate(days):
+            start, end = datetime_range(day)
+            counts['day{}'.format(index)] = Sum(Case(When(timestamp__gte=start, timestamp__lt=end, then=1), default=0,
+                                                     output_field=IntegerField()))
+        rows = (Value.objects.filter(datum__in=others, timestamp__gte=first, timestamp__lt=datetime_range(today)[1])
+                .values('datum').annotate(**counts).order_by())
+        for row in rows:
+            summary = summaries[row['datum']]
+            summary.sparkline_values = [row['day{}'.format(index)] for index in range(len(days))]
+            summary.today_count = summary.sparkline_values[-1]
+
+    return [summaries[datum.pk] for datum in datums]
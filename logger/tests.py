@@ -1,5 +1,1108 @@
-from django.test import TestCase, Client
+import asyncio
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
 
-# Create your tests here.
+from logger import (benchmarks, buffer, chunks, datafixes, datum_cache, dedup, export, feed, heatmap, metrics,
+                    partitions, retention, rollups, routers, series, spans, week_cache)
+from logger.asgi import IngestApplication
+from logger.ingest import bulk_ingest, store_value
+from logger.models import Datum, Rollup, Span, Value, ValueChunk
+from logger.timeline import WeekTimeline
+from logger.timestamp_table import TableCell, WeekTableRow
+from logger.utils import monday_this_week
+from logger.wsgi import IngestWSGIApplication
+
+
+class TimestampDatumQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP)
+        self.client = Client()
+        self.client.login(username="user", password="password")
+
+        self.monday = datetime.datetime.combine(monday_this_week(), datetime.time())
+        # insert out of order, and around the edges of the week
+        offsets = [
+            datetime.timedelta(days=1, hours=17),
+            datetime.timedelta(days=1, hours=8),
+            datetime.timedelta(hours=12),
+            datetime.timedelta(hours=9),
+            datetime.timedelta(days=7),
+            datetime.timedelta(seconds=-1),
+        ]
+        for offset in offsets:
+            Value.objects.create(datum=self.datum, timestamp=self.monday + offset)
+
+    def test_value_index(self):
+        constraints = connection.introspection.get_constraints(connection.cursor(), Value._meta.db_table)
+        indexed_columns = [constraint['columns'] for constraint in constraints.values() if constraint['index']]
+        self.assertIn(['datum_id', 'timestamp'], indexed_columns)
+
+    def test_week_query_count_and_ordering(self):
+        url = reverse('datum', kwargs={'datum_id': self.datum.pk})
+
+        # session, user, datum, the week's spans and their daily totals
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+
+        days = response.context['days']
+        timestamps = [entry.timestamp for _, entries, _ in days for entry in entries]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(len(timestamps), 4)
+        self.assertEqual([day for day, _, _ in days],
+                         [self.monday.strftime("%Y-%m-%d"),
+                          (self.monday + datetime.timedelta(days=1)).strftime("%Y-%m-%d")])
+
+        rows = response.context['day_table_rows']
+        self.assertEqual(rows[0].total_duration, datetime.timedelta(hours=3))
+        self.assertEqual(rows[1].total_duration, datetime.timedelta(hours=9))
+
+
+class WeekTimelineTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP)
+        self.monday = datetime.datetime(2017, 3, 6)
+
+    def span(self, start, end=None):
+        span = Span(datum=self.datum, start=self.monday + start)
+        if end is not None:
+            span.close(self.monday + end)
+        return span
+
+    def test_rows_and_punches(self):
+        hours = datetime.timedelta(hours=1)
+        spans = [self.span(8 * hours, 12 * hours + datetime.timedelta(minutes=30)),
+                 self.span(13 * hours, 17 * hours),
+                 self.span(24 * hours + 22 * hours),
+                 self.span(48 * hours + 9 * hours)]
+        # the open span of wednesday is in progress, the one of tuesday ran to the end of its day
+        timeline = WeekTimeline(self.monday.date(), spans, now=self.monday + 48 * hours + 11 * hours)
+        rows = timeline.table_rows(self.datum)
+
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0].total_duration, datetime.timedelta(hours=8, minutes=30))
+        self.assertEqual([cell.state for cell in rows[0][7:14]],
+                         [TableCell.EMPTY, TableCell.START, TableCell.FULL, TableCell.FULL, TableCell.FULL,
+                          TableCell.END, TableCell.START])
+        self.assertEqual(rows[0][17].state, TableCell.END)
+        self.assertEqual(rows[1][23].state, TableCell.FULL)
+        self.assertEqual(rows[1].total_duration, datetime.timedelta(hours=1, minutes=59))
+        self.assertEqual(rows[2].total_duration, datetime.timedelta(hours=2))
+
+        punches = timeline.day_punches()
+        self.assertEqual([day for day, _ in punches], [self.monday.date() + datetime.timedelta(days=days)
+                                                       for days in range(3)])
+        self.assertEqual([punch.diff for punch in punches[0][1]],
+                         [datetime.timedelta(), datetime.timedelta(hours=4, minutes=30), datetime.timedelta(),
+                          datetime.timedelta(hours=4)])
+
+
+class BulkIngestTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.client = Client()
+        self.url = reverse('bulk_log_values')
+
+    def post(self, body, content_type="application/json"):
+        return self.client.post(self.url, body, content_type=content_type)
+
+    def test_json_list(self):
+        records = [{'slug': self.datum.slug, 'timestamp': "2017-03-01T08:00:00", 'value': 1.5},
+                   [self.datum.slug, 1488358800, "2.5"],
+                   [self.datum.slug, "2017-03-01T08:00:00", "warm"],
+                   ["nope", None, 1],
+                   [self.datum.slug, None]]
+        response = self.post(json.dumps(records))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['saved'], 2)
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ["ok", "ok", "error", "error", "error"])
+        self.assertEqual(sorted(Value.objects.values_list('float_value', flat=True)), [1.5, 2.5])
+
+    def test_ndjson(self):
+        lines = [json.dumps([self.datum.slug, "2017-03-01T08:00:00", value]) for value in (1, 2)]
+        for body, content_type in (("\n".join(lines), "application/x-ndjson"), ("\n".join(lines), ""),
+                                   (lines[0], ""), (lines[0], "application/json")):
+            response = self.post(body, content_type)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), body.count("\n") + 1)
+            self.assertEqual(response.json()['saved'], body.count("\n") + 1)
+
+    def test_malformed_body(self):
+        self.assertEqual(self.post("[1, 2").status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class RollupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.morning = datetime.datetime(2017, 3, 1, 8)
+
+    def log(self, minutes, number):
+        store_value(Value(datum=self.datum, timestamp=self.morning + datetime.timedelta(minutes=minutes),
+                          float_value=number))
+
+    def assertRollup(self, resolution, bucket, count, total, low, high, last):
+        rollup = Rollup.objects.get(datum=self.datum, resolution=resolution, bucket=bucket)
+        self.assertEqual((rollup.count, rollup.sum, rollup.min, rollup.max, rollup.last),
+                         (count, total, low, high, last))
+
+    def test_incremental_and_rebuilt(self):
+        for minutes, number in ((0, 2.0), (30, 4.0), (90, 1.0), (10, 3.0)):
+            self.log(minutes, number)
+
+        self.assertRollup(Rollup.HOUR, self.morning, 3, 9.0, 2.0, 4.0, 4.0)
+        self.assertRollup(Rollup.HOUR, self.morning.replace(hour=9), 1, 1.0, 1.0, 1.0, 1.0)
+        self.assertRollup(Rollup.DAY, self.morning.replace(hour=0), 4, 10.0, 1.0, 4.0, 1.0)
+
+        incremental = set(Rollup.objects.values_list('resolution', 'bucket', 'count', 'sum', 'min', 'max', 'last'))
+        self.assertEqual(rollups.rebuild_rollups(self.datum), 3)
+        self.assertEqual(set(Rollup.objects.values_list('resolution', 'bucket', 'count', 'sum', 'min', 'max',
+                                                        'last')), incremental)
+
+    def test_new_bucket_created_concurrently(self):
+        merge_into_existing = rollups._merge_into_existing
+
+        def racing(partials):
+            # another transaction creates the day's rollups right after they were found missing
+            merged = merge_into_existing(partials)
+            if not Rollup.objects.exists():
+                for resolution, _ in Rollup.RESOLUTION_CHOICES:
+                    Rollup.objects.create(datum=self.datum, resolution=resolution,
+                                          bucket=rollups.truncate(self.morning, resolution), count=1, sum=5.0, min=5.0,
+                                          max=5.0, last=5.0, last_timestamp=self.morning)
+            return merged
+
+        with mock.patch.object(rollups, '_merge_into_existing', side_effect=racing):
+            self.log(0, 2.0)
+
+        self.assertEqual(Value.objects.count(), 1)
+        self.assertRollup(Rollup.HOUR, self.morning, 2, 7.0, 2.0, 5.0, 2.0)
+        self.assertRollup(Rollup.DAY, self.morning.replace(hour=0), 2, 7.0, 2.0, 5.0, 2.0)
+
+
+class RollupEditTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.morning = datetime.datetime(2017, 3, 1, 8)
+
+    def rollups(self):
+        return sorted(Rollup.objects.filter(datum=self.datum).values_list('resolution', 'bucket', 'count', 'sum'))
+
+    def test_edit_and_delete(self):
+        store_value(Value(datum=self.datum, timestamp=self.morning, float_value=1.0))
+        value = Value.objects.get()
+        value.float_value = 10.0
+        value.save()
+        self.assertEqual(self.rollups(), [(Rollup.DAY, self.morning.replace(hour=0), 1, 10.0),
+                                          (Rollup.HOUR, self.morning, 1, 10.0)])
+
+        # moved to the next day, the first one has no rollups left
+        value.timestamp += datetime.timedelta(days=1)
+        value.save()
+        self.assertEqual(self.rollups(), [(Rollup.DAY, datetime.datetime(2017, 3, 2), 1, 10.0),
+                                          (Rollup.HOUR, datetime.datetime(2017, 3, 2, 8), 1, 10.0)])
+
+        value.delete()
+        self.assertEqual(self.rollups(), [])
+
+    def test_bulk_delete_rebuilds_once(self):
+        for minutes in range(5):
+            store_value(Value(datum=self.datum, timestamp=self.morning + datetime.timedelta(minutes=minutes),
+                              float_value=minutes))
+        with mock.patch('logger.signals.rebuild_rollups', wraps=rollups.rebuild_rollups) as rebuild:
+            Value.objects.filter(timestamp__gte=self.morning + datetime.timedelta(minutes=2)).delete()
+        self.assertEqual(rebuild.call_count, 1)
+        self.assertEqual(self.rollups(), [(Rollup.DAY, self.morning.replace(hour=0), 2, 1.0),
+                                          (Rollup.HOUR, self.morning, 2, 1.0)])
+
+
+    def test_bulk_delete_touches_once(self):
+        for minutes in range(5):
+            store_value(Value(datum=self.datum, timestamp=self.morning + datetime.timedelta(minutes=minutes),
+                              float_value=minutes))
+        with CaptureQueriesContext(connection) as queries:
+            Value.objects.filter(datum=self.datum).delete()
+        touches = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "logger_datum"')]
+        self.assertEqual(len(touches), 1)
+        self.assertIsNotNone(Datum.objects.get(pk=self.datum.pk).values_changed)
+
+class SpanTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP)
+        self.monday = datetime.datetime(2017, 3, 6)
+
+    def punch(self, hours, days=0):
+        value = Value(datum=self.datum, timestamp=self.monday + datetime.timedelta(days=days, hours=hours))
+        store_value(value)
+        return value
+
+    def durations(self, days=0):
+        start = self.monday + datetime.timedelta(days=days)
+        return [span.duration for span in Span.objects.filter(datum=self.datum, start__gte=start,
+                                                             start__lt=start + datetime.timedelta(days=1))
+                .order_by('start')]
+
+    def test_punches_pair_per_day(self):
+        for hours in (8, 12, 13):
+            self.punch(hours)
+        # backfilled into the middle of the day
+        self.punch(10)
+        self.punch(22, days=1)
+
+        self.assertEqual(self.durations(), [datetime.timedelta(hours=2), datetime.timedelta(hours=1)])
+        self.assertEqual(self.durations(1), [None])
+        self.assertEqual(spans.rebuild_spans(self.datum), 3)
+        self.assertEqual(self.durations(), [datetime.timedelta(hours=2), datetime.timedelta(hours=1)])
+
+    def test_edit_repairs_old_and_new_day(self):
+        for hours in (8, 12):
+            self.punch(hours)
+        moved = self.punch(17)
+        self.punch(9, days=1)
+        untouched = self.punch(8, days=2)
+        untouched_span = Span.objects.get(start=untouched.timestamp)
+
+        moved.timestamp += datetime.timedelta(days=1)
+        moved.save()
+        self.assertEqual(self.durations(), [datetime.timedelta(hours=4)])
+        self.assertEqual(self.durations(1), [datetime.timedelta(hours=8)])
+        self.assertTrue(Span.objects.filter(pk=untouched_span.pk).exists())
+
+        moved.delete()
+        self.assertEqual(self.durations(1), [None])
+
+
+class WeekCacheTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP)
+        cache.clear()
+
+    def test_invalidated_by_backfills(self):
+        this_week = monday_this_week()
+        last_month = this_week - datetime.timedelta(weeks=4)
+        week_cache.set_week(self.datum, this_week, "now")
+        week_cache.set_week(self.datum, last_month, "then")
+        self.assertIsNone(week_cache.get_week(self.datum, this_week))
+        self.assertEqual(week_cache.get_week(self.datum, last_month), "then")
+
+        store_value(Value(datum=self.datum, timestamp=datetime.datetime.combine(last_month, datetime.time(9))))
+        self.assertIsNone(week_cache.get_week(self.datum, last_month))
+
+        week_cache.set_week(self.datum, last_month, "again")
+        spans.rebuild_spans(self.datum)
+        self.assertIsNone(week_cache.get_week(self.datum, last_month))
+
+    @override_settings(LOGGER_WEEK_CACHE_TIMEOUT=60, LOGGER_WEEK_CACHE_OLD_TIMEOUT=600,
+                       LOGGER_WEEK_CACHE_HORIZON_DAYS=14)
+    def test_timeouts_are_finite(self):
+        this_week = monday_this_week()
+        self.assertIs(week_cache._timeout(this_week), False)
+        self.assertEqual(week_cache._timeout(this_week - datetime.timedelta(weeks=1)), 60)
+        self.assertEqual(week_cache._timeout(this_week - datetime.timedelta(weeks=52)), 600)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.client = Client()
+        self.client.login(username="user", password="password")
+        self.morning = datetime.datetime(2017, 3, 1, 8)
+        # two values share each timestamp, so the chunks have to page on the id as well
+        Value.objects.bulk_create([
+            Value(datum=self.datum, timestamp=self.morning + datetime.timedelta(hours=index // 2), float_value=index)
+            for index in range(7)])
+
+    def test_iter_values_in_chunks(self):
+        rows = list(export.iter_values(self.datum, ['float_value'], chunk_size=2))
+        self.assertEqual(rows, [(float(index),) for index in range(7)])
+        rows = list(export.iter_values(self.datum, ['float_value'], start=self.morning + datetime.timedelta(hours=1),
+                                       end=self.morning + datetime.timedelta(hours=3), chunk_size=3))
+        self.assertEqual(rows, [(2.0,), (3.0,), (4.0,), (5.0,)])
+
+    def test_csv_and_ndjson(self):
+        url = reverse('export_datum', kwargs={'datum_id': self.datum.pk, 'format': 'csv'})
+        response = self.client.get(url, {'to': "2017-03-01T09:00:00"})
+        self.assertEqual(b"".join(response.streaming_content).decode().splitlines(),
+                         ["timestamp,value", "2017-03-01T08:00:00,0.0", "2017-03-01T08:00:00,1.0"])
+
+        url = reverse('export_datum', kwargs={'datum_id': self.datum.pk, 'format': 'ndjson'})
+        response = self.client.get(url, {'columns': "id,value", 'from': "2017-03-01T11:00:00"})
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line['value'] for line in lines], [6.0])
+
+        self.assertEqual(self.client.get(url, {'columns': "secret"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': "yesterday"}).status_code, 400)
+
+
+class ImportValuesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.notes = Datum.objects.create(user=self.user, name="notes", type=Datum.STRING)
+        self.temperature = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with (gzip.open if name.endswith('.gz') else open)(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        return path
+
+    def run_import(self, *args, **options):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_values', *args, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv(self):
+        path = self.write("notes.csv", 'slug,timestamp,value\n'
+                                       'notes,2017-03-01T08:00:00,"two\nlines"\n'
+                                       'notes,,no timestamp\n'
+                                       'notes,2017-03-01T09:00:00,plain\n'
+                                       'notes,2017-03-01T09:00:00,repeated\n')
+        stdout, stderr = self.run_import(path)
+        self.assertIn("done: 4 read, 2 saved, 1 skipped as duplicates, 1 errors", stdout)
+        self.assertIn("missing timestamp", stderr)
+        self.assertEqual(list(Value.objects.order_by('timestamp').values_list('string_value', flat=True)),
+                         ["two\nlines", "plain"])
+
+        # a second run skips everything that's there already
+        stdout, _ = self.run_import(path)
+        self.assertIn("done: 4 read, 0 saved, 3 skipped as duplicates, 1 errors", stdout)
+
+    def test_gzipped_ndjson_resumed(self):
+        lines = ['{{"timestamp": "2017-03-01T0{}:00:00", "value": {}}}\n'.format(hour, hour) for hour in range(4)]
+        path = self.write("temperature.ndjson.gz", "".join(lines))
+        offset = len(lines[0]) + len(lines[1])
+        stdout, _ = self.run_import(path, slug="temperature", offset=offset, batch_size=1, transaction_size=1)
+        self.assertIn("resume with --offset {}".format(offset + len(lines[2])), stdout)
+        self.assertIn("done: 2 read, 2 saved", stdout)
+        self.assertEqual(sorted(Value.objects.values_list('float_value', flat=True)), [2.0, 3.0])
+
+
+class DatafixesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP)
+        self.morning = datetime.datetime(2017, 3, 1, 8)
+
+    def test_shift_timestamps(self):
+        for hours in (0, 1, 4):
+            store_value(Value(datum=self.datum, timestamp=self.morning + datetime.timedelta(hours=hours)))
+        hour = datetime.timedelta(hours=1)
+        # the first value is moved into the range of the second shift, and mustn't be moved again
+        shifts = [(None, self.morning + hour, hour), (self.morning + hour, None, -2 * hour)]
+
+        self.assertEqual(datafixes.shift_timestamps(self.datum, shifts, dry_run=True), 3)
+        self.assertEqual(datafixes.shift_timestamps(self.datum, shifts, batch_size=2), 3)
+        self.assertEqual(list(Value.objects.order_by('timestamp').values_list('timestamp', flat=True)),
+                         [self.morning - hour, self.morning + hour, self.morning + 2 * hour])
+        self.assertEqual(list(Span.objects.order_by('start').values_list('duration', flat=True)), [2 * hour, None])
+
+    def test_shift_numeric(self):
+        datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        for hours in (0, 1, 3):
+            store_value(Value(datum=datum, timestamp=self.morning + datetime.timedelta(hours=hours), float_value=hours))
+        hour = datetime.timedelta(hours=1)
+
+        self.assertEqual(datafixes.shift_timestamps(datum, [(None, None, hour)]), 3)
+        self.assertFalse(Span.objects.exists())
+        buckets = Rollup.objects.filter(resolution=Rollup.HOUR).order_by('bucket').values_list('bucket', flat=True)
+        self.assertEqual(list(buckets), [self.morning + hour, self.morning + 2 * hour, self.morning + 4 * hour])
+
+    def test_timezone_shifts(self):
+        # CET switches to summer time at 02:00 on the 26th of March 2017, the missing hour is taken as winter time
+        shifts = datafixes.timezone_shifts("Europe/Berlin", "UTC", datetime.datetime(2017, 3, 25),
+                                           datetime.datetime(2017, 3, 27))
+        self.assertEqual(shifts, [(datetime.datetime(2017, 3, 25), datetime.datetime(2017, 3, 26, 3),
+                                   datetime.timedelta(hours=-1)),
+                                  (datetime.datetime(2017, 3, 26, 3), datetime.datetime(2017, 3, 27),
+                                   datetime.timedelta(hours=-2))])
+
+
+class FileBufferTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ingest.log")
+        self.buffer = buffer.FileBuffer(self.path, max_size=10, max_delay=1, max_attempts=3)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def put(self, *numbers):
+        self.buffer.put([Value(datum=self.datum, timestamp=datetime.datetime(2017, 3, 1, 8, index), float_value=number)
+                         for index, number in enumerate(numbers)])
+
+    def append(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def test_flush(self):
+        self.put(1.0, 2.0)
+        self.assertEqual(self.buffer.depth(), 2)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.depth(), 0)
+        self.assertEqual(sorted(Value.objects.values_list('float_value', flat=True)), [1.0, 2.0])
+
+    def test_malformed_lines_are_rejected(self):
+        self.put(1.0)
+        self.append(b'[1, 2]\n{"datum": ')
+        with self.assertLogs('logger.buffer', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 1)
+        with open(self.path + ".rejected", 'rb') as f:
+            self.assertEqual(f.read(), b'[1, 2]\n{"datum": \n')
+        self.assertEqual(self.buffer.stats_dict()['rejected'], 2)
+
+    def test_failing_file_is_set_aside(self):
+        self.append(json.dumps({'datum': self.datum.pk, 'timestamp': "2017-03-01T08:00:00", 'unknown': 1}).encode()
+                    + b"\n")
+        with self.assertLogs('logger.buffer', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+            self.put(2.0)
+            # the failing file holds up the next one until it failed max_attempts times
+            self.assertEqual(self.buffer.flush(), 0)
+            self.assertFalse(Value.objects.exists())
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(len([name for name in os.listdir(self.directory.name) if name.endswith(".failed")]), 1)
+        self.assertEqual(self.buffer.stats_dict()['failed_files'], 1)
+        self.assertEqual(self.buffer.depth(), 0)
+
+
+class AsgiIngestTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.application = IngestApplication(max_workers=1, max_pending=1)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.application.executor.shutdown(wait=True)
+        self.loop.close()
+
+    def request(self, method, path, chunks=(b'',), headers=()):
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1}
+                    for index, chunk in enumerate(chunks)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': list(headers)}
+        self.loop.run_until_complete(self.application(scope, receive, send))
+        return sent[0]['status'], sent[1]['body'].decode()
+
+    def test_log_value(self):
+        status, text = self.request("GET", "/{}/1.5".format(self.datum.slug))
+        self.assertEqual(status, 200)
+        self.assertTrue(text.startswith("saved: slug: temperature"))
+        self.assertEqual(self.request("GET", "/{}/warm".format(self.datum.slug)), (200, "bad val"))
+        self.assertEqual(self.request("GET", "/nope/1")[0], 404)
+        self.assertEqual(self.request("GET", "/datum/1/events")[0], 404)
+        self.assertEqual(list(Value.objects.values_list('float_value', flat=True)), [1.5])
+
+    def test_bulk_in_chunks(self):
+        body = json.dumps([[self.datum.slug, "2017-03-01T08:00:00", value] for value in (1, 2)]).encode()
+        status, text = self.request("POST", "/bulk/", chunks=(body[:10], body[10:]),
+                                    headers=[(b'content-type', b'application/json')])
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(text)['saved'], 2)
+        self.assertEqual(self.request("GET", "/bulk/")[0], 405)
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=5):
+            self.assertEqual(self.request("POST", "/bulk/", chunks=(body,))[0], 413)
+
+
+class DatumCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT,
+                                          storage=Datum.CHUNKS, raw_retention_days=30)
+        datum_cache._local.clear()
+
+    def test_cached_fields(self):
+        datum_cache.get_datum(self.datum.slug)
+        with self.assertNumQueries(0):
+            datum = datum_cache.get_datum(self.datum.slug)
+        self.assertEqual((datum.pk, datum.type, datum.user_id, datum.storage, datum.raw_retention_days),
+                         (self.datum.pk, Datum.FLOAT, self.user.pk, Datum.CHUNKS, 30))
+
+        # retention moves pruned_before up with an UPDATE, without signals
+        retention.prepare_raw(datum, datetime.datetime(2017, 3, 31, 12))
+        self.assertEqual(datum_cache.get_datum(self.datum.slug).pruned_before, datetime.datetime(2017, 3, 1))
+
+    def test_renamed_slug(self):
+        old_slug = self.datum.slug
+        datum_cache.get_datum(old_slug)
+        self.datum.slug = "outside"
+        self.datum.save()
+        with self.assertRaises(Datum.DoesNotExist):
+            datum_cache.get_datum(old_slug)
+        self.assertEqual(datum_cache.get_datums([old_slug, "outside"]).keys(), {"outside"})
+
+
+class ChunksTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.start = datetime.datetime(2017, 3, 1, 8)
+
+    def points(self, numbers):
+        return [(self.start + datetime.timedelta(seconds=10 * index, microseconds=index % 3), number)
+                for index, number in enumerate(numbers)]
+
+    def test_encode_decode(self):
+        floats = self.points([20.5, 20.5, -3.25, None, 1e300, 0.0, 20.5])
+        self.assertEqual(list(chunks.decode(self.start, chunks.encode(Datum.FLOAT, self.start, floats))), floats)
+        ints = self.points([5, 5, -70000, None, 2 ** 40, 0])
+        self.assertEqual(list(chunks.decode(self.start, chunks.encode(Datum.INT, self.start, ints))), ints)
+
+    def test_compact(self):
+        datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT, storage=Datum.CHUNKS)
+        Value.objects.bulk_create([Value(datum=datum, timestamp=self.start + datetime.timedelta(minutes=20 * index),
+                                         float_value=index) for index in range(7)])
+        before = list(chunks.iter_points(datum))
+
+        changed = Datum.objects.get(pk=datum.pk).values_changed
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(chunks.compact(datum, self.start + datetime.timedelta(hours=2, minutes=10)), (2, 6))
+        # the rows are deleted in one statement a window, and moving them isn't an edit
+        self.assertEqual(sum(1 for query in queries.captured_queries if query['sql'].startswith("DELETE")), 2)
+        self.assertEqual(Datum.objects.get(pk=datum.pk).values_changed, changed)
+        self.assertEqual(Value.objects.filter(datum=datum).count(), 1)
+        self.assertEqual(ValueChunk.objects.filter(datum=datum).count(), 2)
+        self.assertEqual(list(chunks.iter_points(datum)), before)
+        self.assertEqual(list(chunks.iter_points(datum, self.start + datetime.timedelta(minutes=50),
+                                                 self.start + datetime.timedelta(hours=2, minutes=1))),
+                         before[3:7])
+
+        # a late value for a compacted window is merged into its chunk
+        Value.objects.create(datum=datum, timestamp=self.start + datetime.timedelta(minutes=5), float_value=0.5)
+        self.assertEqual(chunks.compact(datum, self.start + datetime.timedelta(hours=1)), (1, 4))
+        self.assertEqual([value for _, value in chunks.iter_points(datum)][:3], [0.0, 0.5, 1.0])
+
+
+class RetentionTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.day = datetime.datetime(2026, 1, 5)
+        self.now = datetime.datetime(2026, 3, 1, 12)
+        datum_cache._local.clear()
+
+    def spans(self, datum):
+        return [(span.start.hour, span.end.hour if span.end else None)
+                for span in Span.objects.filter(datum=datum).order_by('start')]
+
+    def test_numeric(self):
+        datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT, raw_retention_days=30,
+                                     hourly_retention_days=40)
+        for days, number in ((0, 1.0), (0, 3.0), (50, 5.0)):
+            store_value(Value(datum=datum, timestamp=self.day + datetime.timedelta(days=days, hours=8),
+                              float_value=number))
+
+        result = retention.enforce_retention(datum, now=self.now)
+        self.assertEqual((result.values, result.rollups), (2, 1))
+        self.assertEqual(Value.objects.filter(datum=datum).count(), 1)
+        day = Rollup.objects.get(datum=datum, resolution=Rollup.DAY, bucket=self.day)
+        self.assertEqual((day.count, day.sum), (2, 4.0))
+
+        # late values are merged into the kept rollups, and rebuilds leave them alone
+        store_value(Value(datum=datum, timestamp=self.day + datetime.timedelta(hours=9), float_value=2.0))
+        datum.refresh_from_db()
+        rollups.rebuild_rollups(datum)
+        day.refresh_from_db()
+        self.assertEqual((day.count, day.sum), (3, 6.0))
+
+    def test_late_punches_for_pruned_days(self):
+        datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP, raw_retention_days=30)
+        datum_cache.get_datum(datum.slug)
+        stale = datum_cache._local.get(datum.slug)
+        for hours in (8, 12, 13, 17):
+            store_value(Value(datum=datum, timestamp=self.day + datetime.timedelta(hours=hours)))
+
+        self.assertEqual(retention.enforce_retention(datum, now=self.now).values, 4)
+        # still cached from before retention ran, like by another ingest worker
+        datum_cache._local.set(datum.slug, stale)
+        self.assertEqual(self.spans(datum), [(8, 12), (13, 17)])
+
+        bulk_ingest([[datum.slug, "2026-01-05T18:00:00", None]])
+        self.assertEqual(self.spans(datum), [(8, 12), (13, 17), (18, None)])
+
+        # a punch before the last span of the day repairs the day from its spans rather than its values
+        late = Value(datum=datum, timestamp=self.day + datetime.timedelta(hours=10))
+        store_value(late)
+        self.assertEqual(self.spans(datum), [(8, 10), (12, 13), (17, 18)])
+        late.delete()
+        self.assertEqual(self.spans(datum), [(8, 12), (13, 17), (18, None)])
+
+        spans.rebuild_spans(Datum.objects.get(pk=datum.pk))
+        self.assertEqual(self.spans(datum), [(8, 12), (13, 17), (18, None)])
+
+
+class SeriesTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.client = Client()
+        self.client.login(username="user", password="password")
+        self.url = reverse('datum_series', kwargs={'datum_id': self.datum.pk})
+        self.morning = datetime.datetime(2017, 3, 1, 8)
+        for minutes, number in ((0, 1.0), (1, 3.0), (70, 5.0)):
+            store_value(Value(datum=self.datum, timestamp=self.morning + datetime.timedelta(minutes=minutes),
+                              float_value=number))
+
+    def get(self, etag=None, **params):
+        params.setdefault('from', "2017-03-01T00:00:00")
+        params.setdefault('to', "2017-03-02T00:00:00")
+        if etag is None:
+            return self.client.get(self.url, params)
+        return self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+
+    def test_resolutions(self):
+        points = self.get(resolution="1h").json()['points']
+        self.assertEqual([(point['count'], point['avg']) for point in points], [(2, 2.0), (1, 5.0)])
+        points = self.get(resolution="1m").json()['points']
+        self.assertEqual([point['count'] for point in points], [1, 1, 1])
+        response = self.get(resolution="raw", max_points=2).json()
+        self.assertEqual([point['value'] for point in response['points']], [1.0, 3.0])
+        self.assertEqual(response['next'], "2017-03-01T09:10:00")
+        self.assertEqual(self.get(resolution="1s").status_code, 400)
+
+    def test_validators(self):
+        response = self.get(resolution="raw")
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        not_modified = self.get(etag, resolution="raw")
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(set(not_modified['Cache-Control'].split(", ")), {"private", "no-cache"})
+        since = self.client.get(self.url, {'resolution': "raw", 'from': "2017-03-01", 'to': "2017-03-02"},
+                                HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+        value = Value.objects.get(float_value=3.0)
+        value.float_value = 4.0
+        value.save()
+        response = self.get(etag, resolution="raw")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(series.validators(self.datum, "raw", self.morning, self.morning + datetime.timedelta(days=1),
+                                           10)[1], self.morning + datetime.timedelta(minutes=70))
+
+    def test_last_modified_in_dst_transition(self):
+        # 02:30 happens twice in CET that night
+        store_value(Value(datum=self.datum, timestamp=datetime.datetime(2017, 10, 29, 2, 30), float_value=1.0))
+        response = self.get(resolution="raw", **{'from': "2017-10-29", 'to': "2017-10-30"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+
+class WeekTableRowTest(TestCase):
+    def test_render(self):
+        row = WeekTableRow(datetime.date(2017, 3, 6))
+        for hour in range(24):
+            row.append(TableCell(row, hour, "rgba(135, 187, 255, 1)"))
+        row.add_span(datetime.datetime(2017, 3, 6, 8, 15), datetime.datetime(2017, 3, 6, 10, 30))
+
+        html = row.render()
+        self.assertEqual(html, "".join(cell.render() for cell in row))
+        self.assertEqual(html.count("<td "), 24)
+        self.assertIn("background-size: 75% 100%", row[8].render())
+        self.assertIn("background-size: 50% 100%", row[10].render())
+        self.assertIn('title="08:15:00 - 10:30:00 (2h 15m 0s)"', row[9].render())
+        self.assertEqual(row.total_duration_str, "2h 15m 0s")
+
+
+class HeatmapTest(TestCase):
+    def test_period_range(self):
+        day = datetime.date(2017, 11, 15)
+        self.assertEqual(heatmap.period_range('month', day), (datetime.date(2017, 11, 1), datetime.date(2017, 12, 1)))
+        self.assertEqual(heatmap.period_range('quarter', day), (datetime.date(2017, 10, 1), datetime.date(2018, 1, 1)))
+        self.assertEqual(heatmap.period_range('year', day), (datetime.date(2017, 1, 1), datetime.date(2018, 1, 1)))
+
+    def test_occupancy(self):
+        first_day = datetime.date(2017, 3, 6)
+        spans = [(datetime.datetime(2017, 3, 6, 8, 30), datetime.datetime(2017, 3, 6, 10, 15)),
+                 (datetime.datetime(2017, 3, 6, 9, 50), datetime.datetime(2017, 3, 6, 9, 55)),
+                 (datetime.datetime(2017, 3, 7, 23, 0), None)]
+        occupancy = heatmap.Heatmap(first_day, 2, spans, now=datetime.datetime(2017, 3, 8, 12))
+        rows = list(occupancy.rows())
+
+        self.assertEqual(rows[0][1][7:11], [0, 30, 60, 15])
+        self.assertEqual(rows[0][2], datetime.timedelta(hours=1, minutes=45))
+        # open spans of past days end at 23:59
+        self.assertEqual(rows[1][1][23], 59)
+        self.assertEqual(occupancy.total(), datetime.timedelta(hours=2, minutes=44))
+
+        # the plain Python fallback gives the same
+        with mock.patch.object(heatmap, 'numpy', None):
+            self.assertEqual(list(heatmap.Heatmap(first_day, 2, spans, now=occupancy.now).rows()), rows)
+
+
+@override_settings(LOGGER_METRICS=True)
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.client = Client()
+
+    def test_instrumented_view(self):
+        url = reverse('log_value', kwargs={'slug': self.datum.slug, 'value': "1.5"})
+        with self.assertLogs('logger.metrics', 'INFO') as logs:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['view'], line['status']), ("log_value", 200))
+        self.assertGreater(line['queries'], 0)
+        self.assertAlmostEqual(line['seconds'], line['db_seconds'] + line['template_seconds'] + line['python_seconds'],
+                               places=5)
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('logger_request_seconds_count{view="log_value"}', text)
+        self.assertIn('# TYPE logger_request_queries histogram', text)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", (1, 5))
+        for value in (0.5, 3, 7):
+            histogram.observe("view", value)
+        lines = list(histogram.lines())
+        self.assertIn('test_seconds_bucket{view="view",le="1"} 1', lines)
+        self.assertIn('test_seconds_bucket{view="view",le="5"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="view",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{view="view"} 10.5', lines)
+
+    @override_settings(LOGGER_METRICS=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+
+class BenchmarksTest(TestCase):
+    def test_week_url_across_new_year(self):
+        datum = mock.Mock(pk=1)
+        with mock.patch.object(benchmarks, 'monday_this_week', return_value=datetime.date(2026, 1, 5)):
+            url = benchmarks._week_url(datum, 1)
+        self.assertEqual(url, "/datum/1?week=52&year=2025")
+
+    def test_week_of_another_year(self):
+        user = User.objects.create_user(username="user", password="password")
+        datum = Datum.objects.create(user=user, name="work", type=Datum.TIMESTAMP)
+        self.client.login(username="user", password="password")
+        response = self.client.get(reverse('datum', kwargs={'datum_id': datum.pk}), {'week': 52, 'year': 2025})
+        self.assertEqual(response.context['from_date'], datetime.date(2025, 12, 29))
+
+    def test_run(self):
+        datums = benchmarks.generate(300, 14)
+        self.assertEqual(benchmarks.find_datums().keys(), datums.keys())
+        results = benchmarks.run(datums, 1, ["timestamp_datum_cached", "index"])
+        self.assertEqual(sorted(results), ["index", "timestamp_datum_cached"])
+        self.assertEqual(results['timestamp_datum_cached']['repeat'], 1)
+
+        slower = {'index': dict(results['index'], median_seconds=results['index']['median_seconds'] * 3)}
+        messages = benchmarks.regressions(slower, {'index': {'max_queries': 0}}, results, tolerance=2)
+        self.assertEqual(len(messages), 2)
+
+
+class FeedTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP)
+        self.client.login(username="user", password="password")
+        self.morning = datetime.datetime(2017, 3, 6, 8)
+
+    def punch(self, hours, **fields):
+        timestamp = self.morning + datetime.timedelta(hours=hours)
+        return Value.objects.create(datum=self.datum, timestamp=timestamp, **fields)
+
+    def value_ids(self, batch):
+        return [data['id'] for _, event, data in batch if event == "value"]
+
+    def test_late_commit(self):
+        first, late, last = self.punch(0), self.punch(1), self.punch(2)
+        late_id = late.id
+        late.delete()  # as if its transaction hadn't committed yet
+        batch = feed.events(self.datum, feed.Cursor(0, frozenset()))
+        self.assertEqual(self.value_ids(batch), [first.id, last.id])
+        cursor = batch[-1][0]
+        self.assertEqual(cursor.gaps, {late_id})
+
+        self.assertEqual(feed.events(self.datum, cursor), [])
+        self.punch(1, id=late_id)
+        batch = feed.events(self.datum, feed.Cursor.parse(str(cursor)))
+        self.assertEqual(self.value_ids(batch), [late_id])
+        self.assertEqual(batch[-1][0], feed.Cursor(last.id, frozenset()))
+
+    def test_gap_of_another_datum(self):
+        other = Datum.objects.create(user=self.user, name="other", type=Datum.FLOAT)
+        first, skipped, last = self.punch(0), self.punch(1), self.punch(2)
+        skipped_id = skipped.id
+        skipped.delete()
+        cursor = feed.events(self.datum, feed.Cursor(first.id, frozenset()))[-1][0]
+        self.assertEqual(str(cursor), "{}:{}".format(last.id, skipped_id))
+        Value.objects.create(id=skipped_id, datum=other, timestamp=self.morning, float_value=1.0)
+        self.assertEqual(feed.events(self.datum, cursor), [])
+        newer = self.punch(3)
+        self.assertEqual(feed.events(self.datum, cursor)[-1][0], feed.Cursor(newer.id, frozenset()))
+
+    def test_spans_closed_and_opened_at_once(self):
+        for hours in (0, 1, 1, 2):
+            self.punch(hours)
+        batch = feed.events(self.datum, feed.Cursor(0, frozenset()))
+        self.assertEqual([(event, data.get('state')) for _, event, data in batch],
+                         [("span", "open"), ("value", None),
+                          ("span", "close"), ("span", "open"), ("value", None), ("value", None),
+                          ("span", "close"), ("value", None)])
+
+    @override_settings(LOGGER_FEED_TIMEOUT=0)
+    def test_stream(self):
+        first, second = self.punch(0), self.punch(1)
+        url = reverse('datum_events', kwargs={'datum_id': self.datum.pk})
+        response = self.client.get(url, HTTP_LAST_EVENT_ID=str(first.id))
+        self.assertEqual(response['Content-Type'], "text/event-stream")
+        text = "".join(chunk.decode() for chunk in response.streaming_content)
+        self.assertIn("id: {}\nevent: value\n".format(second.id), text)
+        self.assertNotIn("id: {}\n".format(first.id), text)
+        self.assertEqual(self.client.get(url, HTTP_LAST_EVENT_ID="5:7").status_code, 400)
+
+    @override_settings(LOGGER_FEED_KEEPALIVE=0)
+    def test_poll(self):
+        first, second = self.punch(0), self.punch(1)
+        url = reverse('datum_events_poll', kwargs={'datum_id': self.datum.pk})
+        answer = json.loads(self.client.get(url, {'last_event_id': 0}).content.decode())
+        self.assertEqual([event['data']['id'] for event in answer['events'] if event['event'] == "value"],
+                         [first.id, second.id])
+        self.assertEqual(answer['last_event_id'], str(second.id))
+
+        answer = json.loads(self.client.get(url, {'last_event_id': answer['last_event_id']}).content.decode())
+        self.assertEqual(answer['events'], [])
+        self.assertEqual(self.client.get(url, {'last_event_id': "x"}).status_code, 400)
+
+
+class PartitionsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.months = [datetime.date(2016, 12, 1), datetime.date(2017, 1, 1), datetime.date(2017, 2, 1)]
+        for month in self.months:
+            Value.objects.create(datum=self.datum, timestamp=datetime.datetime.combine(month, datetime.time(12)),
+                                 float_value=month.month)
+
+    def test_months(self):
+        self.assertEqual(partitions.next_month(datetime.date(2016, 12, 1)), datetime.date(2017, 1, 1))
+        self.assertEqual(partitions.next_month(datetime.date(2017, 1, 1)), datetime.date(2017, 2, 1))
+        self.assertEqual(partitions.partition_name(datetime.date(2017, 1, 1)), "p201701")
+        self.assertEqual(partitions.partition_month("p201612"), datetime.date(2016, 12, 1))
+        self.assertIsNone(partitions.partition_month(partitions.FUTURE))
+
+    def test_drop_months_downsamples(self):
+        with mock.patch.object(partitions, 'months', return_value=self.months), \
+                mock.patch.object(partitions, '_execute') as execute:
+            dropped = partitions.drop_months(datetime.date(2017, 2, 15))
+        self.assertEqual(dropped, self.months[:2])
+        self.assertEqual(execute.call_args[0][0], ['ALTER TABLE "logger_value" DROP PARTITION p201612, p201701'])
+
+        self.datum.refresh_from_db()
+        self.assertEqual(self.datum.pruned_before, datetime.datetime(2017, 2, 1))
+        self.assertEqual(Rollup.objects.filter(datum=self.datum, resolution=Rollup.DAY).count(), 2)
+
+    def test_drop_expired(self):
+        other = Datum.objects.create(user=self.user, name="pressure", type=Datum.FLOAT, raw_retention_days=30)
+        self.datum.raw_retention_days = 60
+        self.datum.save()
+        now = datetime.datetime(2017, 3, 15)
+        with mock.patch.object(partitions, 'months', return_value=self.months), \
+                mock.patch.object(partitions, '_drop_partitions', side_effect=lambda months: months):
+            # the datum with the longer retention still has values in January
+            self.assertEqual(partitions.drop_expired(now, [self.datum, other]), self.months[:1])
+            # only the months that are over
+            self.assertEqual(partitions.drop_expired(datetime.datetime(2017, 2, 15), [other]), self.months[:2])
+        self.assertEqual(other.pruned_before, datetime.datetime(2017, 2, 13))
+
+
+class IndexSummaryQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.client = Client()
+        self.client.login(username="user", password="password")
+
+    def add_datums(self, count):
+        midnight = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        for index in range(count):
+            for datum_type, field in ((Datum.FLOAT, 'float_value'), (Datum.STRING, 'string_value'),
+                                      (Datum.TIMESTAMP, None)):
+                datum = Datum.objects.create(user=self.user, name="{}{}".format(datum_type.lower(), index),
+                                             type=datum_type)
+                for minutes in (1, 2):
+                    fields = {field: minutes} if field else {}
+                    store_value(Value(datum=datum, timestamp=midnight + datetime.timedelta(minutes=minutes), **fields))
+
+    def test_query_count_is_constant(self):
+        # session, user, datums with the ids of their latest values, those values, numeric rollups and other counts
+        for count in (1, 5):
+            self.add_datums(count)
+            with self.assertNumQueries(6):
+                response = self.client.get(reverse('index'))
+            self.assertEqual(response.status_code, 200)
+
+        summaries = response.context['summaries']
+        self.assertEqual(len(summaries), 18)
+        for summary in summaries:
+            self.assertEqual(summary.today_count, 2)
+            self.assertIsNotNone(summary.last_seen)
+            if summary.datum.type == Datum.FLOAT:
+                self.assertEqual(summary.latest, 2.0)
+                self.assertEqual(summary.sparkline_values[-1], 1.5)
+            else:
+                self.assertEqual(summary.sparkline_values[-1], 2)
+            if summary.datum.type == Datum.STRING:
+                self.assertEqual(summary.latest, "2")
+
+
+@override_settings(LOGGER_DB_REPLICAS=['replica'])
+class ReplicaRouterTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="temperature", type=Datum.FLOAT)
+        self.router = routers.ReplicaRouter()
+
+    def test_routing(self):
+        self.assertEqual(self.router.db_for_read(Value), 'default')
+        self.assertEqual(self.router.db_for_write(Value), 'default')
+        with routers.use_replicas():
+            self.assertEqual(self.router.db_for_read(Value), 'replica')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Value), 'default')
+
+    def test_read_your_writes(self):
+        other = User.objects.create_user(username="other", password="password")
+        # the datum was created in setUp
+        self.assertFalse(routers.should_use_replicas(self.user.pk))
+        self.assertTrue(routers.should_use_replicas(other.pk))
+
+        store_value(Value(datum=Datum.objects.create(user=other, name="pressure", type=Datum.FLOAT), float_value=1))
+        self.assertFalse(routers.should_use_replicas(other.pk))
+
+    def test_views_read_from_replica(self):
+        cache.clear()  # forget that the datum was just created
+        self.client.login(username="user", password="password")
+        url = reverse('datum', kwargs={'datum_id': self.datum.pk})
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(any('"logger_datum"' in query['sql'] for query in replica.captured_queries))
+        self.assertFalse(any('"logger_' in query['sql'] for query in primary.captured_queries))
+
+        # the user's own value is read back from the primary, which has it for sure
+        self.client.get(reverse('log_value', kwargs={'slug': self.datum.slug, 'value': "1.5"}))
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(replica), 0)
+
+
+class IdempotentIngestTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="work", type=Datum.TIMESTAMP)
+        self.client = Client()
+        dedup._recent.clear()
+
+    def test_log_value_retries(self):
+        url = reverse('log_value', kwargs={'slug': self.datum.slug, 'value': "timestamp"})
+        self.assertTrue(self.client.get(url, HTTP_IDEMPOTENCY_KEY="a").content.startswith(b"saved"))
+        # answered from the recent keys
+        with self.assertNumQueries(0):
+            self.assertTrue(self.client.get(url, HTTP_IDEMPOTENCY_KEY="a").content.startswith(b"duplicate"))
+        # and from the unique index, like by another process
+        dedup._recent.clear()
+        self.assertTrue(self.client.get(url + "?key=a").content.startswith(b"duplicate"))
+        self.assertTrue(self.client.get(url + "?key=b").content.startswith(b"saved"))
+
+        self.assertEqual(Value.objects.filter(datum=self.datum).count(), 2)
+        self.assertEqual(self.datum.span_set.count(), 1)
+        self.assertFalse(self.datum.span_set.get().is_open)
+
+    def test_bulk_retries(self):
+        url = reverse('bulk_log_values')
+        records = [{'slug': self.datum.slug, 'timestamp': "2017-03-01T08:00:00", 'key': "in"},
+                   [self.datum.slug, "2017-03-01T08:00:00", None, "in"],
+                   [self.datum.slug, "2017-03-01T17:00:00", None, "out"]]
+        response = self.client.post(url, json.dumps(records[:1]), content_type="application/json")
+        self.assertEqual(response.json()['saved'], 1)
+
+        dedup._recent.clear()
+        response = self.client.post(url, json.dumps(records), content_type="application/json")
+        self.assertEqual([result['status'] for result in response.json()['results']], ["duplicate", "duplicate", "ok"])
+        self.assertEqual(Value.objects.filter(datum=self.datum).count(), 2)
+        self.assertEqual(self.datum.span_set.get().duration, datetime.timedelta(hours=9))
+
+
+class IngestWSGITest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.datum = Datum.objects.create(user=self.user, name="Ingest", type=Datum.FLOAT)
+        self.application = IngestWSGIApplication()
+        dedup._recent.clear()
+
+    def request(self, method, path, body=b'', query_string="", **headers):
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query_string,
+                   'CONTENT_TYPE': "application/json", 'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+        environ.update(headers)
+        started = []
+        body = b"".join(self.application(environ, lambda status, response_headers: started.append(status)))
+        return int(started[0].split()[0]), body.decode()
+
+    def test_routes(self):
+        self.assertEqual(self.datum.slug, "ingest")
+        self.assertEqual(self.request("GET", "/-/ingest/1.5"), (200, "saved"))
+        status, text = self.request("GET", "/ingest/2.5")
+        self.assertEqual(status, 200)
+        self.assertTrue(text.startswith("saved: slug: ingest"))
+        self.assertEqual(self.request("GET", "/-/ingest/warm")[0], 400)
+        self.assertEqual(self.request("GET", "/-/nope/1")[0], 404)
+        self.assertEqual(self.request("GET", "/-/ingest")[0], 404)
+        self.assertEqual(sorted(Value.objects.values_list('float_value', flat=True)), [1.5, 2.5])
+
+    def test_site_short_route(self):
+        self.assertEqual(self.client.get(reverse('ingest_value', kwargs={'slug': "ingest", 'value': "1"})).content,
+                         b"saved")
+        self.assertEqual(Value.objects.get().float_value, 1.0)
+
+    def test_bulk(self):
+        body = json.dumps([["ingest", "2017-03-01T08:00:00", value] for value in (1, 2)]).encode()
+        status, text = self.request("POST", "/-/bulk", body)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(text)['saved'], 2)
+        self.assertEqual(self.request("POST", "/bulk/", b"[")[0], 400)
+        self.assertEqual(self.request("GET", "/-/bulk")[0], 405)
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=5):
+            self.assertEqual(self.request("POST", "/-/bulk", body)[0], 413)
+
+    def test_idempotency_key(self):
+        self.assertEqual(self.request("GET", "/-/ingest/1", HTTP_IDEMPOTENCY_KEY="a"), (200, "saved"))
+        self.assertEqual(self.request("GET", "/-/ingest/1", query_string="key=a"), (200, "duplicate"))
+        self.assertEqual(self.request("GET", "/-/ingest/1", query_string="key=b"), (200, "saved"))
+        self.assertEqual(Value.objects.count(), 2)
@@ -0,0 +1,60 @@
+import datetime
+from collections import OrderedDict, namedtuple
+
+from logger.timestamp_table import TableCell, WeekTableRow
+
+# a single punch of a span, for listing. `diff` is zero for starts and the span duration for stops
+Punch = namedtuple('Punch', ['timestamp', 'diff'])
+
+
+class WeekTimeline(object):
+    """
+    The spans of one week of a TIMESTAMP datum, mapped onto the week table.
+
+    `spans` must be ordered by start. Open spans are closed at `now` if they're on today's date, otherwise at the end
+    of their day.
+    """
+
+    def __init__(self, from_date, spans, now=None):
+        self.from_date = from_date
+        self.now = now if now is not None else datetime.datetime.now()
+        self.spans = OrderedDict()
+        for span in spans:
+            self.spans.setdefault(span.start.date(), []).append(span)
+
+    def table_rows(self, datum):
+        rows = []
+        color = datum.color_rgba
+        for day_index in range(7):
+            day = self.from_date + datetime.timedelta(days=day_index)
+            row = WeekTableRow(day)
+            for hour in range(24):
+                row.append(TableCell(row, hour, color))
+
+            for span in self.spans.get(day, ()):
+                if not span.is_open:
+                    row.add_span(span.start, span.end)
+                elif day == self.now.date():  # the span is "in progress"
+                    row.add_span(span.start, max(span.start, self.now))
+                else:
+                    end_of_day = datetime.datetime(year=day.year, month=day.month, day=day.day, hour=23, minute=59,
+                                                   second=0)
+                    row.add_span(span.start, max(span.start, end_of_day), open_ended=True)
+
+            rows.append(row)
+
+        return rows
+
+    def day_punches(self):
+        """Returns a list of (day, punches) tuples, sorted on day."""
+        zero_delta = datetime.timedelta()
+        days = []
+        for day, spans in sorted(self.spans.items()):
+            punches = []
+            for span in spans:
+                punches.append(Punch(span.start, zero_delta))
+                if not span.is_open:
+                    punches.append(Punch(span.end, span.duration))
+            days.append((day, punches))
+
+        return days
@@ -1,4 +1,5 @@
 import datetime
+from functools import lru_cache
 
 from logger.utils import format_timedelta
 
@@ -21,34 +22,40 @@ class WeekTableRow(list):
     def total_duration_str(self):
         return format_timedelta(self.total_duration)
 
-    def set_span_end(self, cell_index):
-        cells_to_update = []
-        start = end = None
-        for cell in reversed(self[:cell_index + 1]):
-            if cell.state == TableCell.START:
-                cells_to_update.append(cell)
-                start = cell.start_timestamp
-                break
-            elif cell.state == TableCell.PARTIAL:
-                cells_to_update.append(cell)
-                start = cell.start_timestamp
-                end = cell.end_timestamp
-                break
-            elif cell.state == TableCell.FULL:
-                cells_to_update.append(cell)
-                if cell.hour == 23:
-                    end = cell.end_timestamp
-            elif cell.state == TableCell.END:
-                cells_to_update.append(cell)
-                end = cell.end_timestamp
-            elif cell.state == TableCell.EMPTY:
-                break
-            elif cell.state == TableCell.REVERSE_PARTIAL:
-                cells_to_update.append(cell)
-                start = cell.end_timestamp
-                break
+    def render(self):
+        """The <td>s of all cells of the row, in one join."""
+        return "".join([cell_html(cell.title, cell.state, cell.color, cell.start_factor, cell.end_factor, cell.value)
+                        for cell in self])
+
+    def add_span(self, start, end, open_ended=False):
+        """
+        Mark the cells covered by the span from start to end, and add its duration to the row total.
+
+        An open ended span runs past the end of the row, so its last cell is filled rather than ended.
+        """
+        first, last = start.hour, end.hour
+
+        first_cell = self[first]
+        if first == last and not open_ended:
+            if first_cell.state == TableCell.END:  # can't show a gap within a cell, so just extend the previous span
+                first_cell.set_end(timestamp=end)
+            else:
+                first_cell.set_partial(start_timestamp=start, end_timestamp=end)
+        elif first_cell.state == TableCell.END:
+            first_cell.set_reverse_partial(start_timestamp=first_cell.end_timestamp, end_timestamp=start)
+        else:
+            first_cell.set_start(timestamp=start)
+
+        for cell in self[first + 1:last]:
+            cell.set_full()
+
+        if last != first:
+            last_cell = self[last]
+            if open_ended:
+                last_cell.set_full()
+                last_cell.end_timestamp = end
             else:
-                raise NotImplementedError
+                last_cell.set_end(timestamp=end)
 
         delta = end - start
 
@@ -56,9 +63,11 @@ class WeekTableRow(list):
 
         title = "{} - {} ({})".format(start.strftime("%H:%M:%S"), end.strftime("%H:%M:%S"), delta_str)
 
-        for cell in cells_to_update:
+        for cell in self[first:last + 1]:
             cell.title = title
 
+        self.total_duration += delta
+
 
 class TableCell(object):
     EMPTY = 0
@@ -71,7 +80,12 @@ class TableCell(object):
     EMPTY_COLOR = "#FFFFFF00"
     BACKGROUND_COLOR = "#FFFFFFFF"
 
-    def __init__(self, row, hour, datum):
+    # a year of rows is almost 9000 cells, so they only have the attributes below
+    __slots__ = ('row', 'hour', 'state', 'value', 'start_timestamp', 'end_timestamp', 'start_factor', 'end_factor',
+                 'color', 'title')
+
+    def __init__(self, row, hour, color):
+        """`color` is the datum's color_rgba, which is passed in so it's only computed once per table."""
         self.row = row
         self.hour = hour
         self.state = self.EMPTY
@@ -80,7 +94,7 @@ class TableCell(object):
         self.end_timestamp = None
         self.start_factor = 0.0
         self.end_factor = 0.0
-        self.color = datum.color_rgba
+        self.color = color
         self.title = "NO TITLE"
 
     def set_full(self):
@@ -90,7 +104,7 @@ class TableCell(object):
     def set_empty(self):
         self.value = ""
         self.state = self.EMPTY
-        self.color = "#FFFFFF00"
+        self.color = self.EMPTY_COLOR
 
     def set_start(self, timestamp):
         self.state = self.START
@@ -125,54 +139,43 @@ class TableCell(object):
         self.value = ""
 
     def render(self):
-        style = ""
-        attributes = ""
-        if self.state == self.EMPTY:
-            style = "background-color: {};".format(self.EMPTY_COLOR)
-            attributes = 'style="{}"'.format(style)
-        elif self.state == self.FULL:
-            styles = [
-                "border-left: none;",
-                "background-color: {};".format(self.color)
-            ]
-            style = " ".join(styles)
-            attributes = 'style="{}"'.format(style)
-        elif self.state == self.START:
-            styles = [
-                "background-image: linear-gradient(to left, {self.color} 0%, {self.color} 100%);".format(self=self),
-                "background-repeat: no-repeat;",
-                "background-position: 100% 100%;",
-                "background-size: {}% 100%".format(int((1 - self.start_factor) * 100))]
-            style = " ".join(styles)
-            attributes = 'style="{}"'.format(style)
-        elif self.state == self.END:
-            styles = [
-                "border-left: none;",
-                "background-image: linear-gradient(to right, {self.color} 0%, {self.color} 100%);".format(self=self),
-                "background-repeat: no-repeat;",
-                "background-size: {}% 100%".format(int(self.end_factor * 100))]
-            style = " ".join(styles)
-            attributes = 'style="{}"'.format(style)
-        elif self.state == self.PARTIAL:
-            fill = self.end_factor - self.start_factor
-            styles = [
-                "background-image: linear-gradient(to right, {self.color} 0%, {self.color} 100%);".format(self=self),
-                "background-repeat: no-repeat;",
-                "background-position: {}% 100%;".format(int(self.start_factor * 100)),
-                "background-size: {}% 100%".format(int(fill * 100))]
-            style = " ".join(styles)
-            attributes = 'style="{}"'.format(style)
-        elif self.state == self.REVERSE_PARTIAL:
-            fill = self.end_factor - self.start_factor
-            styles = [
-                "border-left: none;",
-                "background-color: {self.color};".format(self=self),
-                "background-image: linear-gradient(to right, {self.BACKGROUND_COLOR} 0%, {self.BACKGROUND_COLOR} 100%);".format(
-                    self=self),
-                "background-repeat: no-repeat;",
-                "background-position: {}% 100%;".format(int(self.start_factor * 100)),
-                "background-size: {}% 100%".format(int(fill * 100))]
-            style = " ".join(styles)
-            attributes = 'style="{}"'.format(style)
-
-        return '<td title="{}" class="day_cell" {}>{}</td>'.format(self.title, attributes, self.value)
+        return cell_html(self.title, self.state, self.color, self.start_factor, self.end_factor, self.value)
+
+
+# the style attribute of each cell state, filled in with the color and the percentages of the cell's factors
+_STYLES = {
+    TableCell.EMPTY: 'style="background-color: {empty};"',
+    TableCell.FULL: 'style="border-left: none; background-color: {color};"',
+    TableCell.START: ('style="background-image: linear-gradient(to left, {color} 0%, {color} 100%); '
+                      'background-repeat: no-repeat; background-position: 100% 100%; background-size: {rest}% 100%"'),
+    TableCell.END: ('style="border-left: none; background-image: linear-gradient(to right, {color} 0%, {color} 100%); '
+                    'background-repeat: no-repeat; background-size: {end}% 100%"'),
+    TableCell.PARTIAL: ('style="background-image: linear-gradient(to right, {color} 0%, {color} 100%); '
+                        'background-repeat: no-repeat; background-position: {start}% 100%; '
+                        'background-size: {fill}% 100%"'),
+    TableCell.REVERSE_PARTIAL: ('style="border-left: none; background-color: {color}; '
+                                'background-image: linear-gradient(to right, {background} 0%, {background} 100%); '
+                                'background-repeat: no-repeat; background-position: {start}% 100%; '
+                                'background-size: {fill}% 100%"'),
+}
+
+
+@lru_cache(maxsize=4096)
+def cell_style(state, color, start_factor, end_factor):
+    """
+    The style attribute of a cell. Factors are whole minutes over 60, so a table only ever has a few distinct styles
+    per color, and after the first they're all cache hits.
+    """
+    template = _STYLES.get(state)
+    if template is None:
+        return ""
+    return template.format(color=color, empty=TableCell.EMPTY_COLOR, background=TableCell.BACKGROUND_COLOR,
+                           rest=int((1 - start_factor) * 100), end=int(end_factor * 100),
+                           start=int(start_factor * 100), fill=int((end_factor - start_factor) * 100))
+
+
+@lru_cache(maxsize=16384)
+def cell_html(title, state, color, start_factor, end_factor, value):
+    """The <td> of a cell. Most cells of a table are empty or full, and all cells of a span share its title."""
+    return '<td title="{}" class="day_cell" {}>{}</td>'.format(title, cell_style(state, color, start_factor,
+                                                                                   end_factor), value)
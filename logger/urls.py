@@ -1,11 +1,22 @@
 from django.conf.urls import url
 from django.contrib.auth import views as auth_views
 
-from . import views
+from . import metrics, views
 
 urlpatterns = [
+    # the short ingest routes first, see logger/ingest_app.py
+    url(r'^-/bulk/?$', views.bulk_log_values, name="ingest_bulk"),
+    url(r'^-/(?P<slug>[^/]+)/(?P<value>[^/]+)/?$', views.ingest_value, name="ingest_value"),
+
     url(r'^$', views.index, name='index'),
+    url(r'^metrics$', metrics.metrics, name='metrics'),
 
+    url(r'^datum/(?P<datum_id>\d+)/export\.(?P<format>csv|ndjson)$', views.export_datum, name='export_datum'),
+    url(r'^datum/(?P<datum_id>\d+)/series\.json$', views.datum_series, name='datum_series'),
+    url(r'^datum/(?P<datum_id>\d+)/events$', views.datum_events, name='datum_events'),
+    url(r'^datum/(?P<datum_id>\d+)/events\.json$', views.datum_events_poll, name='datum_events_poll'),
+    url(r'^datum/(?P<datum_id>\d+)/heatmap/(?P<period>month|quarter|year)$', views.datum_heatmap,
+        name='datum_heatmap'),
     url(r'^datum/(?P<datum_id>.+?)$', views.datum, name='datum'),
 
     url('^login/$', auth_views.login, name="user_login"),
@@ -18,6 +29,8 @@ urlpatterns = [
         auth_views.password_reset_confirm, name='user_password_reset_confirm'),
     url('^reset/done/$', auth_views.password_reset_complete, name='user_password_reset_complete'),
 
+    url(r'^bulk/?$', views.bulk_log_values, name="bulk_log_values"),
+
     url(r'^(?P<slug>.+?)/add_lunch/(?P<date>.+?)/(?P<duration>\d+)/?$', views.add_lunch, name="add_lunch"),
 
     url(r'^(?P<slug>.+?)/(?P<value>.+?)/?$', views.log_value, name="log_value"),
@@ -1,5 +1,7 @@
 import datetime
 
+from django.utils.dateparse import parse_date, parse_datetime
+
 
 def format_timedelta(delta, use_days=True):
     days, seconds = delta.days, delta.seconds
@@ -23,3 +25,22 @@ def monday_this_week(today=None):
     monday = today - datetime.timedelta(days=today.weekday())
 
     return monday
+
+
+def datetime_range(from_date, days=1):
+    """Returns the half open range [from_date 00:00, from_date + days 00:00) as a pair of datetimes."""
+    start = datetime.datetime.combine(from_date, datetime.time())
+    return start, start + datetime.timedelta(days=days)
+
+
+def parse_datetime_or_date(value):
+    """Parse an ISO 8601 datetime, or a date which is taken as midnight. Returns None if `value` is neither."""
+    try:
+        parsed = parse_datetime(value) or parse_date(value)
+    except ValueError:
+        return None
+
+    if isinstance(parsed, datetime.date) and not isinstance(parsed, datetime.datetime):
+        parsed = datetime.datetime.combine(parsed, datetime.time())
+
+    return parsed
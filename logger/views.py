@@ -1,24 +1,42 @@
 import datetime
-import operator
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.http import Http404
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-
-from logger.timestamp_table import TableCell, WeekTableRow
-from logger.utils import format_timedelta, monday_this_week
-from .models import Value, Datum
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
+
+from logger import export, feed, heatmap, ingest_app, series, summary, week_cache
+from logger.buffer import get_buffer
+from logger.datum_cache import get_datum_or_404
+from logger.ingest import IngestError, build_value, bulk_ingest, parse_key, parse_records, store_value
+from logger.metrics import instrumented
+from logger.rollups import NUMERIC_TYPES
+from logger.routers import replica_reads
+from logger.spans import day_totals
+from logger.timeline import WeekTimeline
+from logger.utils import datetime_range, format_timedelta, monday_this_week, parse_datetime_or_date
+from .models import Value, Datum, Rollup, Span
+
+NUMERIC_DATUM_DAYS = 31
 
 
 @login_required
+@replica_reads
 def index(request):
     datums = Datum.objects.filter(user=request.user)
-    context = {'datums': datums}
+    context = {'summaries': summary.summarize(datums)}
     return render(request, "logger/index.html", context)
 
 
+@instrumented
 @login_required
+@replica_reads
 def datum(request, datum_id):
     datum = get_object_or_404(Datum, user=request.user, pk=datum_id)
     context = {'datum': datum}
@@ -28,6 +46,8 @@ def datum(request, datum_id):
     if datum.type == Datum.TIMESTAMP:
         template = 'logger/datum_timestamp.html'
         context = timestamp_datum(request, datum, context)
+    elif datum.type in NUMERIC_TYPES:
+        context = numeric_datum(request, datum, context)
 
     return render(request, template, context)
 
@@ -37,130 +57,257 @@ def timestamp_datum(request, datum, context):
     if 'week' in request.GET and request.GET['week'].isdigit():
         week = int(request.GET['week'])
         year = datetime.datetime.today().year
+        if request.GET.get('year', '').isdigit():
+            year = int(request.GET['year'])
         date = datetime.datetime.strptime("{}-W{}-1".format(year, week), "%Y-W%W-%w").date()
         from_date = monday_this_week(today=date)
     else:
         from_date = monday_this_week()
-        week = int(from_date.strftime("%W"))
-
-    to_date = from_date + datetime.timedelta(days=7)
 
-    week_values = Value.objects.filter(datum=datum, timestamp__gte=from_date, timestamp__lt=to_date).order_by('timestamp')
+    week_table = week_cache.get_week(datum, from_date)
+    if week_table is None:
+        week_table = render_to_string('logger/week_table.html', week_table_context(datum, from_date))
+        week_cache.set_week(datum, from_date, week_table)
 
-    days = {}
+    context['week_table'] = week_table
+    context['from_date'] = from_date
+    context['week'] = from_date.strftime("%U")
 
-    for value in week_values:
-        day = value.timestamp.date().strftime("%Y-%m-%d")
+    return context
 
-        if day not in days:
-            days[day] = []
 
-        days[day].append(value)
+def week_table_context(datum, from_date):
+    week_start, week_end = datetime_range(from_date, days=7)
 
-    zero_delta = datetime.timedelta()
+    week_spans = Span.objects.filter(datum=datum, start__gte=week_start, start__lt=week_end).order_by('start')
 
-    for day, entries in days.items():
-        start = None
-        for entry in entries:
-            if start is None:
-                start = entry
-                entry.diff = zero_delta
-                continue
-            else:
-                diff = entry.timestamp - start.timestamp
-                entry.diff = diff
-                start = None
+    timeline = WeekTimeline(from_date, week_spans)
 
     hours = range(24)
 
-    day_table_rows = []
-    for day in range(7):
-        row = WeekTableRow(from_date + datetime.timedelta(days=day))
-        day_table_rows.append(row)
-        for hour in range(24):
-            day_table_rows[day].append(TableCell(row, hour, datum))
-
-    now = datetime.datetime.now()
-
-    total_week_duration = datetime.timedelta()
-
-    for day_index, row in enumerate(day_table_rows):
-        day = from_date + datetime.timedelta(days=day_index)
-        values = week_values.filter(timestamp__gte=from_date, timestamp__date=day).order_by('timestamp')
-
-        started = None
-        for cell_index, cell in enumerate(row):
-            for value in values:
-                if value.timestamp.hour == cell_index:
-                    ts = value.timestamp
-                    if not started:
-                        if cell.state == TableCell.END:
-                            cell.set_reverse_partial(start_timestamp=cell.end_timestamp, end_timestamp=ts)
-                        else:
-                            cell.set_start(timestamp=ts)
-                        started = value.timestamp
-                    else:
-                        if cell.state == TableCell.START:
-                            cell.set_partial(start_timestamp=cell.start_timestamp, end_timestamp=ts)
-                            row.set_span_end(cell_index)
-                        else:
-                            cell.set_end(timestamp=ts)
-                            row.set_span_end(cell_index)
-
-                        row.total_duration += ts - started
-                        started = None
-
-            if started:  # a time span has started earlier and not been closed, ie. the event is "in progress"
-                if now.weekday() == day_index and int(now.strftime("%W")) == week:  # it is today
-                    if cell.state == TableCell.EMPTY:
-                        if cell_index == now.hour:  # cell empty and we're on this hour's cell, so set "now" as the end
-                            cell.set_end(timestamp=now)
-                            row.set_span_end(cell_index)
-                            row.total_duration += now - started
-                        elif cell_index > now.hour:  # cell empty and we've passed "now", so set it to empty
-                            cell.set_empty()
-                        elif cell_index < now.hour:  # cell empty but not yet reached "now", mark as full and it will
-                            cell.set_full()          # be closed later
-                    elif cell.state == TableCell.START:  # the span started in this cell, AND ends within it
-                        if cell_index == now.hour:
-                            cell.set_partial(start_timestamp=cell.start_timestamp, end_timestamp=now)
-                            row.set_span_end(cell_index)
-                            row.total_duration += now - started
-                elif started and cell.state == TableCell.EMPTY:  # it's not today, so just fill up the cell and hope the next iteration takes care of it
-                    cell.set_full()
-
-            if started and cell_index == 23 and cell.state == TableCell.FULL:
-                end_of_day = datetime.datetime(year=started.year, month=started.month, day=started.day, hour=23, minute=59, second=0)
-                row.total_duration += end_of_day - started
-                cell.end_timestamp = end_of_day
-                row.set_span_end(cell_index)
-
-        total_week_duration += row.total_duration
+    day_table_rows = timeline.table_rows(datum)
 
-    total_work_week_average = total_week_duration / 5
+    total_week_duration = sum((row.total_duration for row in day_table_rows), datetime.timedelta())
 
-    days = sorted(days.items(), key=operator.itemgetter(0))
-    sums = []
-    for _, entries in days:
-        sums.append(sum(entry.diff.total_seconds() for entry in entries))
+    total_work_week_average = total_week_duration / 5
 
-    days_with_sums = []
-    for i in range(len(days)):
-        days_with_sums.append((days[i][0], days[i][1], format_timedelta(datetime.timedelta(seconds=sums[i]))))
+    totals = day_totals(datum, week_start, week_end)
+    days_with_sums = [(day.strftime("%Y-%m-%d"), punches, format_timedelta(totals.get(day, datetime.timedelta())))
+                      for day, punches in timeline.day_punches()]
 
+    context = {'datum': datum}
     context['days'] = days_with_sums
     context['hours'] = hours
     context['day_table_rows'] = day_table_rows
-    context['from_date'] = from_date
-    context['week'] = from_date.strftime("%U")
     context['total_work_week_average'] = format_timedelta(total_work_week_average)
     context['total_week_duration'] = format_timedelta(total_week_duration, use_days=False)
 
     return context
 
 
+@login_required
+@replica_reads
+def datum_heatmap(request, datum_id, period):
+    datum = get_object_or_404(Datum, user=request.user, pk=datum_id, type=Datum.TIMESTAMP)
+
+    day = datetime.date.today()
+    if 'date' in request.GET:
+        try:
+            day = datetime.datetime.strptime(request.GET['date'], "%Y-%m-%d").date()
+        except ValueError:
+            return HttpResponseBadRequest("bad date: {}".format(request.GET['date']))
+
+    first_day, end_day = heatmap.period_range(period, day)
+    start, end = datetime_range(first_day, days=(end_day - first_day).days)
+    spans = Span.objects.filter(datum=datum, start__gte=start, start__lt=end).values_list('start', 'end')
+    occupancy = heatmap.Heatmap(first_day, (end_day - first_day).days, spans.iterator())
+
+    context = {
+        'datum': datum,
+        'period': period,
+        'periods': heatmap.PERIODS,
+        'first_day': first_day,
+        'previous_day': heatmap.period_range(period, first_day - datetime.timedelta(days=1))[0],
+        'next_day': end_day,
+        'hours': range(24),
+        'rows': heatmap.render_rows(occupancy, datum),
+        'hour_totals': [format_timedelta(total, use_days=False) for total in occupancy.hour_totals()],
+        'total': format_timedelta(occupancy.total(), use_days=False),
+    }
+    return render(request, "logger/heatmap.html", context)
+
+
+def numeric_datum(request, datum, context):
+    from_date = datetime.date.today() - datetime.timedelta(days=NUMERIC_DATUM_DAYS - 1)
+    from_datetime, _ = datetime_range(from_date)
+
+    context['rollups'] = Rollup.objects.filter(datum=datum, resolution=Rollup.DAY,
+                                               bucket__gte=from_datetime).order_by('-bucket')
+    context['from_date'] = from_date
+
+    return context
+
+
+@login_required
+@replica_reads
+def export_datum(request, datum_id, format):
+    datum = get_object_or_404(Datum, user=request.user, pk=datum_id)
+    content_type, lines = export.FORMATS[format]
+
+    columns = request.GET.get('columns', ",".join(export.DEFAULT_COLUMNS)).split(",")
+    try:
+        fields = export.value_columns(datum, columns)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    bounds = {}
+    for bound in ('from', 'to'):
+        if bound in request.GET:
+            bounds[bound] = parse_datetime_or_date(request.GET[bound])
+            if bounds[bound] is None:
+                return HttpResponseBadRequest("bad {} date: {}".format(bound, request.GET[bound]))
+
+    rows = export.iter_values(datum, fields, start=bounds.get('from'), end=bounds.get('to'))
+
+    response = StreamingHttpResponse(lines(columns, rows), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(datum.slug, format)
+    return response
+
+
+def _series_params(request):
+    """The (resolution, start, end, max_points) of a datum_series request, or the JsonResponse of what's wrong."""
+    resolution = request.GET.get('resolution', "1h")
+    if resolution not in series.RESOLUTIONS:
+        return JsonResponse({'error': "resolution must be one of {}".format(", ".join(series.RESOLUTIONS))},
+                            status=400)
+
+    try:
+        max_points = min(int(request.GET.get('max_points', settings.LOGGER_SERIES_MAX_POINTS)),
+                         settings.LOGGER_SERIES_MAX_POINTS)
+    except ValueError:
+        return JsonResponse({'error': "bad max_points: {}".format(request.GET['max_points'])}, status=400)
+    if max_points < 1:
+        return JsonResponse({'error': "max_points must be positive"}, status=400)
+
+    bounds = {}
+    for bound in ('from', 'to'):
+        if bound in request.GET:
+            bounds[bound] = parse_datetime_or_date(request.GET[bound])
+            if bounds[bound] is None:
+                return JsonResponse({'error': "bad {} date: {}".format(bound, request.GET[bound])}, status=400)
+    end = bounds.get('to') or timezone.now()
+    start = bounds.get('from') or end - series.DEFAULT_RANGES[resolution]
+    return resolution, start, end, max_points
+
+
+def _series_validators(request, datum_id):
+    """
+    The ETag and newest value time of a datum_series request, None for bad requests. condition() asks for both, so
+    they're computed once and kept on the request, along with its parameters.
+    """
+    if not hasattr(request, '_series'):
+        datum = get_object_or_404(Datum, user=request.user, pk=datum_id)
+        params = _series_params(request)
+        validators = (None, None) if isinstance(params, JsonResponse) else series.validators(datum, *params)
+        request._series = datum, params, validators
+    return request._series[2]
+
+
+def _series_etag(request, datum_id):
+    return _series_validators(request, datum_id)[0]
+
+
+def _series_last_modified(request, datum_id):
+    newest = _series_validators(request, datum_id)[1]
+    # naive local times are ambiguous or don't exist around DST transitions, pick one rather than raise
+    return timezone.make_aware(newest, is_dst=False) if newest is not None else None
+
+
+@login_required
+@replica_reads
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_series_etag, last_modified_func=_series_last_modified)
+def datum_series(request, datum_id):
+    """
+    The points of a datum in the range ?from=&to= at ?resolution=raw, 1m, 1h or 1d, as JSON.
+
+    At most ?max_points= points are returned, capped by LOGGER_SERIES_MAX_POINTS. When there are more, "next" is the
+    time to ask for the rest from. Responses carry an ETag, so clients can revalidate without the points being read.
+    condition() quotes the ETag and compares it with If-None-Match the way the running Django version expects.
+    """
+    _series_validators(request, datum_id)
+    datum, params, _ = request._series
+    if isinstance(params, JsonResponse):
+        return params
+
+    resolution, start, end, max_points = params
+    points, following = series.series(datum, resolution, start, end, max_points)
+    response = JsonResponse({'datum': datum.slug, 'type': datum.type, 'unit': datum.unit, 'resolution': resolution,
+                             'from': start, 'to': end, 'points': points, 'next': following})
+    return response
+
+
+def _last_event_id(request):
+    """
+    The feed cursor of the last event a client got, from the Last-Event-ID header of a reconnecting EventSource or from
+    ?last_event_id=. None when the client has none, raises ValueError when it isn't a cursor.
+    """
+    raw = request.META.get('HTTP_LAST_EVENT_ID', request.GET.get('last_event_id'))
+    if raw is None or raw == "":
+        return None
+    return feed.Cursor.parse(raw)
+
+
+@login_required
+def datum_events(request, datum_id):
+    """
+    Server-sent events of the values of a datum as they're logged, and of the spans they open and close for TIMESTAMP
+    datums. A client that reconnects with a Last-Event-ID gets the values it missed first, otherwise the stream starts
+    with the values logged from now on. The stream holds its worker until it's closed, see logger/feed.py.
+    """
+    datum = get_object_or_404(Datum, user=request.user, pk=datum_id)
+    try:
+        after = _last_event_id(request)
+    except ValueError:
+        return HttpResponseBadRequest("bad last event id")
+    if after is None:
+        after = feed.last_value_id(datum)
+
+    response = StreamingHttpResponse(feed.stream(datum, after), content_type="text/event-stream")
+    response['Cache-Control'] = "no-cache"
+    response['X-Accel-Buffering'] = "no"  # nginx would hold the events back until its buffer is full
+    return response
+
+
+@login_required
+def datum_events_poll(request, datum_id):
+    """
+    Long polling version of datum_events for clients without EventSource: answers with the events after
+    ?last_event_id= as soon as there are any, or with none after LOGGER_FEED_KEEPALIVE seconds. Clients ask again with
+    the last_event_id of the answer.
+    """
+    datum = get_object_or_404(Datum, user=request.user, pk=datum_id)
+    try:
+        after = _last_event_id(request)
+    except ValueError:
+        return JsonResponse({'error': "bad last_event_id: {}".format(request.GET.get('last_event_id'))}, status=400)
+    if after is None:
+        after = feed.last_value_id(datum)
+
+    events = []
+    for event_id, event, data in feed.poll(datum, after):
+        if event_id is not None:
+            after = event_id
+        events.append({'id': str(event_id) if event_id is not None else None, 'event': event, 'data': data})
+
+    response = JsonResponse({'datum': datum.slug, 'events': events, 'last_event_id': str(after)})
+    response['Cache-Control'] = "no-cache"
+    return response
+
+
+@instrumented
 def add_lunch(request, slug, date, duration):
-    datum = get_object_or_404(Datum, slug=slug)
+    datum = get_datum_or_404(slug)
     duration = int(duration)
 
     try:
@@ -182,23 +329,42 @@ def add_lunch(request, slug, date, duration):
     return redirect('datum', datum_id=3)
 
 
+@instrumented
 def log_value(request, slug, value):
-    datum = get_object_or_404(Datum, slug=slug)
+    datum = get_datum_or_404(slug)
 
-    if datum.type == Datum.FLOAT:
-        try:
-            val = float(value)
-        except Exception:
-            return HttpResponse("bad val")
-        value = Value(datum=datum, float_value=val)
-        value.save()
-    elif datum.type == Datum.TIMESTAMP:
-        if value != "timestamp":
-            return HttpResponse('timestamp datum but value was not "timestamp"')
-
-        value = Value(datum=datum)
-        value.save()
-    else:
-        raise NotImplementedError('handling for {} datums not implemented yet'.format(datum.type))
+    try:
+        value = build_value(datum, value)
+        value.dedup_key = parse_key(request.META.get('HTTP_IDEMPOTENCY_KEY', request.GET.get('key')))
+    except IngestError as e:
+        return HttpResponse(str(e))
+
+    status = store_value(value)
+
+    return HttpResponse("{}: slug: {}, value: {}".format(status, slug, value))
+
+
+@instrumented
+def ingest_value(request, slug, value):
+    """log_value on the short route of logger/ingest_app.py, for sites that don't run an ingest-only application."""
+    try:
+        status, text = ingest_app.log_value(ingest_app.Route(False, True, slug, value),
+                                            request.META.get('HTTP_IDEMPOTENCY_KEY', request.GET.get('key')))
+    except ingest_app.HttpError as e:
+        status, text = e.status, str(e)
+    return HttpResponse(text, status=status, content_type="text/plain; charset=utf-8")
+
+
+@instrumented
+@csrf_exempt
+@require_POST
+def bulk_log_values(request):
+    try:
+        records = parse_records(request.body, request.content_type)
+    except IngestError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    results = bulk_ingest(records)
+    saved = sum(1 for result in results if result['status'] == 'ok')
 
-    return HttpResponse("saved: slug: {}, value: {}".format(slug, value))
+    return JsonResponse({'saved': saved, 'queued': get_buffer() is not None, 'results': results})
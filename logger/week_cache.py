@@ -0,0 +1,74 @@
+"""
+Cache of the rendered week table of TIMESTAMP datums, keyed on (datum, ISO year, ISO week).
+
+Entries are invalidated whenever the spans of their week change. A full rebuild of a datum bumps its version, which
+orphans all of its cached weeks at once.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .utils import monday_this_week
+
+
+def _version_key(datum_id):
+    return "logger:week_version:{}".format(datum_id)
+
+
+def _version(datum_id):
+    key = _version_key(datum_id)
+    version = cache.get(key)
+    if version is None:
+        # start from the clock rather than 1, so an evicted version can't resurrect entries from before the eviction
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def _week_key(datum_id, from_date):
+    year, week, _ = from_date.isocalendar()
+    return "logger:week:{}:{}:{}:{}".format(datum_id, _version(datum_id), year, week)
+
+
+def _timeout(from_date):
+    """
+    Returns the timeout for the week starting on from_date, or False if the week mustn't be cached.
+
+    The current week depends on the time of day, so it isn't cached. Weeks older than the horizon are cached for
+    longer, since only backfills change them, but never forever: a table rendered from a replica that hadn't caught up
+    with a backfill yet would be kept for good otherwise.
+    """
+    today = datetime.date.today()
+    week_end = from_date + datetime.timedelta(days=7)
+    if week_end > today:
+        return False
+
+    if today - week_end > datetime.timedelta(days=settings.LOGGER_WEEK_CACHE_HORIZON_DAYS):
+        return settings.LOGGER_WEEK_CACHE_OLD_TIMEOUT
+
+    return settings.LOGGER_WEEK_CACHE_TIMEOUT
+
+
+def get_week(datum, from_date):
+    if _timeout(from_date) is False:
+        return None
+    return cache.get(_week_key(datum.pk, from_date))
+
+
+def set_week(datum, from_date, html):
+    timeout = _timeout(from_date)
+    if timeout is not False:
+        cache.set(_week_key(datum.pk, from_date), html, timeout)
+
+
+def invalidate_day(datum_id, day):
+    cache.delete(_week_key(datum_id, monday_this_week(today=day)))
+
+
+def invalidate_datum(datum_id):
+    try:
+        cache.incr(_version_key(datum_id))
+    except ValueError:  # no version yet, so nothing is cached
+        pass
@@ -0,0 +1,48 @@
+"""
+A WSGI application for the ingest endpoints, for deployments that run ingest on WSGI workers of their own.
+
+It serves the routes of logger/ingest_app.py, like the ASGI application in logger/asgi.py, and answers everything
+else with a 404. Requests don't go through Django's handler, middleware or URL resolver.
+"""
+from http import HTTPStatus
+
+from django.conf import settings
+
+from .ingest_app import HttpError, bulk_log_values, call, log_value, query_key, route
+
+
+def _read_body(environ):
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise HttpError(400, "bad content length")
+    if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is not None and length > settings.DATA_UPLOAD_MAX_MEMORY_SIZE:
+        raise HttpError(413, "request body too large")
+    return environ['wsgi.input'].read(length) if length else b''
+
+
+class IngestWSGIApplication(object):
+    def __call__(self, environ, start_response):
+        content_type = "text/plain"
+        try:
+            # WSGI servers decode the path as latin-1, so like Django take it back to the UTF-8 it was sent in
+            path = environ.get('PATH_INFO', '/').encode('latin-1').decode('utf-8', 'replace')
+            match = route(environ['REQUEST_METHOD'], path)
+            if match.bulk:
+                body = _read_body(environ)
+                status, text = call(bulk_log_values, body, environ.get('CONTENT_TYPE', '').split(';')[0].strip())
+                content_type = "application/json"
+            else:
+                key = environ.get('HTTP_IDEMPOTENCY_KEY')
+                if key is None:
+                    key = query_key(environ.get('QUERY_STRING', ''))
+                status, text = call(log_value, match, key)
+        except HttpError as e:
+            status, text = e.status, str(e)
+
+        body = text.encode('utf-8')
+        start_response("{} {}".format(status, HTTPStatus(status).phrase), [
+            ('Content-Type', "{}; charset=utf-8".format(content_type)),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
@@ -0,0 +1,18 @@
+"""
+ASGI config for the ingest endpoints of logger_proj.
+
+It exposes the ASGI callable as a module-level variable named ``application``, serve it with any ASGI 3 server, eg.
+``uvicorn logger_proj.asgi:application``. Only log_value and bulk ingest are served, see logger/asgi.py, the rest of
+the site is served through logger_proj/wsgi.py.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "logger_proj.ingest_settings")
+django.setup()
+
+from logger.asgi import IngestApplication  # noqa: E402
+
+application = IngestApplication()
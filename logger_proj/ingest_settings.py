@@ -0,0 +1,15 @@
+"""
+Settings for the ingest-only applications, logger_proj/ingest_wsgi.py and logger_proj/asgi.py.
+
+They're the settings of the site without the apps and middleware that only the browser pages use, so ingest workers
+start faster. The ingest applications don't serve Django views, so there are no URLs either.
+"""
+from logger_proj.settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'logger.apps.LoggerConfig',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+]
+
+MIDDLEWARE = []
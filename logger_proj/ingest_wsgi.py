@@ -0,0 +1,18 @@
+"""
+WSGI config for the ingest endpoints of logger_proj.
+
+It exposes the WSGI callable as a module-level variable named ``application``, serve it with any WSGI server, eg.
+``gunicorn logger_proj.ingest_wsgi:application``, and route /-/ and the ingest URLs of devices to it. Only
+log_value and bulk ingest are served, see logger/wsgi.py, the rest of the site is served through logger_proj/wsgi.py.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "logger_proj.ingest_settings")
+django.setup()
+
+from logger.wsgi import IngestWSGIApplication  # noqa: E402
+
+application = IngestWSGIApplication()
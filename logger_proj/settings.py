@@ -86,9 +86,32 @@ else:  # this will be true on dev machines
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-        }
+        },
+        # a second connection to the same database, so the replica routing can be tried with LOGGER_DB_REPLICAS and
+        # is tested. The test database isn't created twice, the alias reads the primary's
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            'TEST': {'MIRROR': 'default'},
+        },
     }
 
+# seconds to keep database connections open for the next requests of a worker thread, rather than opening one per
+# request. Applies to every alias that doesn't set its own
+if config and hasattr(config, "CONN_MAX_AGE"):
+    for database in DATABASES.values():
+        database.setdefault('CONN_MAX_AGE', config.CONN_MAX_AGE)
+
+# aliases of DATABASES that the read-only views read the logger models from, and how long after a user's values were
+# saved their reads stay on the primary. See logger/routers.py
+DATABASE_ROUTERS = ['logger.routers.ReplicaRouter']
+LOGGER_DB_REPLICAS = []
+LOGGER_DB_READ_YOUR_WRITES_SECONDS = 10
+if config and hasattr(config, "LOGGER_DB_REPLICAS"):
+    LOGGER_DB_REPLICAS = config.LOGGER_DB_REPLICAS
+if config and hasattr(config, "LOGGER_DB_READ_YOUR_WRITES_SECONDS"):
+    LOGGER_DB_READ_YOUR_WRITES_SECONDS = config.LOGGER_DB_READ_YOUR_WRITES_SECONDS
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -108,6 +131,118 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+if config and hasattr(config, "CACHES"):
+    CACHES = config.CACHES
+else:  # local memory is per process, so use a shared cache when running several workers
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# rendered week tables of timestamp datums are cached for this many seconds, and for LOGGER_WEEK_CACHE_OLD_TIMEOUT
+# seconds once the week ended more than LOGGER_WEEK_CACHE_HORIZON_DAYS ago
+LOGGER_WEEK_CACHE_TIMEOUT = 60 * 60
+if config and hasattr(config, "LOGGER_WEEK_CACHE_TIMEOUT"):
+    LOGGER_WEEK_CACHE_TIMEOUT = config.LOGGER_WEEK_CACHE_TIMEOUT
+LOGGER_WEEK_CACHE_OLD_TIMEOUT = 24 * 60 * 60
+if config and hasattr(config, "LOGGER_WEEK_CACHE_OLD_TIMEOUT"):
+    LOGGER_WEEK_CACHE_OLD_TIMEOUT = config.LOGGER_WEEK_CACHE_OLD_TIMEOUT
+LOGGER_WEEK_CACHE_HORIZON_DAYS = 14
+if config and hasattr(config, "LOGGER_WEEK_CACHE_HORIZON_DAYS"):
+    LOGGER_WEEK_CACHE_HORIZON_DAYS = config.LOGGER_WEEK_CACHE_HORIZON_DAYS
+
+# write-behind buffer for ingested values: None to write directly, "memory" to queue in the process, or "file" to
+# queue in an fsync'd log that `manage.py flush_ingest_buffer` drains. See logger/buffer.py
+LOGGER_INGEST_BUFFER = None
+LOGGER_INGEST_BUFFER_PATH = os.path.join(BASE_DIR, "ingest_buffer.log")
+LOGGER_INGEST_BUFFER_SIZE = 500
+LOGGER_INGEST_BUFFER_DELAY = 1.0
+if config and hasattr(config, "LOGGER_INGEST_BUFFER"):
+    LOGGER_INGEST_BUFFER = config.LOGGER_INGEST_BUFFER
+if config and hasattr(config, "LOGGER_INGEST_BUFFER_PATH"):
+    LOGGER_INGEST_BUFFER_PATH = config.LOGGER_INGEST_BUFFER_PATH
+if config and hasattr(config, "LOGGER_INGEST_BUFFER_SIZE"):
+    LOGGER_INGEST_BUFFER_SIZE = config.LOGGER_INGEST_BUFFER_SIZE
+if config and hasattr(config, "LOGGER_INGEST_BUFFER_DELAY"):
+    LOGGER_INGEST_BUFFER_DELAY = config.LOGGER_INGEST_BUFFER_DELAY
+# flushes of a file of the "file" buffer that fail this many times set it aside as .failed
+LOGGER_INGEST_BUFFER_MAX_ATTEMPTS = 5
+if config and hasattr(config, "LOGGER_INGEST_BUFFER_MAX_ATTEMPTS"):
+    LOGGER_INGEST_BUFFER_MAX_ATTEMPTS = config.LOGGER_INGEST_BUFFER_MAX_ATTEMPTS
+
+# idempotency keys of ingested values are remembered for LOGGER_INGEST_KEY_CACHE_TTL seconds by each process, up to
+# LOGGER_INGEST_KEY_CACHE_SIZE of them, and kept in the database for LOGGER_INGEST_KEY_RETENTION_DAYS. See
+# logger/dedup.py
+LOGGER_INGEST_KEY_CACHE_SIZE = 10000
+LOGGER_INGEST_KEY_CACHE_TTL = 60 * 60
+LOGGER_INGEST_KEY_RETENTION_DAYS = 7
+if config and hasattr(config, "LOGGER_INGEST_KEY_CACHE_SIZE"):
+    LOGGER_INGEST_KEY_CACHE_SIZE = config.LOGGER_INGEST_KEY_CACHE_SIZE
+if config and hasattr(config, "LOGGER_INGEST_KEY_CACHE_TTL"):
+    LOGGER_INGEST_KEY_CACHE_TTL = config.LOGGER_INGEST_KEY_CACHE_TTL
+if config and hasattr(config, "LOGGER_INGEST_KEY_RETENTION_DAYS"):
+    LOGGER_INGEST_KEY_RETENTION_DAYS = config.LOGGER_INGEST_KEY_RETENTION_DAYS
+
+# datums are looked up by slug on every ingest request, so they're cached in each process for
+# LOGGER_DATUM_CACHE_TTL seconds, and in CACHES as well if LOGGER_DATUM_CACHE_SHARED. See logger/datum_cache.py
+LOGGER_DATUM_CACHE_SIZE = 1024
+LOGGER_DATUM_CACHE_TTL = 60
+LOGGER_DATUM_CACHE_SHARED = False
+if config and hasattr(config, "LOGGER_DATUM_CACHE_SIZE"):
+    LOGGER_DATUM_CACHE_SIZE = config.LOGGER_DATUM_CACHE_SIZE
+if config and hasattr(config, "LOGGER_DATUM_CACHE_TTL"):
+    LOGGER_DATUM_CACHE_TTL = config.LOGGER_DATUM_CACHE_TTL
+if config and hasattr(config, "LOGGER_DATUM_CACHE_SHARED"):
+    LOGGER_DATUM_CACHE_SHARED = config.LOGGER_DATUM_CACHE_SHARED
+
+# threads that run the ORM work of the ASGI ingest application, and how many requests may wait for one of them
+# before the application answers 503. See logger_proj/asgi.py
+LOGGER_ASGI_MAX_WORKERS = 8
+LOGGER_ASGI_MAX_PENDING = 1000
+if config and hasattr(config, "LOGGER_ASGI_MAX_WORKERS"):
+    LOGGER_ASGI_MAX_WORKERS = config.LOGGER_ASGI_MAX_WORKERS
+if config and hasattr(config, "LOGGER_ASGI_MAX_PENDING"):
+    LOGGER_ASGI_MAX_PENDING = config.LOGGER_ASGI_MAX_PENDING
+
+# the most points the series API returns per request, see logger/series.py
+LOGGER_SERIES_MAX_POINTS = 5000
+if config and hasattr(config, "LOGGER_SERIES_MAX_POINTS"):
+    LOGGER_SERIES_MAX_POINTS = config.LOGGER_SERIES_MAX_POINTS
+
+# per view query counts and latencies, logged and served at /metrics, see logger/metrics.py
+LOGGER_METRICS = False
+LOGGER_METRICS_MIDDLEWARE = True  # measure every view, otherwise only the ones decorated with metrics.instrumented
+if config and hasattr(config, "LOGGER_METRICS"):
+    LOGGER_METRICS = config.LOGGER_METRICS
+if config and hasattr(config, "LOGGER_METRICS_MIDDLEWARE"):
+    LOGGER_METRICS_MIDDLEWARE = config.LOGGER_METRICS_MIDDLEWARE
+if LOGGER_METRICS and LOGGER_METRICS_MIDDLEWARE:
+    MIDDLEWARE.insert(0, 'logger.metrics.MetricsMiddleware')
+
+# the feed of new values of a datum: "local" wakes the streams of the process that saved the values, "polling" also
+# looks for values saved by other processes every LOGGER_FEED_POLL_SECONDS. Streams are closed after
+# LOGGER_FEED_TIMEOUT seconds and clients reconnect. See logger/feed.py
+# Each open stream or long poll holds a worker of the site the whole time, so the feed needs threaded or async
+# workers, eg. gunicorn --worker-class gthread --threads 32. On sync workers a few clients block the whole site
+LOGGER_FEED_BROKER = "local"
+LOGGER_FEED_POLL_SECONDS = 2.0
+LOGGER_FEED_TIMEOUT = 300
+LOGGER_FEED_KEEPALIVE = 15
+LOGGER_FEED_RETRY_MILLISECONDS = 1000
+if config and hasattr(config, "LOGGER_FEED_BROKER"):
+    LOGGER_FEED_BROKER = config.LOGGER_FEED_BROKER
+if config and hasattr(config, "LOGGER_FEED_POLL_SECONDS"):
+    LOGGER_FEED_POLL_SECONDS = config.LOGGER_FEED_POLL_SECONDS
+if config and hasattr(config, "LOGGER_FEED_TIMEOUT"):
+    LOGGER_FEED_TIMEOUT = config.LOGGER_FEED_TIMEOUT
+if config and hasattr(config, "LOGGER_FEED_KEEPALIVE"):
+    LOGGER_FEED_KEEPALIVE = config.LOGGER_FEED_KEEPALIVE
+if config and hasattr(config, "LOGGER_FEED_RETRY_MILLISECONDS"):
+    LOGGER_FEED_RETRY_MILLISECONDS = config.LOGGER_FEED_RETRY_MILLISECONDS
+
 # login stuff
 LOGIN_URL = "user_login"
 LOGIN_REDIRECT_URL = "index"